@@ -0,0 +1,466 @@
+"""
+Benchmarks for DAG operations on synthetic graphs.
+
+Graphs are generated in layers with a configurable size, fan-in, fan-out,
+depth and diamond density, and loaded into an in-process fake of the
+Google spreadsheet. The fake mimics the gspread worksheet methods the
+Sheets backend uses, counts every call and can add a fixed latency to
+each one, so the real backend, cache and scheduler code is exercised
+without network access.
+
+Usage:
+
+    python3 bench.py                          # 10 to 100k nodes
+    python3 bench.py --sizes 10 1000 --latency 0.05
+    python3 bench.py --save-baseline          # store new reference numbers
+
+Results are compared with ``bench_baseline.json``. Each time is the
+median of several runs. An operation counts as a regression when it makes
+more API calls than the baseline, or takes longer than the baseline by
+more than the threshold; the exit status is 1 if any regression is found,
+or if an operation has no baseline entry yet (run with --save-baseline
+after adding one).
+"""
+import argparse
+import builtins
+import collections
+import contextlib
+import copy
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import types
+
+from run import DAG
+from scheduler import RequestScheduler
+from storage import FIELDS, SheetsBackend
+
+SIZES = (10, 100, 1000, 10000, 100000)
+OPERATIONS = ('add_node', 'update_node', 'delete_items', 'sync',
+              'visualize_simple_graph', 'critical_paths',
+              'calculate_outcome_probabilities_and_severities')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'bench_baseline.json')
+# Allowed slowdown of the median time; run-to-run noise alone reaches 25%
+THRESHOLD = 0.5
+REPEAT = 5
+# Timings below this are too noisy to call a regression
+MIN_SECONDS = 0.01
+
+
+def generate_graph(size, depth=6, fan_in=2, fan_out=4, diamonds=0.3,
+                   outcome_ratio=0.1, seed=0):
+    """
+    Generate node and outcome rows for a layered random DAG.
+
+    ``size`` nodes are spread over ``depth`` layers. Each node below the
+    first layer has 1 to ``fan_in`` causes in the layer above, preferring
+    nodes with fewer than ``fan_out`` effects. With probability
+    ``diamonds`` the causes are picked among the effects of one node two
+    layers up, so paths split and join again. Outcomes are caused by
+    nodes in the last layer. Returns (node rows, outcome rows) in
+    worksheet column order, with ids 1 to size + outcomes.
+    """
+    rng = random.Random(seed)
+    depth = max(1, min(depth, size))
+    layers = []
+    start = 1
+    for layer in range(depth):
+        width = size // depth + (layer < size % depth)
+        layers.append(list(range(start, start + width)))
+        start += width
+
+    parents = collections.defaultdict(list)
+    children = collections.defaultdict(list)
+
+    def pick(candidates):
+        # A few tries for a cause that still has room for another effect
+        for _ in range(3):
+            parent_id = rng.choice(candidates)
+            if len(children[parent_id]) < fan_out:
+                return parent_id
+        return parent_id
+
+    for layer in range(1, depth):
+        for node_id in layers[layer]:
+            count = rng.randint(1, fan_in)
+            candidates = layers[layer - 1]
+            if layer > 1 and rng.random() < diamonds:
+                grandparent_id = rng.choice(layers[layer - 2])
+                candidates = children[grandparent_id] or candidates
+            for parent_id in {pick(candidates) for _ in range(count)}:
+                parents[node_id].append(parent_id)
+                children[parent_id].append(node_id)
+
+    outcome_ids = range(start, start + max(1, int(size * outcome_ratio)))
+    for outcome_id in outcome_ids:
+        for parent_id in {rng.choice(layers[-1])
+                          for _ in range(rng.randint(1, fan_in))}:
+            parents[outcome_id].append(parent_id)
+            children[parent_id].append(outcome_id)
+
+    def links(ids):
+        return ', '.join(map(str, sorted(ids)))
+
+    nodes = [
+        [node_id, f"Cause {node_id}", f"Synthetic cause {node_id}",
+         links(parents[node_id]), links(children[node_id]),
+         rng.randint(1, 100), rng.randint(1, 10)]
+        for layer in layers for node_id in layer
+    ]
+    outcomes = [
+        [outcome_id, f"Outcome {outcome_id}", f"Synthetic outcome "
+         f"{outcome_id}", links(parents[outcome_id]), '', '']
+        for outcome_id in outcome_ids
+    ]
+    return nodes, outcomes
+
+
+class FakeWorksheet:
+    """In-memory stand-in for a gspread worksheet."""
+
+    def __init__(self, spreadsheet, sheet_id, title, rows):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.rows = rows
+
+    def _request(self, method, write=False):
+        self.spreadsheet._request(method, write)
+
+    def _set(self, cell_range, values):
+        match = re.match(r'([A-Z]+)(\d+)', cell_range)
+        column = 0
+        for letter in match.group(1):
+            column = column * 26 + ord(letter) - 64
+        for row_offset, row_values in enumerate(values):
+            row = self.rows[int(match.group(2)) - 1 + row_offset]
+            for column_offset, value in enumerate(row_values):
+                index = column - 1 + column_offset
+                row.extend([''] * (index + 1 - len(row)))
+                row[index] = value
+
+    def get_all_records(self):
+        self._request('get_all_records')
+        header = self.rows[0]
+        return [dict(zip(header, row + [''] * (len(header) - len(row))))
+                for row in self.rows[1:]]
+
+    def get_all_values(self):
+        self._request('get_all_values')
+        return [list(row) for row in self.rows]
+
+    def col_values(self, column):
+        self._request('col_values')
+        return [str(row[column - 1]) for row in self.rows
+                if len(row) >= column]
+
+    def update(self, cell_range, values):
+        self._request('update', write=True)
+        self._set(cell_range, values)
+
+    def batch_update(self, data):
+        self._request('batch_update', write=True)
+        for item in data:
+            self._set(item['range'], item['values'])
+
+    def append_row(self, row):
+        self._request('append_row', write=True)
+        self.rows.append(list(row))
+
+    def append_rows(self, rows):
+        self._request('append_rows', write=True)
+        self.rows.extend(list(row) for row in rows)
+
+    def delete_rows(self, start, end=None):
+        self._request('delete_rows', write=True)
+        del self.rows[start - 1:end or start]
+
+
+class FakeSpreadsheet:
+    """
+    In-memory stand-in for the "dag-tui" spreadsheet.
+
+    It also acts as its own gspread client, answering the Drive request
+    for the file version, which goes up with every write.
+    """
+
+    def __init__(self, nodes, outcomes, latency=0.0):
+        self.id = 'fake'
+        self.client = self
+        self.calls = collections.Counter()
+        self.latency = latency
+        self.version = 1
+        last_id = max((row[0] for row in nodes + outcomes), default=0)
+        tables = {
+            'nodes': [FIELDS['nodes']] + nodes,
+            'outcomes': [FIELDS['outcomes']] + outcomes,
+            # The generated ids count as one lease, as if the app made them
+            'ids': [['start', 'count', 'session']],
+        }
+        if last_id:
+            tables['ids'].append([1, last_id, 'bench'])
+        self._worksheets = {
+            title: FakeWorksheet(self, sheet_id, title, rows)
+            for sheet_id, (title, rows) in enumerate(tables.items())
+        }
+
+    def _request(self, method, write=False):
+        self.calls[method] += 1
+        if write:
+            self.version += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def worksheets(self):
+        return list(self._worksheets.values())
+
+    def worksheet(self, title):
+        return self._worksheets[title]
+
+    def request(self, method, url, params=None):
+        self._request('files_get')
+        version = str(self.version)
+        return types.SimpleNamespace(json=lambda: {'version': version})
+
+    def values_batch_get(self, ranges):
+        self._request('values_batch_get')
+        return {'valueRanges': [
+            {'range': title,
+             'values': [[str(value) for value in row]
+                        for row in self._worksheets[title].rows]}
+            for title in ranges
+        ]}
+
+    def batch_update(self, body):
+        self._request('spreadsheet_batch_update', write=True)
+        by_id = {sheet.id: sheet for sheet in self._worksheets.values()}
+        for request in body['requests']:
+            cells = request['deleteDimension']['range']
+            del by_id[cells['sheetId']].rows[cells['startIndex']:
+                                             cells['endIndex']]
+
+
+class FakeSheetsBackend(SheetsBackend):
+    """
+    Sheets backend connected to a FakeSpreadsheet.
+
+    Quotas are lifted so the benchmark measures the application rather
+    than the rate limit.
+    """
+
+    def __init__(self, nodes, outcomes, latency=0.0):
+        super().__init__(token_cache=None)
+        self.fake = FakeSpreadsheet(nodes, outcomes, latency)
+        self.scheduler = RequestScheduler(read_quota=10 ** 9,
+                                          write_quota=10 ** 9)
+
+    @property
+    def calls(self):
+        return self.fake.calls
+
+    def connect(self):
+        self.sheet = self.fake
+        self._worksheets = {table: self.fake.worksheet(table)
+                            for table in FIELDS}
+        self._id_sheet = self.fake.worksheet('ids')
+        self.connect_seconds = 0.0
+
+
+@contextlib.contextmanager
+def scripted_input(answers):
+    """Answer input() prompts from a list instead of the keyboard."""
+    answers = iter(answers)
+    original = builtins.input
+    builtins.input = lambda prompt='': next(answers)
+    try:
+        yield
+    finally:
+        builtins.input = original
+
+
+def run_operation(name, dag, nodes, outcomes):
+    """Run one benchmarked operation against a loaded DAG."""
+    if name == 'add_node':
+        with scripted_input(['Benchmark cause', 'Added by bench.py',
+                             str(nodes[-1][0]), str(outcomes[0][0]),
+                             '50', '5', 'yes']):
+            dag.add_node()
+    elif name == 'update_node':
+        # A first-layer node, so the change reaches the most outcomes
+        dag.update_node(nodes[0][0], probability=75)
+    elif name == 'sync':
+        # Another session changes one probability behind our back
+        fake = dag.backend.fake
+        fake.worksheet('nodes').rows[1][5] = 42
+        fake.version += 1
+        dag.sync(force=True)
+    elif name == 'delete_items':
+        # Two first-layer nodes and an outcome, spread over both sheets
+        dag.delete_items([nodes[0][0], nodes[-1][0], outcomes[0][0]])
+    else:
+        getattr(dag, name)()
+
+
+def measure(name, nodes, outcomes, latency=0.0, repeat=REPEAT):
+    """
+    Time an operation on fresh copies of a graph.
+
+    The snapshot and index are loaded before the clock starts, as they
+    are in a running session. Returns the median wall time and the API
+    calls made by the operation. Calls are those of the run making the
+    fewest: a revision read is reused for a second, so slow runs can
+    make an extra request.
+    """
+    times = []
+    result = None
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            backend = FakeSheetsBackend(copy.deepcopy(nodes),
+                                        copy.deepcopy(outcomes), latency)
+            dag = DAG(backend, cache_ttl=-1)
+            dag.index
+            dag.order
+            backend.calls.clear()
+
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(devnull):
+                run_operation(name, dag, nodes, outcomes)
+            times.append(time.perf_counter() - started)
+            calls = sum(backend.calls.values())
+            if result is None or calls < result['calls']:
+                result = {'calls': calls, 'by_method': dict(backend.calls)}
+    result['seconds'] = round(statistics.median(times), 6)
+    return result
+
+
+def run_benchmarks(sizes=SIZES, operations=OPERATIONS, latency=0.0,
+                   repeat=REPEAT, seed=0, **graph_options):
+    """Return {size: {operation: result}} for every combination."""
+    results = {}
+    for size in sizes:
+        nodes, outcomes = generate_graph(size, seed=seed, **graph_options)
+        results[str(size)] = {}
+        for name in operations:
+            result = measure(name, nodes, outcomes, latency, repeat)
+            results[str(size)][name] = result
+            print(f"{size:>7} nodes  {name:<48} "
+                  f"{result['seconds'] * 1000:>10.2f} ms "
+                  f"{result['calls']:>5} calls", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Return (size, operation, reason) for every regression found."""
+    regressions = []
+    for size, operations in results.items():
+        for name, result in operations.items():
+            reference = baseline.get(size, {}).get(name)
+            if reference is None:
+                if baseline:
+                    regressions.append((size, name, "no baseline entry"))
+                continue
+            if result['calls'] > reference['calls']:
+                regressions.append((size, name, (
+                    f"{result['calls']} API calls, baseline "
+                    f"{reference['calls']}"
+                )))
+            limit = reference['seconds'] * (1 + threshold)
+            if result['seconds'] > max(limit, MIN_SECONDS):
+                regressions.append((size, name, (
+                    f"{result['seconds'] * 1000:.2f} ms, baseline "
+                    f"{reference['seconds'] * 1000:.2f} ms"
+                )))
+    return regressions
+
+
+def report(results, baseline):
+    """Format results as a table, with the change from the baseline."""
+    lines = [f"{'nodes':>7}  {'operation':<48} {'time':>12} {'calls':>6} "
+             f"{'vs baseline':>12}"]
+    for size, operations in results.items():
+        for name, result in operations.items():
+            reference = baseline.get(size, {}).get(name)
+            change = ''
+            if reference and reference['seconds']:
+                change = f"{result['seconds'] / reference['seconds'] - 1:+.0%}"
+            lines.append(
+                f"{size:>7}  {name:<48} "
+                f"{result['seconds'] * 1000:>9.2f} ms {result['calls']:>6} "
+                f"{change:>12}"
+            )
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Benchmark DAG operations")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help="node counts to benchmark")
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS,
+                        default=OPERATIONS, help="operations to benchmark")
+    parser.add_argument('--depth', type=int, default=6,
+                        help="layers of nodes (default: 6)")
+    parser.add_argument('--fan-in', type=int, default=2,
+                        help="maximum causes per node (default: 2)")
+    parser.add_argument('--fan-out', type=int, default=4,
+                        help="preferred maximum effects per node "
+                             "(default: 4)")
+    parser.add_argument('--diamonds', type=float, default=0.3,
+                        help="share of nodes closing a diamond "
+                             "(default: 0.3)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every API call")
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help="runs per measurement, the median is kept "
+                             "(default: 5)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE,
+                        help="baseline file (default: bench_baseline.json)")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store these results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="allowed slowdown before a regression is "
+                             "reported (default: 0.5)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(
+        args.sizes, args.operations, args.latency, args.repeat, args.seed,
+        depth=args.depth, fan_in=args.fan_in, fan_out=args.fan_out,
+        diamonds=args.diamonds
+    )
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print(report(results, baseline))
+
+    if args.save_baseline:
+        for size, operations in results.items():
+            baseline.setdefault(size, {}).update(operations)
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("\nRegressions:")
+        for size, name, reason in regressions:
+            print(f"  {name} at {size} nodes: {reason}")
+        return 1
+    print("\nNo regressions." if baseline else "\nNo baseline to compare.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
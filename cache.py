@@ -0,0 +1,386 @@
+"""
+Record cache, write batching and id allocation over a storage backend.
+
+The terminal UI and the shared server each keep one RecordCache of the
+nodes and outcomes worksheets. The UI also batches its writes with
+WriteTransaction and draws new ids from an IdAllocator.
+"""
+import contextlib
+import os
+import time
+
+from graph import Record, to_id
+from storage import FIELDS
+
+# Seconds a fetched worksheet snapshot stays fresh before it is re-read
+CACHE_TTL = float(os.environ.get('DAG_CACHE_TTL', 30))
+
+# Number of ids reserved from the backend at a time
+ID_BLOCK_SIZE = int(os.environ.get('DAG_ID_BLOCK_SIZE', 20))
+
+
+class RecordCache:
+    """
+    Read-through, versioned snapshot of the nodes and outcomes worksheets.
+
+    Records are fetched once per worksheet and served from memory. When
+    a snapshot is older than the TTL, or on ``sync``, the backend is
+    asked what changed since the snapshot's revision and only those
+    records are applied; backends that cannot tell are refetched. Writes
+    made by this process are applied to the snapshot directly so they
+    never trigger a refetch. Every change bumps ``version``; a sync or
+    refetch returning identical records does not. Rows are parsed into
+    compact typed Records once, when they are fetched or written.
+
+    Listeners are told about every change: ``reset(name)`` when a
+    snapshot is replaced or dropped, ``upsert(name, record)`` after a
+    record is added or changed and ``remove(name, record)`` after one is
+    deleted.
+    """
+
+    # Past this share of a table, listeners are reset rather than told
+    # about each changed record, as rebuilding is then cheaper
+    RESET_SHARE = 0.25
+
+    # Seconds a revision read by a sync or write is trusted as the
+    # starting point of the next local write, saving a request
+    REVISION_REUSE = 1.0
+
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.version = 0
+        self.fetches = 0
+        self.syncs = 0
+        self._records = {}
+        self._fetched_at = {}
+        self._revisions = {}
+        self._last_revision = (None, float('-inf'))
+        self.listeners = []
+
+    def notify(self, event, name, *args):
+        """Tell every listener about a change to a worksheet."""
+        for listener in self.listeners:
+            getattr(listener, event)(name, *args)
+
+    def is_stale(self, name):
+        """Return True if the named snapshot must be checked or fetched."""
+        if name not in self._records:
+            return True
+        if self.ttl is None or self.ttl < 0:
+            return False
+        return time.monotonic() - self._fetched_at[name] > self.ttl
+
+    def get(self, name):
+        """Return the records of a worksheet, fetching them if stale."""
+        if self.is_stale(name) and name in self._records:
+            self.sync([name])
+        if self.is_stale(name):
+            self.fetch(name)
+        return self._records[name]
+
+    def fetch(self, name):
+        """Download a worksheet and replace its snapshot."""
+        # Read the revision first: a write landing in between is then
+        # seen as a newer revision by the next sync
+        revision = self.backend.revision()
+        rows = self.backend.get_records(name)
+        self._revisions[name] = revision
+        self._fetched_at[name] = time.monotonic()
+        self.fetches += 1
+        self.replace(name, rows)
+
+    def replace(self, name, rows):
+        """Replace a snapshot with a whole table, keeping its listeners."""
+        records = [Record(FIELDS[name], row) for row in rows]
+        old = self._records.get(name)
+        if records == old:
+            return
+        self.version += 1
+        if old is None:
+            self._records[name] = records
+            self.notify('reset', name)
+            return
+
+        # Listeners may hold on to the list, so replace it in place
+        removed = {record.id: record for record in old}
+        old[:] = records
+        changed = []
+        for record in records:
+            if removed.pop(record.id, None) != record:
+                changed.append(record)
+        self.notify_changes(name, changed, list(removed.values()))
+
+    def apply(self, name, rows, deleted_ids):
+        """
+        Apply changed rows and deleted ids reported by the backend.
+
+        Changed records keep their position and new ones are appended,
+        as in the worksheet. ``deleted_ids`` None means ``rows`` is the
+        whole table.
+        """
+        if deleted_ids is None:
+            self.replace(name, rows)
+            return
+        records = self._records[name]
+        positions = {record.id: i for i, record in enumerate(records)}
+        changed = []
+        for row in rows:
+            record = Record(FIELDS[name], row)
+            position = positions.get(record.id)
+            if position is None:
+                positions[record.id] = len(records)
+                records.append(record)
+            elif records[position] == record:
+                continue
+            else:
+                records[position] = record
+            changed.append(record)
+
+        deleted = {to_id(item_id) for item_id in deleted_ids}
+        removed = [record for record in records if record.id in deleted]
+        if removed:
+            records[:] = [record for record in records
+                          if record.id not in deleted]
+        if changed or removed:
+            self.version += 1
+            self.notify_changes(name, changed, removed)
+
+    def notify_changes(self, name, changed, removed):
+        """Tell listeners about changed and removed records of a table."""
+        if len(changed) + len(removed) > \
+                self.RESET_SHARE * len(self._records[name]):
+            self.notify('reset', name)
+            return
+        for record in removed:
+            self.notify('remove', name, record)
+        for record in changed:
+            self.notify('upsert', name, record)
+
+    def sync(self, names=None):
+        """
+        Apply what other sessions changed since the snapshots were taken.
+
+        Snapshots whose changes the backend cannot list are dropped and
+        refetched on next use. Backends without revisions are left to
+        the TTL. Every snapshot an answer covers is brought up to date
+        with it, named or not: those taken at the same revision, and
+        those the backend sent whole.
+        """
+        groups = {}
+        for name in names or list(self._records):
+            if name in self._records:
+                groups.setdefault(self._revisions.get(name), []).append(name)
+
+        done = set()
+        for since, group in groups.items():
+            group = [name for name in group if name not in done]
+            if not group:
+                continue
+            revision, changes = self.backend.changes(since)
+            if revision is None:
+                continue
+            self._last_revision = (revision, time.monotonic())
+            if changes is not None:
+                group += [
+                    name for name in self._records
+                    if name not in group and name not in done and (
+                        self._revisions.get(name) == since
+                        or name in changes and changes[name][1] is None
+                    )
+                ]
+            done.update(group)
+            for name in group:
+                if changes is None:
+                    self._records.pop(name)
+                    self._fetched_at.pop(name)
+                    self.version += 1
+                    self.notify('reset', name)
+                    continue
+                if name in changes:
+                    version = self.version
+                    self.apply(name, *changes[name])
+                    self.syncs += self.version != version
+                self._revisions[name] = revision
+                self._fetched_at[name] = time.monotonic()
+
+    @contextlib.contextmanager
+    def writing(self):
+        """
+        Wrap writes this process makes to the backend.
+
+        The writes are applied to the snapshots directly, so a later
+        sync reading them back is wasted work. Where that means
+        downloading whole worksheets (``backend.quota_limited``), the
+        revision is read before and after the writes, and snapshots that
+        were current before move to the revision after. A revision read
+        less than REVISION_REUSE seconds ago is used as the one before.
+        A write by another session landing in that window is then only
+        picked up with the next change after it, or by "Refresh data".
+        """
+        if not (self._records and self.backend.quota_limited):
+            yield
+            return
+        before, read_at = self._last_revision
+        if time.monotonic() - read_at > self.REVISION_REUSE:
+            before = self.backend.revision()
+        yield
+        after = self.backend.revision()
+        self._last_revision = (after, time.monotonic())
+        for name in self._records:
+            if self._revisions.get(name) == before:
+                self._revisions[name] = after
+
+    def refresh(self, name=None):
+        """Explicitly refetch one worksheet, or all of them."""
+        for sheet_name in [name] if name else list(FIELDS):
+            self.fetch(sheet_name)
+
+    def invalidate(self, name=None):
+        """Drop one or all snapshots so the next read refetches."""
+        self.version += 1
+        for sheet_name in [name] if name else list(self._records):
+            self._records.pop(sheet_name, None)
+            self._fetched_at.pop(sheet_name, None)
+            self.notify('reset', sheet_name)
+
+    def update_record(self, name, row_index, fields):
+        """Apply a local write of ``fields`` to the record at a sheet row."""
+        if name in self._records:
+            record = self._records[name][row_index - 2]
+            record.update(fields)
+            self.version += 1
+            self.notify('upsert', name, record)
+
+    def append_record(self, name, record):
+        """Apply a locally appended row to the snapshot."""
+        if name in self._records:
+            record = Record(FIELDS[name], record)
+            self._records[name].append(record)
+            self.version += 1
+            self.notify('upsert', name, record)
+
+    def delete_record(self, name, row_index):
+        """Apply a locally deleted row to the snapshot."""
+        if name in self._records:
+            record = self._records[name].pop(row_index - 2)
+            self.version += 1
+            self.notify('remove', name, record)
+
+
+class WriteTransaction:
+    """
+    Buffer of pending worksheet writes, sent in as few requests as possible.
+
+    Cell changes are collected per worksheet and sent as a single
+    ``update_cells`` call on commit (one ``batch_update`` on Google
+    Sheets); appended rows are sent with one ``append_rows`` call. The
+    cache is only updated once the requests succeed, and a failed commit
+    invalidates the affected snapshots so the next read reflects what
+    actually reached the storage backend.
+    """
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+        self._cells = {}
+        self._appends = {}
+
+    def __len__(self):
+        return (sum(len(cells) for cells in self._cells.values()) +
+                sum(len(rows) for rows in self._appends.values()))
+
+    def update(self, name, row_index, fields):
+        """Queue new values for several fields of the record at a row."""
+        cells = self._cells.setdefault(name, {})
+        for field, value in fields.items():
+            cells[(row_index, field)] = value
+
+    def append(self, name, record):
+        """Queue a new record to be appended to a worksheet."""
+        self._appends.setdefault(name, []).append(record)
+
+    def rollback(self):
+        """Discard all pending writes."""
+        self._cells.clear()
+        self._appends.clear()
+
+    def commit(self):
+        """Send all pending writes and apply them to the cache."""
+        if not self:
+            return
+        try:
+            with self.cache.writing():
+                for name, cells in self._cells.items():
+                    if not cells:
+                        continue
+                    records = self.cache.get(name)
+                    id_field = FIELDS[name][0]
+                    self.backend.update_cells(name, [
+                        (row, records[row - 2][id_field], field, value)
+                        for (row, field), value in cells.items()
+                    ])
+                for name, records in self._appends.items():
+                    if not records:
+                        continue
+                    self.backend.append_rows(name, [
+                        [record.get(field, '') for field in FIELDS[name]]
+                        for record in records
+                    ])
+        except Exception:
+            # Part of the batch may have been written; re-read on next use
+            for name in set(self._cells) | set(self._appends):
+                self.cache.invalidate(name)
+            self.rollback()
+            raise
+
+        for name, cells in self._cells.items():
+            # One update, and one listener notification, per record
+            records = {}
+            for (row, field), value in cells.items():
+                records.setdefault(row, {})[field] = value
+            for row, fields in records.items():
+                self.cache.update_record(name, row, fields)
+        for name, records in self._appends.items():
+            for record in records:
+                self.cache.append_record(name, {
+                    field: record.get(field, '')
+                    for field in FIELDS[name]
+                })
+        self.rollback()
+
+
+class IdAllocator:
+    """
+    Hands out ids that are unique in the graph and across sessions.
+
+    Ranges of ids are leased from the storage backend a block at a time,
+    so concurrent sessions never draw from the same range. Ids already
+    used in the graph (for example older randomly generated ones) are
+    skipped with an O(1) lookup in the graph index.
+    """
+
+    def __init__(self, backend, exists, block_size=ID_BLOCK_SIZE):
+        self.backend = backend
+        self.exists = exists
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+
+    def reserve(self, count, exclude=()):
+        """Return ``count`` unused ids, leasing a larger block if needed."""
+        ids = []
+        while len(ids) < count:
+            if self._next >= self._end:
+                size = max(count - len(ids), self.block_size)
+                self._next = self.backend.reserve_ids(size)
+                self._end = self._next + size
+            item_id = self._next
+            self._next += 1
+            if not self.exists(item_id) and item_id not in exclude:
+                ids.append(item_id)
+        return ids
+
+    def next_id(self):
+        """Return a single unused id."""
+        return self.reserve(1)[0]
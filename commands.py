@@ -0,0 +1,438 @@
+"""
+Headless commands for scripted changes to the graph.
+
+Commands can be given on the command line or as a script, one per line,
+read from a file or stdin:
+
+    python3 run.py add node --title "Power cut" --causes 12 --as power
+    python3 run.py batch changes.txt
+    printf 'link 3 12\\nrecompute\\n' | python3 run.py batch
+
+Script lines use the same syntax without ``run.py``; blank lines and
+lines starting with ``#`` are skipped. ``add --as NAME`` names the new
+item so later commands can refer to it as ``@NAME``.
+
+All commands in one run form a single batch. They are applied to a
+working copy of the graph, the result is validated once (every link
+must resolve and no cycle may be added) and the changes are saved in one
+transaction, so a script of thousands of edits costs a handful of
+requests. If any command fails nothing is saved. Outcomes affected by
+the changes are recalculated once at the end.
+"""
+import argparse
+import contextlib
+import os
+import shlex
+import sys
+
+from graph import GraphIndex, parse_ids, to_id, topological_order
+from storage import FIELDS, MissingRecordError, RemoteError
+
+
+class CommandError(ValueError):
+    """Raised for a command that cannot be applied."""
+
+
+class CommandParser(argparse.ArgumentParser):
+    """Argument parser raising CommandError instead of exiting."""
+
+    def error(self, message):
+        raise CommandError(message)
+
+
+def add_command_parsers(subparsers):
+    """Add the headless commands to an argparse subparsers object."""
+    def add_fields(parser):
+        parser.add_argument('--title')
+        parser.add_argument('--description')
+        parser.add_argument('--caused-by', dest='causedBy',
+                            help="comma-separated IDs of the causes")
+        parser.add_argument('--causes',
+                            help="comma-separated IDs of the effects")
+        parser.add_argument('--probability', type=int,
+                            help="probability from 1 to 100")
+        parser.add_argument('--severity', type=int,
+                            help="severity from 1 to 10")
+
+    add = subparsers.add_parser('add', help="add a node or outcome")
+    add.add_argument('kind', choices=('node', 'outcome'))
+    add_fields(add)
+    add.add_argument('--as', dest='name', metavar='NAME',
+                     help="name the new item @NAME for later commands")
+
+    update = subparsers.add_parser('update',
+                                   help="change fields of a node or outcome")
+    update.add_argument('item_id', metavar='ID')
+    add_fields(update)
+
+    delete = subparsers.add_parser(
+        'delete', help="delete nodes or outcomes and the links to them"
+    )
+    delete.add_argument('item_ids', metavar='ID', nargs='+')
+
+    for name, action in (('link', 'add'), ('unlink', 'remove')):
+        link = subparsers.add_parser(
+            name, help=f"{action} a cause -> effect link"
+        )
+        link.add_argument('cause_id', metavar='CAUSE')
+        link.add_argument('effect_id', metavar='EFFECT')
+
+    subparsers.add_parser('recompute', help="recalculate every outcome")
+
+    batch = subparsers.add_parser(
+        'batch', help="run commands from a file, one per line"
+    )
+    batch.add_argument('path', nargs='?', default='-',
+                       help="script file (default: stdin)")
+
+
+def command_parser():
+    """Return a parser for single script lines."""
+    parser = CommandParser(prog='', add_help=False)
+    add_command_parsers(parser.add_subparsers(dest='command',
+                                              parser_class=CommandParser))
+    return parser
+
+
+def parse_script(lines):
+    """Parse script lines into (line number, args) pairs."""
+    parser = command_parser()
+    commands = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            args = parser.parse_args(shlex.split(line))
+        except (CommandError, ValueError) as error:
+            raise CommandError(f"line {line_number}: {error}")
+        if args.command in (None, 'batch'):
+            raise CommandError(f"line {line_number}: expected a command")
+        commands.append((line_number, args))
+    return commands
+
+
+def read_script(path):
+    """Parse a command script from a file, or stdin if path is '-'."""
+    if path == '-':
+        return parse_script(sys.stdin)
+    with open(path, encoding='utf-8') as file:
+        return parse_script(file)
+
+
+class Batch:
+    """
+    Working copy of the graph edited by a run of commands.
+
+    Only the records a command touches are copied. Nothing is written
+    until ``save``, which validates the final graph and sends every
+    change together.
+    """
+
+    def __init__(self, dag):
+        self.dag = dag
+        self.index = dag.index
+        self.changed = {}
+        self.added = {}
+        self.deleted = {}
+        self.names = {}
+        self.recompute_all = False
+
+    def resolve(self, label):
+        """Return the id an argument refers to: a number or ``@NAME``."""
+        label = str(label).strip()
+        if label.startswith('@'):
+            if label[1:] not in self.names:
+                raise CommandError(f"Unknown name {label}")
+            return self.names[label[1:]]
+        item_id = to_id(label)
+        if item_id is None:
+            raise CommandError(f"Invalid ID '{label}'")
+        return item_id
+
+    def resolve_links(self, value):
+        """Rewrite a comma-separated list of ids and names to ids."""
+        return ', '.join(
+            str(self.resolve(token)) for token in str(value).split(',')
+            if token.strip()
+        )
+
+    def record(self, item_id):
+        """Return (table, working record) for an id."""
+        if item_id in self.deleted:
+            raise CommandError(f"ID {item_id} was deleted")
+        if item_id in self.added:
+            return self.added[item_id]
+        if item_id not in self.changed:
+            if item_id in self.index.nodes:
+                source = ('nodes', self.index.nodes[item_id])
+            elif item_id in self.index.outcomes:
+                source = ('outcomes', self.index.outcomes[item_id])
+            else:
+                raise CommandError(f"No node or outcome with ID {item_id}")
+            self.changed[item_id] = (source[0], dict(source[1]))
+        return self.changed[item_id]
+
+    def set_fields(self, table, record, args):
+        """Copy the field options given to a command into a record."""
+        if table == 'outcomes' and args.causes is not None:
+            raise CommandError("Outcomes cannot cause other items")
+        for field in FIELDS[table][1:]:
+            value = getattr(args, field, None)
+            if value is None:
+                continue
+            if field == 'probability' and not 1 <= value <= 100:
+                raise CommandError("Probability must be between 1 and 100")
+            if field == 'severity' and not 1 <= value <= 10:
+                raise CommandError("Severity must be between 1 and 10")
+            if field in ('causedBy', 'causes'):
+                value = self.resolve_links(value)
+            record[field] = value
+
+    def link_outcomes(self, item_id, record):
+        """Record links from a node to outcomes on the outcome side too."""
+        for child_id in parse_ids(record.get('causes', '')):
+            if child_id in self.index.outcomes or child_id in self.added:
+                table, outcome = self.record(child_id)
+                if table != 'outcomes':
+                    continue
+                caused_by = parse_ids(outcome.get('causedBy', ''))
+                if item_id not in caused_by:
+                    outcome['causedBy'] = ', '.join(
+                        map(str, caused_by + [item_id])
+                    )
+
+    def add(self, args, item_id):
+        if not args.title:
+            raise CommandError("A title is required")
+        table = f'{args.kind}s'
+        record = {field: '' for field in FIELDS[table]}
+        record[FIELDS[table][0]] = item_id
+        self.set_fields(table, record, args)
+        self.added[item_id] = (table, record)
+        self.link_outcomes(item_id, record)
+        if args.name:
+            self.names[args.name] = item_id
+        return f"Added {args.kind} {item_id}: {args.title}"
+
+    def drop_links(self, item_id, record, args):
+        """Remove links an update dropped from the other side too."""
+        candidates = (set(self.index.parents.get(item_id, ())) |
+                      set(self.index.children.get(item_id, ())) |
+                      set(self.added) | set(self.changed))
+        for field, other_field in (('causedBy', 'causes'),
+                                   ('causes', 'causedBy')):
+            if getattr(args, field, None) is None:
+                continue
+            kept = set(parse_ids(record.get(field, '')))
+            for other_id in candidates - kept:
+                if other_id == item_id or other_id in self.deleted or \
+                        not (self.index.exists(other_id) or
+                             other_id in self.added):
+                    continue
+                entry = self.added.get(other_id) or \
+                    self.changed.get(other_id)
+                other = entry[1] if entry else \
+                    self.index.nodes.get(other_id) or \
+                    self.index.outcomes[other_id]
+                ids = parse_ids(other.get(other_field, ''))
+                if item_id in ids:
+                    _, other = self.record(other_id)
+                    other[other_field] = ', '.join(
+                        str(i) for i in ids if i != item_id
+                    )
+
+    def update(self, args):
+        item_id = self.resolve(args.item_id)
+        table, record = self.record(item_id)
+        self.set_fields(table, record, args)
+        self.drop_links(item_id, record, args)
+        self.link_outcomes(item_id, record)
+        return f"Updated {table[:-1]} {item_id}"
+
+    def link(self, args, linked=True):
+        cause_id = self.resolve(args.cause_id)
+        effect_id = self.resolve(args.effect_id)
+        cause_table, cause = self.record(cause_id)
+        effect_table, effect = self.record(effect_id)
+        if cause_table != 'nodes':
+            raise CommandError(f"{cause_id} is an outcome, not a cause")
+        for record, field, other_id in ((cause, 'causes', effect_id),
+                                        (effect, 'causedBy', cause_id)):
+            ids = [i for i in parse_ids(record.get(field, ''))
+                   if i != other_id]
+            if linked:
+                ids.append(other_id)
+            record[field] = ', '.join(map(str, ids))
+        return f"{'Linked' if linked else 'Unlinked'} {cause_id} -> " \
+            f"{effect_id}"
+
+    def delete(self, args):
+        messages = []
+        for label in args.item_ids:
+            item_id = self.resolve(label)
+            table, _ = self.record(item_id)
+            self.changed.pop(item_id, None)
+            if self.added.pop(item_id, None) is None:
+                self.deleted[item_id] = table
+
+            # Strip links to the deleted item so none are left dangling
+            candidates = (set(self.index.parents.get(item_id, ())) |
+                          set(self.index.children.get(item_id, ())) |
+                          set(self.added) | set(self.changed))
+            for other_id in candidates:
+                if other_id == item_id or other_id in self.deleted or \
+                        not (self.index.exists(other_id) or
+                             other_id in self.added):
+                    continue
+                _, record = self.record(other_id)
+                for field in ('causedBy', 'causes'):
+                    if field in record:
+                        record[field] = ', '.join(
+                            str(i) for i in parse_ids(record[field])
+                            if i != item_id
+                        )
+            messages.append(f"Deleted {table[:-1]} {item_id}")
+        return '\n'.join(messages)
+
+    def apply(self, args, new_ids):
+        """Apply one parsed command and return a message describing it."""
+        if args.command == 'add':
+            return self.add(args, next(new_ids))
+        if args.command == 'update':
+            return self.update(args)
+        if args.command in ('link', 'unlink'):
+            return self.link(args, linked=args.command == 'link')
+        if args.command == 'delete':
+            return self.delete(args)
+        if args.command == 'recompute':
+            self.recompute_all = True
+            return "Recompute all outcomes"
+        raise CommandError(f"Unknown command '{args.command}'")
+
+    def final_index(self):
+        """Build the index of the graph as it will be after saving."""
+        tables = {'nodes': [], 'outcomes': []}
+        for table, records in (('nodes', self.index.nodes),
+                               ('outcomes', self.index.outcomes)):
+            for item_id, record in records.items():
+                if item_id not in self.deleted:
+                    tables[table].append(
+                        self.changed.get(item_id, (table, record))[1]
+                    )
+        for table, record in self.added.values():
+            tables[table].append(record)
+        return GraphIndex(tables['nodes'], tables['outcomes'])
+
+    def validate(self):
+        """Check the final graph, raising CommandError if it is invalid."""
+        final = self.final_index()
+        before = set(self.index.missing_references())
+        missing = [ref for ref in final.missing_references()
+                   if ref not in before]
+        if missing:
+            details = ', '.join(f"{item_id} -> {ref_id}"
+                                for item_id, ref_id in missing[:10])
+            raise CommandError(f"Unknown IDs referenced: {details}")
+        _, cyclic_before = topological_order(self.index)
+        _, cyclic = topological_order(final)
+        if cyclic - cyclic_before:
+            raise CommandError(
+                "Changes would create a cycle through IDs: " + ', '.join(
+                    map(str, sorted(cyclic - cyclic_before)[:10])
+                )
+            )
+        return final
+
+    def save(self):
+        """Write every change in one transaction plus one delete per table."""
+        index = self.index
+        rows = {'nodes': index.node_rows, 'outcomes': index.outcome_rows}
+        with self.dag.transaction() as tx:
+            for item_id, (table, record) in self.changed.items():
+                original = getattr(index, table)[item_id]
+                fields = {field: value for field, value in record.items()
+                          if original.get(field) != value}
+                if fields:
+                    tx.update(table, rows[table][item_id], fields)
+            for table, record in self.added.values():
+                tx.append(table, record)
+
+        for table in FIELDS:
+            refs = sorted(((rows[table][item_id], item_id)
+                           for item_id, kind in self.deleted.items()
+                           if kind == table), reverse=True)
+            if refs:
+                self.dag.delete_rows(table, refs)
+        self.dag.reset_order()
+
+    def affected_outcomes(self, final):
+        """Return the outcomes whose inputs may have changed."""
+        if self.recompute_all:
+            return None
+        touched = set(self.changed) | set(self.added) | set(self.deleted)
+        affected = (self.index.downstream_outcomes(touched) |
+                    final.downstream_outcomes(touched))
+        affected |= {item_id for item_id in touched
+                     if item_id in final.outcomes}
+        return {item_id for item_id in affected if item_id in final.outcomes}
+
+
+def run_commands(dag, commands, verbose=False):
+    """
+    Apply (line number, args) commands as one batch.
+
+    Prints one line per command and returns 0, or prints the first error
+    and returns 1 without saving anything.
+    """
+    batch = Batch(dag)
+    adds = sum(1 for _, args in commands if args.command == 'add')
+    new_ids = iter(dag.ids.reserve(adds))
+    messages = []
+    for line_number, args in commands:
+        try:
+            messages.append(batch.apply(args, new_ids))
+        except CommandError as error:
+            where = f" on line {line_number}" if line_number else ''
+            print(f"Error{where}: {error}\nNothing was saved.")
+            return 1
+    try:
+        final = batch.validate()
+    except CommandError as error:
+        print(f"Error: {error}\nNothing was saved.")
+        return 1
+
+    try:
+        batch.save()
+    except MissingRecordError as error:
+        print(f"Error: {error}, changed by another session.\n"
+              "Some changes may not have been saved.")
+        return 1
+    except RemoteError as error:
+        print(f"Error: {error}\nSome changes may not have been saved.")
+        return 1
+    for message in messages:
+        print(message)
+
+    affected = batch.affected_outcomes(final)
+    if affected is None or affected:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(
+                sys.stdout if verbose else devnull):
+            dag.calculate_outcome_probabilities_and_severities(affected)
+        count = len(dag.index.outcomes) if affected is None \
+            else len(affected)
+        print(f"Recalculated {count} outcome(s).")
+    return 0
+
+
+def main(dag, args):
+    """Run the command given on the command line, or a batch script."""
+    try:
+        if args.command == 'batch':
+            commands = read_script(args.path)
+        else:
+            commands = [(None, args)]
+    except (OSError, CommandError) as error:
+        print(f"Error: {error}")
+        return 1
+    return run_commands(dag, commands, verbose=args.verbose)
@@ -1,10 +1,32 @@
 const Pty = require('node-pty');
 const fs = require('fs');
+const { spawn } = require('child_process');
+
+// One shared DAG server holds the backend connection and cache for all
+// terminal sessions, which connect to it as thin clients
+const DAG_SOCKET = process.env.DAG_SOCKET || '/tmp/dag-tui.sock';
+var dagServer = null;
+
+function startDagServer() {
+
+    dagServer = spawn('python3', ['server.py', '--socket', DAG_SOCKET], {
+        cwd: process.env.PWD,
+        env: process.env,
+        stdio: 'inherit'
+    });
+
+    dagServer.on('exit', function (code, signal) {
+        console.log("DAG server exited, restarting");
+        dagServer = null;
+        setTimeout(startDagServer, 1000);
+    });
+}
 
 exports.install = function () {
 
     ROUTE('/');
     WEBSOCKET('/', socket, ['raw']);
+    startDagServer();
 
 };
 
@@ -21,7 +43,10 @@ function socket() {
             cols: 80,
             rows: 24,
             cwd: process.env.PWD,
-            env: process.env
+            env: Object.assign({}, process.env, {
+                DAG_BACKEND: 'remote',
+                DAG_SOCKET: DAG_SOCKET
+            })
         });
 
         client.tty.on('exit', function (code, signal) {
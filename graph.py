@@ -0,0 +1,706 @@
+"""
+In-memory graph index built from a snapshot of the nodes and outcomes.
+
+Rows from the storage backend are parsed once into compact Records with
+typed fields and packed link arrays; the index adds id lookups, sheet
+row positions and packed adjacency arrays so traversals never have to
+scan the tables or convert ids again.
+"""
+import heapq
+import sys
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, deque, namedtuple
+
+from storage import NODE_FIELDS, OUTCOME_FIELDS
+
+# Type code of packed id arrays: signed 64-bit integers
+ID_TYPE = 'q'
+
+
+def to_id(value):
+    """Convert an id cell or user input to an int, or None if invalid."""
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        try:
+            number = float(str(value).strip())
+        except ValueError:
+            return None
+        return int(number) if number.is_integer() else None
+
+
+def parse_ids(value):
+    """Parse a comma-separated id cell into a list of integer ids."""
+    ids = []
+    for part in str(value).split(','):
+        item_id = to_id(part) if part.strip() else None
+        if item_id is not None:
+            ids.append(item_id)
+    return ids
+
+
+def to_number(value):
+    """Convert a probability or severity cell to an int or float."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() else number
+
+
+class Record:
+    """
+    One node or outcome, parsed once from its worksheet row.
+
+    The id is an int, probability and severity are numbers (None when
+    blank), titles are interned and links are packed integer arrays. A
+    record still reads like the row it came from: ``record['causedBy']``
+    gives the comma-separated text and blank numbers read as ''.
+    """
+    __slots__ = ('fields', 'id', 'title', 'description', 'caused_by',
+                 'causes', 'probability', 'severity')
+
+    ATTRIBUTES = {'node_id': 'id', 'outcome_id': 'id',
+                  'causedBy': 'caused_by'}
+    LINKS = ('causedBy', 'causes')
+    NUMBERS = ('probability', 'severity')
+    NO_LINKS = array(ID_TYPE)
+
+    def __init__(self, fields, row=()):
+        self.fields = fields
+        self.id = None
+        self.title = self.description = ''
+        self.caused_by = self.causes = self.NO_LINKS
+        self.probability = self.severity = None
+        self.update(row)
+
+    @classmethod
+    def node(cls, row):
+        return cls(NODE_FIELDS, row)
+
+    @classmethod
+    def outcome(cls, row):
+        return cls(OUTCOME_FIELDS, row)
+
+    def __getitem__(self, field):
+        if field not in self.fields:
+            raise KeyError(field)
+        value = getattr(self, self.ATTRIBUTES.get(field, field))
+        if field in self.LINKS:
+            return ', '.join(map(str, value))
+        return '' if value is None else value
+
+    def __setitem__(self, field, value):
+        if field not in self.fields:
+            raise KeyError(field)
+        if field == self.fields[0]:
+            value = to_id(value)
+        elif field in self.LINKS:
+            value = array(ID_TYPE, value if isinstance(value, array)
+                          else parse_ids(value or ''))
+        elif field in self.NUMBERS:
+            value = to_number(value)
+        elif field == 'title':
+            value = sys.intern(str(value))
+        else:
+            value = str(value)
+        setattr(self, self.ATTRIBUTES.get(field, field), value)
+
+    def get(self, field, default=None):
+        return self[field] if field in self.fields else default
+
+    def keys(self):
+        return iter(self.fields)
+
+    __iter__ = keys
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def items(self):
+        return ((field, self[field]) for field in self.fields)
+
+    def update(self, fields=(), **kwargs):
+        items = fields.items() if hasattr(fields, 'items') else fields
+        for field, value in list(items) + list(kwargs.items()):
+            if field in self.fields:
+                self[field] = value
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Record({dict(self.items())!r})"
+
+
+def as_record(row, fields):
+    """Return a row as a Record, parsing it if it is still a dict."""
+    return row if isinstance(row, Record) else Record(fields, row)
+
+
+class GraphIndex:
+    """
+    Lookup tables over one version of the graph.
+
+    An edge ``a -> b`` exists when ``b`` is listed in ``a``'s ``causes``
+    or ``a`` is listed in ``b``'s ``causedBy``, so edges recorded on only
+    one side are still followed. ``children`` and ``parents`` map an id
+    to a sorted array of linked ids.
+
+    An index built from a RecordCache's own record lists can listen to
+    the cache: added, changed and deleted records are then applied in
+    time proportional to their links, and ``stale`` is set when a whole
+    table is replaced.
+    """
+
+    def __init__(self, nodes, outcomes, version=None):
+        self.version = version
+        self.stale = False
+        self.nodes = {}
+        self.outcomes = {}
+        node_rows = {}
+        outcome_rows = {}
+        children = defaultdict(list)
+        parents = defaultdict(list)
+
+        for row, node in enumerate(nodes, start=2):
+            node = as_record(node, NODE_FIELDS)
+            if node.id is None:
+                continue
+            self.nodes[node.id] = node
+            node_rows[node.id] = row
+            for child_id in node.causes:
+                children[node.id].append(child_id)
+                parents[child_id].append(node.id)
+            for parent_id in node.caused_by:
+                children[parent_id].append(node.id)
+                parents[node.id].append(parent_id)
+
+        for row, outcome in enumerate(outcomes, start=2):
+            outcome = as_record(outcome, OUTCOME_FIELDS)
+            if outcome.id is None:
+                continue
+            self.outcomes[outcome.id] = outcome
+            outcome_rows[outcome.id] = row
+            for parent_id in outcome.caused_by:
+                children[parent_id].append(outcome.id)
+                parents[outcome.id].append(parent_id)
+
+        # Links may be recorded on both sides, so drop duplicates
+        self.children = {item_id: array(ID_TYPE, sorted(set(ids)))
+                         for item_id, ids in children.items()}
+        self.parents = {item_id: array(ID_TYPE, sorted(set(ids)))
+                        for item_id, ids in parents.items()}
+        self._tables = {'nodes': nodes, 'outcomes': outcomes}
+        self._rows = {'nodes': node_rows, 'outcomes': outcome_rows}
+
+    @property
+    def node_rows(self):
+        return self.rows('nodes')
+
+    @property
+    def outcome_rows(self):
+        return self.rows('outcomes')
+
+    def rows(self, name):
+        """Return {id: sheet row} of a table, renumbered after changes."""
+        rows = self._rows[name]
+        if rows is None:
+            rows = self._rows[name] = {
+                record.id: row
+                for row, record in enumerate(self._tables[name], start=2)
+                if record.id is not None
+            }
+        return rows
+
+    # RecordCache listener interface
+
+    def reset(self, name):
+        self.stale = True
+
+    def upsert(self, name, record):
+        if record.id is None:
+            return
+        items = self.nodes if name == 'nodes' else self.outcomes
+        if record.id not in items:
+            self._rows[name] = None
+        items[record.id] = record
+        self.relink(record.id)
+
+    def remove(self, name, record):
+        items = self.nodes if name == 'nodes' else self.outcomes
+        if items.pop(record.id, None) is None:
+            return
+        self._rows[name] = None
+        # Links recorded by the other items stay, as in a rebuilt index
+        self.relink(record.id)
+
+    def records(self, item_id):
+        """Return the node and outcome records with an id."""
+        return [record for record in (self.nodes.get(item_id),
+                                      self.outcomes.get(item_id))
+                if record is not None]
+
+    def relink(self, item_id):
+        """Recompute the edges of an item after its records changed."""
+        def lists(other_id, field):
+            return any(item_id in getattr(record, field)
+                       for record in self.records(other_id))
+
+        records = self.records(item_id)
+        old_children = self.children.get(item_id, ())
+        old_parents = self.parents.get(item_id, ())
+        children = {child_id for record in records
+                    for child_id in record.causes}
+        children.update(child_id for child_id in old_children
+                        if lists(child_id, 'caused_by'))
+        parents = {parent_id for record in records
+                   for parent_id in record.caused_by}
+        parents.update(parent_id for parent_id in old_parents
+                       if lists(parent_id, 'causes'))
+        # A self-link is both a child and a parent edge
+        if item_id in children or item_id in parents:
+            children.add(item_id)
+            parents.add(item_id)
+        self._set_edges(self.children, self.parents, item_id,
+                        old_children, children)
+        self._set_edges(self.parents, self.children, item_id,
+                        old_parents, parents)
+
+    @staticmethod
+    def _set_edges(edges, reverse, item_id, old_ids, new_ids):
+        """Replace the ids linked to an item and update the other side."""
+        old_ids = set(old_ids)
+        for other_id in old_ids - new_ids:
+            ids = reverse.get(other_id, ())
+            position = bisect_left(ids, item_id)
+            if position < len(ids) and ids[position] == item_id:
+                del ids[position]
+                if not ids:
+                    del reverse[other_id]
+        for other_id in new_ids - old_ids:
+            ids = reverse.setdefault(other_id, array(ID_TYPE))
+            position = bisect_left(ids, item_id)
+            if position == len(ids) or ids[position] != item_id:
+                ids.insert(position, item_id)
+        if new_ids:
+            edges[item_id] = array(ID_TYPE, sorted(new_ids))
+        else:
+            edges.pop(item_id, None)
+
+    def node(self, node_id):
+        """Return the node record with the given id, or None."""
+        return self.nodes.get(to_id(node_id))
+
+    def outcome(self, outcome_id):
+        """Return the outcome record with the given id, or None."""
+        return self.outcomes.get(to_id(outcome_id))
+
+    def node_row(self, node_id):
+        """Return the sheet row of a node, or None."""
+        return self.node_rows.get(to_id(node_id))
+
+    def outcome_row(self, outcome_id):
+        """Return the sheet row of an outcome, or None."""
+        return self.outcome_rows.get(to_id(outcome_id))
+
+    def causes_of(self, item_id):
+        """Return the nodes causing a node or outcome, in sheet order."""
+        return sorted(
+            (parent_id for parent_id in self.parents.get(item_id, ())
+             if parent_id in self.nodes),
+            key=self.node_rows.__getitem__
+        )
+
+    def exists(self, item_id):
+        """Check whether an id belongs to a node or an outcome."""
+        return item_id in self.nodes or item_id in self.outcomes
+
+    def missing_references(self):
+        """Return (item_id, referenced_id) for links to unknown ids."""
+        missing = []
+        for parent_id, child_ids in self.children.items():
+            for child_id in child_ids:
+                if not self.exists(parent_id):
+                    missing.append((child_id, parent_id))
+                elif not self.exists(child_id):
+                    missing.append((parent_id, child_id))
+        return missing
+
+    def reachable(self, item_ids, edges):
+        """Return the ids reachable from the given items along ``edges``."""
+        seen = set()
+        queue = deque(to_id(item_id) for item_id in item_ids)
+        while queue:
+            item_id = queue.popleft()
+            for next_id in edges.get(item_id, ()):
+                if next_id not in seen:
+                    seen.add(next_id)
+                    queue.append(next_id)
+        return seen
+
+    def upstream(self, item_ids):
+        """Return the ids of every direct or indirect cause of the items."""
+        return self.reachable(item_ids, self.parents)
+
+    def downstream(self, item_ids):
+        """Return the ids of every direct or indirect effect of the items."""
+        return self.reachable(item_ids, self.children)
+
+    def downstream_outcomes(self, item_ids):
+        """Return the ids of all outcomes reachable from the given items."""
+        return {item_id for item_id in self.downstream(item_ids)
+                if item_id in self.outcomes}
+
+
+COMBINE_RULES = ('average', 'noisy_or', 'max')
+
+
+def combine(probabilities, rule='average'):
+    """Combine cause probabilities (0-100) into one using a rule."""
+    if rule == 'average':
+        return sum(probabilities) / len(probabilities)
+    if rule == 'max':
+        return max(probabilities)
+    if rule == 'noisy_or':
+        # Probability that at least one independent cause occurs
+        miss = 1.0
+        for probability in probabilities:
+            miss *= 1 - probability / 100
+        return 100 * (1 - miss)
+    raise ValueError(
+        f"Unknown rule '{rule}'. Choose one of: {', '.join(COMBINE_RULES)}"
+    )
+
+
+def topological_order(index):
+    """
+    Order every node and outcome so causes come before their effects.
+
+    Uses Kahn's algorithm in O(V + E). Returns the order and the set of
+    ids that could not be ordered because they lie on or behind a cycle.
+    """
+    items = list(index.nodes) + list(index.outcomes)
+    in_degree = {item_id: 0 for item_id in items}
+    for item_id in items:
+        for child_id in index.children.get(item_id, ()):
+            if child_id in in_degree:
+                in_degree[child_id] += 1
+
+    queue = deque(item_id for item_id in items if not in_degree[item_id])
+    order = []
+    while queue:
+        item_id = queue.popleft()
+        order.append(item_id)
+        for child_id in index.children.get(item_id, ()):
+            if child_id in in_degree:
+                in_degree[child_id] -= 1
+                if not in_degree[child_id]:
+                    queue.append(child_id)
+
+    ordered = set(order)
+    return order, {item_id for item_id in items if item_id not in ordered}
+
+
+def propagate(index, rule='average', order=None):
+    """
+    Propagate probability and severity through every level of the graph.
+
+    A node's own probability is conditional on its causes: a node with
+    causes occurs with its probability times the combined probability
+    of its causes, and a node without causes with its own probability.
+    An outcome takes the combined probability of its causes. Severity is
+    the maximum severity along any path.
+
+    Returns a dict mapping each reachable id to (probability, severity).
+    Outcomes without causes and items on cycles are left out.
+    """
+    if order is None:
+        order, _ = topological_order(index)
+
+    results = {}
+    for item_id in order:
+        causes = [
+            results[parent_id]
+            for parent_id in index.parents.get(item_id, ())
+            if parent_id in results
+        ]
+        node = index.nodes.get(item_id)
+        if node is not None:
+            probability = node.probability or 0.0
+            severity = node.severity or 0.0
+            if causes:
+                probability *= combine([p for p, _ in causes], rule) / 100
+                severity = max(severity, max(s for _, s in causes))
+            results[item_id] = (probability, severity)
+        elif causes:
+            results[item_id] = (
+                combine([p for p, _ in causes], rule),
+                max(s for _, s in causes)
+            )
+    return results
+
+
+RiskPath = namedtuple('RiskPath', ['risk', 'probability', 'severity', 'path'])
+
+
+def keep_undominated(entries, k):
+    """
+    Drop the partial paths that k others beat in every way.
+
+    Entries are ``(probability, severity, item_id, previous)``. One is
+    dropped when k others are at least as likely and at least as severe.
+    """
+    if len(entries) <= k:
+        return entries
+    entries.sort(key=lambda entry: (-entry[1], -entry[0]))
+    # Min-heap of the k highest probabilities among the more severe
+    best = []
+    kept = []
+    for entry in entries:
+        if len(best) < k:
+            heapq.heappush(best, entry[0])
+        elif entry[0] > best[0]:
+            heapq.heapreplace(best, entry[0])
+        else:
+            continue
+        kept.append(entry)
+    return kept
+
+
+def to_risk_path(entry, outcome_id):
+    """Turn a linked partial path ending at a cause into a RiskPath."""
+    probability, severity = entry[0] * 100, entry[1]
+    path = [outcome_id]
+    while entry is not None:
+        path.append(entry[2])
+        entry = entry[3]
+    return RiskPath(probability * severity, probability, severity,
+                    path[::-1])
+
+
+def critical_paths(index, k=10, order=None):
+    """
+    Find the k riskiest chains of causes leading to each outcome.
+
+    A path starts at a node without causes and follows its effects to an
+    outcome. As in ``propagate``, its probability is the product of the
+    probabilities of its nodes and its severity the highest severity on
+    it. Its risk is the probability (0-100) times the severity.
+
+    Paths are never enumerated. Nodes are visited in topological order,
+    and each keeps only the partial paths from its root causes that can
+    still end up among the k riskiest. Extending two partial paths
+    through the same nodes multiplies their probabilities by the same
+    factor and raises their severities to at least the same value, so a
+    partial path is dropped when k others reaching the same node are at
+    least as likely and as severe. A node keeps at most k paths for each
+    distinct severity, however many paths lead to it. Partial paths are
+    linked tuples sharing their prefixes.
+
+    Returns a dict mapping each outcome with at least one path to its
+    RiskPaths, riskiest first. Items on cycles are left out.
+    """
+    if order is None:
+        order, _ = topological_order(index)
+
+    partial = {}
+    paths = {}
+    for item_id in order:
+        candidates = [entry for parent_id in index.parents.get(item_id, ())
+                      for entry in partial.get(parent_id, ())]
+        node = index.nodes.get(item_id)
+        if node is None:
+            if candidates:
+                best = heapq.nlargest(
+                    k, candidates, key=lambda entry: entry[0] * entry[1]
+                )
+                paths[item_id] = [to_risk_path(entry, item_id)
+                                  for entry in best]
+            continue
+
+        probability = (node.probability or 0.0) / 100
+        severity = node.severity or 0.0
+        if candidates:
+            partial[item_id] = keep_undominated([
+                (entry[0] * probability, max(entry[1], severity), item_id,
+                 entry)
+                for entry in candidates
+            ], k)
+        else:
+            partial[item_id] = [(probability, severity, item_id, None)]
+    return paths
+
+
+class CycleError(ValueError):
+    """Raised when adding an edge would create a cycle."""
+
+    def __init__(self, path):
+        self.path = path
+        super().__init__(
+            "Link would create a cycle: " + ' -> '.join(map(str, path))
+        )
+
+
+class OnlineTopologicalOrder:
+    """
+    Topological order kept up to date as edges are added.
+
+    Implements the Pearce-Kelly dynamic algorithm: an edge that already
+    agrees with the order is accepted in O(1), otherwise only the items
+    positioned between its endpoints are searched and reordered. Edge
+    removals never invalidate the order, so only additions need to go
+    through ``add_edges``. Adjacency is read from the current index so
+    the order can outlive index rebuilds caused by local writes.
+    """
+
+    def __init__(self, index):
+        order, cyclic = topological_order(index)
+        self.position = {
+            item_id: i for i, item_id in enumerate(order + sorted(cyclic))
+        }
+        self.next_position = len(self.position)
+
+    def add_item(self, item_id):
+        """Place a new item after every existing one."""
+        if item_id not in self.position:
+            self.position[item_id] = self.next_position
+            self.next_position += 1
+
+    def add_edges(self, index, edges, removed=()):
+        """
+        Insert ``(parent_id, child_id)`` edges, keeping the order valid.
+
+        Edges are checked one by one against the index, less the
+        ``removed`` edges, plus the edges inserted before them. Raises
+        CycleError on the first edge that would close a cycle; the order
+        stays valid for the edges accepted so far. Once edges were
+        removed, it is only valid for the index without them.
+        """
+        children = defaultdict(set)
+        parents = defaultdict(set)
+        removed = set(removed)
+
+        def successors(item_id):
+            for child_id in index.children.get(item_id, ()):
+                if (item_id, child_id) not in removed:
+                    yield child_id
+            yield from children.get(item_id, ())
+
+        def predecessors(item_id):
+            for parent_id in index.parents.get(item_id, ()):
+                if (parent_id, item_id) not in removed:
+                    yield parent_id
+            yield from parents.get(item_id, ())
+
+        for parent_id, child_id in edges:
+            if parent_id == child_id:
+                raise CycleError([parent_id, child_id])
+            self.add_item(parent_id)
+            self.add_item(child_id)
+
+            lower = self.position[child_id]
+            upper = self.position[parent_id]
+            if lower < upper:
+                forward = self._search(
+                    child_id, successors,
+                    lambda pos: pos <= upper, target=parent_id
+                )
+                backward = self._search(
+                    parent_id, predecessors, lambda pos: pos >= lower
+                )
+                self._reorder(backward, forward)
+
+            children[parent_id].add(child_id)
+            parents[child_id].add(parent_id)
+
+    def _search(self, start, neighbours, in_range, target=None):
+        """Collect items reachable from start within the affected range."""
+        came_from = {start: None}
+        stack = [start]
+        while stack:
+            item_id = stack.pop()
+            for next_id in neighbours(item_id):
+                if next_id == target:
+                    path = [target, item_id]
+                    while came_from[path[-1]] is not None:
+                        path.append(came_from[path[-1]])
+                    raise CycleError(path[:1] + path[:0:-1] + path[:1])
+                if next_id in came_from:
+                    continue
+                if next_id in self.position and \
+                        in_range(self.position[next_id]):
+                    came_from[next_id] = item_id
+                    stack.append(next_id)
+        return list(came_from)
+
+    def _reorder(self, backward, forward):
+        """Move backward items before forward ones, reusing positions."""
+        backward.sort(key=self.position.__getitem__)
+        forward.sort(key=self.position.__getitem__)
+        items = backward + forward
+        positions = sorted(self.position[item_id] for item_id in items)
+        for item_id, position in zip(items, positions):
+            self.position[item_id] = position
+
+
+def walk_causes(index, root_id, visited=None, max_depth=None):
+    """
+    Walk the causes of a node or outcome depth first, visiting each once.
+
+    Yields ``(level, cause_id, effect_id, status)`` in display order, where
+    status is 'expanded' the first time a cause is seen, 'seen' when it
+    was already expanded earlier (pass the same ``visited`` dict to share
+    this across roots), 'cycle' when it leads back to an item on the
+    current path, and 'truncated' when ``max_depth`` stops the expansion.
+    ``visited`` maps each expanded cause to its level. A cause expanded
+    deeper than where it is met again had its causes cut off sooner, so
+    with ``max_depth`` it is expanded again. Uses an explicit stack, so
+    deep graphs cannot exhaust the recursion limit and the first lines
+    are available before the walk finishes.
+    """
+    visited = {} if visited is None else visited
+    path = [root_id]
+    on_path = {root_id}
+    stack = [iter(index.causes_of(root_id))]
+
+    while stack:
+        cause_id = next(stack[-1], None)
+        if cause_id is None:
+            stack.pop()
+            on_path.discard(path.pop())
+            continue
+
+        level = len(stack)
+        effect_id = path[-1]
+        if cause_id in on_path:
+            yield level, cause_id, effect_id, 'cycle'
+            continue
+        if cause_id in visited and (max_depth is None or
+                                    visited[cause_id] <= level):
+            yield level, cause_id, effect_id, 'seen'
+            continue
+
+        has_causes = bool(index.causes_of(cause_id))
+        if has_causes and max_depth is not None and level >= max_depth:
+            yield level, cause_id, effect_id, 'truncated'
+            continue
+
+        # Nothing is cut off below a cause without causes
+        visited[cause_id] = level if has_causes else 0
+        yield level, cause_id, effect_id, 'expanded'
+        if has_causes:
+            path.append(cause_id)
+            on_path.add(cause_id)
+            stack.append(iter(index.causes_of(cause_id)))
@@ -0,0 +1,243 @@
+"""
+Opt-in instrumentation of storage requests and DAG operations.
+
+Enable it with ``run.py --profile`` (or ``DAG_PROFILE=1``). Every call to
+the storage backend, every underlying gspread worksheet call and every
+public DAG method is then timed, and a summary is printed on exit:
+
+- ``dag``: menu actions and the operations they run. Time spent waiting
+  for the user to type is left out and reported under ``input``.
+- ``storage``: backend requests, including any quota throttling.
+- ``worksheet``: the Google Sheets round trips themselves.
+
+Each entry has a call count, total and mean time, a latency histogram
+and the approximate bytes transferred (the JSON size of the arguments
+and the result). ``--profile-json FILE`` also writes the numbers as
+JSON, and ``--profile-dump FILE`` a cProfile dump for ``pstats`` or
+snakeviz.
+"""
+import bisect
+import builtins
+import collections
+import cProfile
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+PROFILE = bool(os.environ.get('DAG_PROFILE'))
+PROFILE_JSON = os.environ.get('DAG_PROFILE_JSON')
+PROFILE_DUMP = os.environ.get('DAG_PROFILE_DUMP')
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+STORAGE_METHODS = ('get_records', 'update_cells', 'append_rows',
+                   'delete_rows', 'reserve_ids', 'revision', 'changes')
+
+
+def payload_size(*values):
+    """Return the approximate size in bytes of values sent as JSON."""
+    size = 0
+    for value in values:
+        try:
+            size += len(json.dumps(value, default=str))
+        except (TypeError, ValueError):
+            pass
+    return size
+
+
+class Stats:
+    """Call count, latency histogram and bytes of one operation."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, seconds, size=0, failed=False):
+        self.calls += 1
+        self.errors += failed
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes += size
+        self.histogram[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+    def percentile(self, fraction):
+        """Return the bucket bound below which ``fraction`` of calls fell."""
+        target = fraction * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.max_seconds * 1000
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_ms': round(self.seconds * 1000, 3),
+            'max_ms': round(self.max_seconds * 1000, 3),
+            'bytes': self.bytes,
+            'histogram_ms': dict(zip(
+                [f"<={bound}" for bound in BUCKETS_MS] +
+                [f">{BUCKETS_MS[-1]}"], self.histogram
+            )),
+        }
+
+
+class Instrumented:
+    """Proxy timing every method call made on a gspread object."""
+
+    def __init__(self, target, profiler, label):
+        self._target = target
+        self._profiler = profiler
+        self._label = label
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+        return self._profiler.wrap(
+            value, 'worksheet', f"{self._label}.{name}", measure_bytes=True,
+            proxy_result=True
+        )
+
+
+class Profiler:
+    """Collects timings for instrumented objects and reports them."""
+
+    def __init__(self, cprofile=False):
+        self.stats = collections.defaultdict(Stats)
+        self.lock = threading.Lock()
+        self.input_seconds = 0.0
+        self.started = time.perf_counter()
+        self.cprofile = cProfile.Profile() if cprofile else None
+        if self.cprofile:
+            self.cprofile.enable()
+
+    def record(self, category, name, seconds, size=0, failed=False):
+        with self.lock:
+            self.stats[(category, name)].add(seconds, size, failed)
+
+    def wrap(self, function, category, name, measure_bytes=False,
+             proxy_result=False, exclude_input=False):
+        """Return ``function`` timed under the given name."""
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            waited = self.input_seconds
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+            finally:
+                seconds = time.perf_counter() - started
+                if exclude_input:
+                    seconds -= self.input_seconds - waited
+                size = 0
+                if measure_bytes:
+                    size = payload_size(args, kwargs,
+                                        None if failed else result)
+                self.record(category, name, seconds, size, failed)
+            if proxy_result and hasattr(result, 'get_all_values'):
+                return Instrumented(result, self, result.title)
+            return result
+        return timed
+
+    def instrument_input(self):
+        """Time prompts separately so user think time is not counted."""
+        original = builtins.input
+
+        def timed_input(prompt=''):
+            started = time.perf_counter()
+            try:
+                return original(prompt)
+            finally:
+                seconds = time.perf_counter() - started
+                self.input_seconds += seconds
+                self.record('input', 'input', seconds)
+
+        builtins.input = timed_input
+
+    def instrument_backend(self, backend):
+        """Time the backend's requests and, for Sheets, its gspread calls."""
+        for name in STORAGE_METHODS:
+            setattr(backend, name, self.wrap(
+                getattr(backend, name), 'storage', name, measure_bytes=True
+            ))
+        if hasattr(backend, '_worksheets'):
+            connect = backend.connect
+
+            def instrumented_connect():
+                connect()
+                backend.sheet = Instrumented(backend.sheet, self,
+                                             'spreadsheet')
+                backend._worksheets = {
+                    table: Instrumented(worksheet, self, table)
+                    for table, worksheet in backend._worksheets.items()
+                }
+                if backend._id_sheet is not None:
+                    backend._id_sheet = Instrumented(backend._id_sheet,
+                                                     self, 'ids')
+
+            backend.connect = self.wrap(instrumented_connect, 'storage',
+                                        'connect')
+
+    def instrument(self, obj, category='dag'):
+        """Time every public method of an object."""
+        for name, function in inspect.getmembers(type(obj),
+                                                 inspect.isfunction):
+            # Generators and context managers return before doing the
+            # work, so timing the call would be misleading
+            if name.startswith('_') or inspect.isgeneratorfunction(
+                    getattr(function, '__wrapped__', function)):
+                continue
+            setattr(obj, name, self.wrap(getattr(obj, name), category,
+                                         name, exclude_input=True))
+
+    def to_dict(self):
+        categories = collections.defaultdict(dict)
+        for (category, name), stats in sorted(self.stats.items()):
+            categories[category][name] = stats.to_dict()
+        return {
+            'session_seconds': round(time.perf_counter() - self.started, 3),
+            'operations': categories,
+        }
+
+    def report(self):
+        """Format the collected stats as a table, slowest first."""
+        lines = [
+            f"\n[profile] {'operation':<52} {'calls':>6} {'total ms':>10} "
+            f"{'mean ms':>9} {'p95 ms':>8} {'max ms':>9} {'KB':>9}"
+        ]
+        for (category, name), stats in sorted(
+                self.stats.items(), key=lambda item: -item[1].seconds):
+            lines.append(
+                f"[profile] {category + ': ' + name:<52} {stats.calls:>6} "
+                f"{stats.seconds * 1000:>10.1f} "
+                f"{stats.seconds * 1000 / stats.calls:>9.2f} "
+                f"{stats.percentile(0.95):>8g} "
+                f"{stats.max_seconds * 1000:>9.1f} "
+                f"{stats.bytes / 1024:>9.1f}"
+            )
+        return '\n'.join(lines)
+
+    def finish(self, json_path=None, dump_path=None):
+        """Print the summary and write the requested files."""
+        if self.cprofile:
+            self.cprofile.disable()
+        print(self.report())
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as file:
+                json.dump(self.to_dict(), file, indent=2)
+            print(f"[profile] Stats written to {json_path}")
+        if dump_path and self.cprofile:
+            self.cprofile.dump_stats(dump_path)
+            print(f"[profile] cProfile data written to {dump_path}")
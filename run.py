@@ -1,26 +1,36 @@
-import gspread
-from google.oauth2.service_account import Credentials
-import warnings
+import argparse
+import atexit
+import contextlib
+import heapq
+import itertools
+import os
+import shlex
+import sys
 import time
-import random
 
-# Suppress specific deprecation warnings from Google Sheets API
-warnings.filterwarnings(
-    "ignore",
-    message=(".*Method signature's arguments 'range_name' and 'values' "
-             "will change their order.*")
-)
+from storage import BACKENDS, DEFAULT_BACKEND, NODE_FIELDS, OUTCOME_FIELDS
+from storage import MissingRecordError, RemoteError, create_backend
+from cache import CACHE_TTL, ID_BLOCK_SIZE, IdAllocator, RecordCache
+from cache import WriteTransaction
+from graph import COMBINE_RULES, GraphIndex, parse_ids, propagate, to_id
+from graph import critical_paths
+from graph import CycleError, OnlineTopologicalOrder, topological_order
+from graph import walk_causes
+import commands
+from profiling import PROFILE, PROFILE_DUMP, PROFILE_JSON, Profiler
+from simulation import simulate
+from search import SearchIndex, add_query_arguments, query_filters
+from transfer import export_graph, import_graph
+import viewer
 
-SCOPE = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive.file",
-    "https://www.googleapis.com/auth/drive"
-]
+# Reference point for the startup timing report
+STARTED = time.perf_counter()
 
-CREDS = Credentials.from_service_account_file('creds.json')
-SCOPED_CREDS = CREDS.with_scopes(SCOPE)
-GSPREAD_CLIENT = gspread.authorize(SCOPED_CREDS)
-SHEET = GSPREAD_CLIENT.open("dag-tui")
+# How the probabilities of several causes are combined
+COMBINE_RULE = os.environ.get('DAG_COMBINE_RULE', 'average')
+
+# Print how long startup and the backend connection took
+TIMING = bool(os.environ.get('DAG_TIMING'))
 
 
 def validate_input(prompt, input_type=str, min_val=None, max_val=None):
@@ -51,7 +61,7 @@ def validate_input(prompt, input_type=str, min_val=None, max_val=None):
 
 class DAG:
     """Class to represent a Directed Acyclic Graph (DAG)
-    and interact with Google Sheets.
+    and interact with its storage backend (Google Sheets by default).
     """
     # Class constants for colors
     GREEN = '\033[92m'  # Green text
@@ -59,24 +69,202 @@ class DAG:
     RED = '\033[91m'  # Red text
     RESET = '\033[0m'  # Reset to default text color
 
-    def __init__(self):
-        """Initialize with worksheets for nodes."""
-        self.nodes_sheet = SHEET.worksheet('nodes')
-        self.outcomes_sheet = SHEET.worksheet('outcomes')
+    # Node fields that feed into outcome probabilities and severities
+    RECOMPUTE_FIELDS = {'causedBy', 'causes', 'probability', 'severity'}
+
+    def __init__(self, backend=None, cache_ttl=CACHE_TTL,
+                 rule=COMBINE_RULE, id_block_size=ID_BLOCK_SIZE):
+        """Initialize with a storage backend for nodes and outcomes."""
+        if rule not in COMBINE_RULES:
+            raise ValueError(
+                f"Unknown rule '{rule}'. "
+                f"Choose one of: {', '.join(COMBINE_RULES)}"
+            )
+        self.backend = backend or create_backend()
+        self.rule = rule
+        self.cache = RecordCache(self.backend, ttl=cache_ttl)
+        self._transaction = None
+        self._index = None
+        self._propagation = None
+        self._paths = None
+        self._order = None
+        self.search_index = SearchIndex()
+        self.cache.listeners.append(self.search_index)
+        self.ids = IdAllocator(self.backend,
+                               lambda item_id: self.index.exists(item_id),
+                               block_size=id_block_size)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group writes into one batch, committed when the block exits.
+
+        Nested calls join the outermost transaction. If the block raises,
+        pending writes are discarded and nothing is sent.
+        """
+        if self._transaction is not None:
+            yield self._transaction
+            return
+
+        self._transaction = WriteTransaction(self.backend, self.cache)
+        try:
+            yield self._transaction
+            self._transaction.commit()
+        finally:
+            self._transaction.rollback()
+            self._transaction = None
+
+    def get_nodes(self):
+        """Return the cached node records."""
+        return self.cache.get('nodes')
+
+    def get_outcomes(self):
+        """Return the cached outcome records."""
+        return self.cache.get('outcomes')
+
+    @property
+    def index(self):
+        """
+        Return the graph index for the current cache version.
+
+        The index listens to the cache, so changed records are applied
+        to it in place; it is only rebuilt when a table is replaced.
+        """
+        nodes = self.get_nodes()
+        outcomes = self.get_outcomes()
+        index = self._index
+        if index is None or index.stale:
+            if index is not None:
+                self.cache.listeners.remove(index)
+            index = self._index = GraphIndex(nodes, outcomes)
+            self.cache.listeners.append(index)
+        index.version = self.cache.version
+        return index
+
+    @property
+    def order(self):
+        """
+        Return the online topological order used to validate new links.
+
+        It is rebuilt only when the snapshot is refetched or changed by
+        another session; local writes keep it current because every new
+        link is inserted through it.
+        """
+        index = self.index
+        key = (self.cache.fetches, self.cache.syncs)
+        if self._order is None or self._order[0] != key:
+            self._order = (key, OnlineTopologicalOrder(index))
+        return self._order[1]
+
+    def reset_order(self):
+        """Forget the online order, e.g. after links were added in bulk."""
+        self._order = None
+
+    def validate_links(self, item_id, causedBy='', causes=''):
+        """
+        Check the IDs an item links to before they are saved.
+
+        Every referenced ID must exist (causedBy must name nodes) and the
+        links must not create a cycle once saved. A causedBy or causes
+        value replaces the item's links on that side, so links it leaves
+        out no longer count; None keeps them. Prints the problem and
+        returns False if the links are invalid.
+        """
+        index = self.index
+        item_id = to_id(item_id)
+        tokens = [token.strip() for value in (causedBy, causes)
+                  for token in str(value or '').split(',') if token.strip()]
+        invalid = [token for token in tokens if to_id(token) is None]
+        parent_ids = parse_ids(causedBy or '')
+        child_ids = parse_ids(causes or '')
+        unknown = (
+            [i for i in parent_ids if i not in index.nodes] +
+            [i for i in child_ids if not index.exists(i)]
+        )
+        if invalid or unknown:
+            print(f"\nUnknown node or outcome ID(s): "
+                  f"{', '.join(map(str, invalid + unknown))}\n")
+            return False
+
+        edges = (
+            [(parent_id, item_id) for parent_id in parent_ids
+             if item_id not in index.children.get(parent_id, ())] +
+            [(item_id, child_id) for child_id in child_ids
+             if child_id not in index.children.get(item_id, ())]
+        )
+        removed = set()
+        if causedBy is not None:
+            removed.update((parent_id, item_id) for parent_id
+                           in index.parents.get(item_id, ())
+                           if parent_id not in parent_ids)
+        if causes is not None:
+            removed.update((item_id, child_id) for child_id
+                           in index.children.get(item_id, ())
+                           if child_id not in child_ids)
+        try:
+            self.order.add_edges(index, edges, removed)
+        except CycleError as error:
+            if removed:
+                # The order may have been changed to rely on links that
+                # stay after all
+                self.reset_order()
+            print(f"\n{error}\n")
+            return False
+        return True
+
+    def propagation(self):
+        """
+        Return propagated (probability, severity) per node and outcome.
+
+        The topological order and results are computed in one pass and
+        reused until the graph or the combination rule changes.
+        """
+        index = self.index
+        key = (index.version, self.rule)
+        if self._propagation is None or self._propagation[0] != key:
+            order, cyclic = topological_order(index)
+            if cyclic:
+                print("Warning: skipping IDs on a cycle: "
+                      f"{', '.join(map(str, sorted(cyclic)))}")
+            self._propagation = (key, propagate(index, self.rule, order))
+        return self._propagation[1]
+
+    def critical_paths(self, k=10):
+        """
+        Return the k riskiest paths to each outcome.
+
+        See ``graph.critical_paths``. The paths are reused until the
+        graph changes; a smaller k is served from a larger cached one.
+        """
+        index = self.index
+        if self._paths is None or self._paths[0] != index.version or \
+                self._paths[1] < k:
+            self._paths = (index.version, k, critical_paths(index, k))
+        return {outcome_id: paths[:k]
+                for outcome_id, paths in self._paths[2].items()}
+
+    def sync(self, force=False):
+        """
+        Pick up changes other sessions made through a shared backend.
+
+        Backends whose checks count against a request quota are left to
+        the cache TTL unless ``force`` is set.
+        """
+        if force or not self.backend.quota_limited:
+            self.cache.sync()
+
+    def refresh(self):
+        """Discard the cached snapshot and reload both worksheets."""
+        self.cache.refresh()
+        print("Graph data refreshed from the spreadsheet.")
 
     def generate_unique_id(self):
-        """Generate a unique ID for nods and outcomes."""
-        # Get the last two digits of the current timestamp
-        timestamp = int(time.time()) % 100
-        # Generate a random number between 10 and 99
-        random_part = random.randint(10, 99)
-        # Combine the two parts
-        return f"{timestamp}{random_part}"
+        """Generate a unique ID for nodes and outcomes."""
+        return str(self.ids.next_id())
 
     def display_node(self, node_id):
         """Display a single node's data."""
-        nodes = self.nodes_sheet.get_all_records()
-        node = next((n for n in nodes if str(n['node_id']) == node_id), None)
+        node = self.index.node(node_id)
 
         if not node:
             print(f"No node found with ID {node_id}")
@@ -123,13 +311,18 @@ class DAG:
         )
 
         node_id = self.generate_unique_id()
+        if not self.validate_links(node_id, causedBy, causes):
+            print("Cause not added. Please try again.")
+            return
 
         # Append new node data to the sheet
-        self.nodes_sheet.append_row([
+        row = [
             node_id, title, description,
             causedBy or '', causes or '',
             probability or '', severity or ''
-        ])
+        ]
+        with self.transaction() as tx:
+            tx.append('nodes', dict(zip(NODE_FIELDS, row)))
 
         # Update outcomes if the node causes any
         if causes:
@@ -141,47 +334,41 @@ class DAG:
         self.confirm_or_edit_node(node_id)
 
         # Updated probabilities and severities if necessary
-        self.calculate_outcome_probabilities_and_severities()
+        self.recompute_outcomes([node_id])
 
     def update_outcomes(self, causes, node_id):
         """
         Update the outcomes caused by a node.
         """
-        outcomes = self.outcomes_sheet.get_all_records()
+        index = self.index
 
-        # Split the causes and iterate through each ID
-        for outcome_id in causes.split(','):
-            outcome_id = outcome_id.strip()
-            if not outcome_id:
-                continue
-
-            for i, outcome in enumerate(outcomes, start=2):
-                if str(outcome['outcome_id']).strip() == outcome_id:
-                    current_causedBy = outcome.get('causedBy', '').strip()
-                    updated_causedBy = (
-                        f"{current_causedBy},{node_id}"
-                        if current_causedBy else node_id
-                    )
+        with self.transaction() as tx:
+            for outcome_id in parse_ids(causes):
+                row_index = index.outcome_row(outcome_id)
+                if row_index is None:
+                    continue
 
-                    # Ensure proper separation
-                    updated_causedBy = (
-                        ', '.join(filter(None, updated_causedBy.split(',')))
-                    )
-                    self.outcomes_sheet.update(f'D{i}', [[updated_causedBy]])
-                    print(
-                        f"Updated causedBy for outcome ID {outcome_id} "
-                        f"with node ID {node_id}"
-                    )
-                    break
+                causedBy_ids = parse_ids(
+                    index.outcomes[outcome_id].get('causedBy', '')
+                )
+                if to_id(node_id) not in causedBy_ids:
+                    causedBy_ids.append(to_id(node_id))
+                updated_causedBy = ', '.join(map(str, causedBy_ids))
+
+                tx.update('outcomes', row_index,
+                          {'causedBy': updated_causedBy})
+                print(
+                    f"Updated causedBy for outcome ID {outcome_id} "
+                    f"with node ID {node_id}"
+                )
 
     def visualize(self):
         """Visualize the DAG by printing nodes and their relationships."""
-        if not self.nodes_sheet.get_all_values():
+        nodes = self.get_nodes()
+        if not nodes:
             print("No nodes to visualize.")
             return
 
-        nodes = self.nodes_sheet.get_all_records()
-
         print("\n\nCauses:")
 
         for node in nodes:
@@ -203,7 +390,7 @@ class DAG:
             print()
 
         print("\nOutcomes:\n")
-        outcomes = self.outcomes_sheet.get_all_records()
+        outcomes = self.get_outcomes()
         if not outcomes:
             print("No outcomes to display.")
         else:
@@ -225,38 +412,76 @@ class DAG:
             probability: (Optional) Probability of the node.
             severity: (Optional) Severity of the node.
         """
-        nodes = self.nodes_sheet.get_all_records()
-        row_index = next(
-            (i for i, node in enumerate(nodes, start=2)
-                if str(node['node_id']) == str(node_id)), None)
+        row_index = self.index.node_row(node_id)
 
         if not row_index:
             print(f"No node found with ID {node_id}")
             return
 
+        if (causedBy is not None or causes is not None) and \
+                not self.validate_links(node_id, causedBy, causes):
+            print(f"Node {node_id} not updated.")
+            return
+
+        # Outcomes fed by the node before the edit may lose it as a cause
+        affected = self.index.downstream_outcomes([node_id])
+
         # Update each attribute if it's provided
-        if title is not None:
-            self.nodes_sheet.update(f'B{row_index}', [[title]])
-        if description is not None:
-            self.nodes_sheet.update(f'C{row_index}', [[description]])
-        if causedBy is not None:
-            self.nodes_sheet.update(f'D{row_index}', [[causedBy]])
-        if causes is not None:
-            self.nodes_sheet.update(f'E{row_index}', [[causes]])
-        if probability is not None:
-            self.nodes_sheet.update(f'F{row_index}', [[probability]])
-        if severity is not None:
-            self.nodes_sheet.update(f'G{row_index}', [[severity]])
+        changes = {
+            field: value for field, value in [
+                ('title', title), ('description', description),
+                ('causedBy', causedBy), ('causes', causes),
+                ('probability', probability), ('severity', severity)
+            ] if value is not None
+        }
+
+        with self.transaction() as tx:
+            tx.update('nodes', row_index, changes)
+            self.drop_links(tx, node_id, causedBy, causes)
 
         print(f"Node {node_id} updated successfully.")
 
         # Update probabilities and severities if necessary
-        self.calculate_outcome_probabilities_and_severities()
+        if changes.keys() & self.RECOMPUTE_FIELDS:
+            affected |= self.index.downstream_outcomes([node_id])
+            self.calculate_outcome_probabilities_and_severities(affected)
+
+    def drop_links(self, tx, node_id, causedBy=None, causes=None):
+        """
+        Remove the links a node edit dropped from the other side too.
+
+        A link is followed when either end lists it, so replacing the
+        node's own causedBy or causes is not enough to remove a link
+        stored on the cause or outcome at the other end.
+        """
+        index = self.index
+        node_id = to_id(node_id)
+        dropped = []
+        for value, edges, field in ((causedBy, index.parents, 'causes'),
+                                    (causes, index.children, 'causedBy')):
+            if value is not None:
+                kept = set(parse_ids(value))
+                dropped.extend((other_id, field)
+                               for other_id in edges.get(node_id, ())
+                               if other_id not in kept)
+
+        for other_id, field in dropped:
+            for table, records, rows in (
+                    ('nodes', index.nodes, index.node_rows),
+                    ('outcomes', index.outcomes, index.outcome_rows)):
+                record = records.get(other_id)
+                if record is None or field not in record:
+                    continue
+                ids = parse_ids(record[field])
+                if node_id in ids:
+                    tx.update(table, rows[other_id], {field: ', '.join(
+                        str(i) for i in ids if i != node_id
+                    )})
 
     def print_nodes(self):
         """Print nodes in a formatted table."""
-        nodes = self.nodes_sheet.get_all_records()
-        outcomes = self.outcomes_sheet.get_all_records()
+        nodes = self.get_nodes()
+        outcomes = self.get_outcomes()
 
         # Print header for nodes
         self.print_table_header("Causes")
@@ -318,18 +543,12 @@ class DAG:
         if node_id_to_edit is None:
             self.print_nodes()
             prompt_msg = "\nEnter the ID of the node to edit (or 'exit'): "
-            node_id_to_edit = validate_input(prompt_msg, int)
+            node_id_to_edit = validate_input(prompt_msg)
 
             if node_id_to_edit.lower() == 'exit':
                 return
 
-        # Fetch all nodes and convert node_ids to string for comparison
-        nodes = self.nodes_sheet.get_all_records()
-        node_to_edit = next(
-            (node for node in nodes
-                if str(node['node_id']) == node_id_to_edit),
-            None
-        )
+        node_to_edit = self.index.node(node_id_to_edit)
 
         if not node_to_edit:
             print(f"No node found with ID {node_id_to_edit}")
@@ -365,28 +584,92 @@ class DAG:
 
     def delete_node(self, node_id):
         """Delete a node from the DAG."""
-        nodes = self.nodes_sheet.get_all_records()
-        row_index = next(
-            (i for i, node in enumerate(nodes, start=2)
-             if str(node['node_id']) == str(node_id)), None)
-
-        if not row_index:
+        if not self.index.node_row(node_id):
             print(f"No node found with ID {node_id}")
             return
 
-        self.nodes_sheet.delete_rows(row_index)
-        print(f"Node {node_id} deleted successfully.")
+        self.delete_items([node_id])
+
+    def delete_items(self, item_ids):
+        """
+        Delete nodes and outcomes together with every link to them.
+
+        Links to the deleted items are stripped from the remaining rows in
+        one write transaction, then the rows of each table are removed
+        with one request, bottom row first so the row indices still to be
+        deleted never shift. Only outcomes downstream of a deleted item
+        are recalculated. Returns the ids that were deleted.
+        """
+        index = self.index
+        deleted = set()
+        for item_id in item_ids:
+            if index.exists(to_id(item_id)):
+                deleted.add(to_id(item_id))
+            else:
+                print(f"No node or outcome found with ID {item_id}")
+        if not deleted:
+            return deleted
+
+        affected = index.downstream_outcomes(deleted) - deleted
+
+        # Every row linking to a deleted item is a parent or child of it
+        linked = set()
+        for item_id in deleted:
+            linked.update(index.parents.get(item_id, ()))
+            linked.update(index.children.get(item_id, ()))
+
+        tables = (('nodes', index.nodes, index.node_rows),
+                  ('outcomes', index.outcomes, index.outcome_rows))
+        with self.transaction() as tx:
+            for table, records, rows in tables:
+                for item_id in sorted(linked & records.keys() - deleted):
+                    record = records[item_id]
+                    changes = {}
+                    for field, ids in (('causedBy', record.caused_by),
+                                       ('causes', record.causes)):
+                        kept = [i for i in ids if i not in deleted]
+                        if len(kept) != len(ids):
+                            changes[field] = ', '.join(map(str, kept))
+                    if changes:
+                        tx.update(table, rows[item_id], changes)
+
+        for table, _, rows in tables:
+            refs = sorted(((rows[item_id], item_id) for item_id in deleted
+                           if item_id in rows), reverse=True)
+            if refs:
+                self.delete_rows(table, refs)
+        self.reset_order()
+
+        print(f"Deleted {', '.join(map(str, sorted(deleted)))} and the "
+              "links to them.")
+        if affected:
+            self.calculate_outcome_probabilities_and_severities(affected)
+        return deleted
+
+    def delete_rows(self, table, refs):
+        """Delete (row, id) refs from the backend, then from the cache."""
+        try:
+            with self.cache.writing():
+                self.backend.delete_rows(table, refs)
+        except Exception:
+            # The snapshot was out of date; re-read it on next use
+            self.cache.invalidate(table)
+            raise
+        for row, _ in refs:
+            self.cache.delete_record(table, row)
 
     def delete_node_ui(self):
-        """Interface for deleting a node."""
+        """Interface for deleting nodes and outcomes."""
         self.print_nodes()
-        node_id = validate_input(
-            "\nEnter the ID of the node to delete (or 'exit'): ", int
+        item_ids = validate_input(
+            "\nEnter the IDs of the nodes or outcomes to delete, "
+            "comma-separated (or 'exit'): "
         )
-        if node_id.lower() == 'exit':
+        if item_ids.lower() == 'exit':
             return
 
-        self.delete_node(node_id)
+        self.delete_items(token.strip() for token in item_ids.split(',')
+                          if token.strip())
 
     def add_outcome(self):
         """Add a new outcome to the DAG."""
@@ -394,22 +677,125 @@ class DAG:
         title = validate_input("Enter outcome title: ")
         description = validate_input("Enter outcome description: ")
         causedBy = validate_input("Enter Caused By "
-                                  "(comma-separated node IDs): ", int)
-        probability = validate_input("Enter Probability (1 - 100): ", 1, 100)
+                                  "(comma-separated node IDs): ")
+        probability = validate_input(
+            "Enter Probability (1 - 100): ", int, 1, 100
+        )
         severity = validate_input("Enter Severity (1 - 10): ", int, 1, 10)
 
         outcome_id = self.generate_unique_id()
+        if not self.validate_links(outcome_id, causedBy):
+            print("Outcome not added. Please try again.")
+            return
 
-        self.outcomes_sheet.append_row([
+        row = [
             outcome_id, title, description, causedBy, probability, severity
-        ])
+        ]
+        with self.transaction() as tx:
+            tx.append('outcomes', dict(zip(OUTCOME_FIELDS, row)))
         print(f"\nOutcome {title} added successfully.\n")
 
+    def import_ui(self, path=None):
+        """Interface for importing nodes and outcomes from a file."""
+        path = path or validate_input(
+            "\nEnter the path of the CSV or JSONL file to import: "
+        )
+        try:
+            nodes, outcomes = import_graph(self, path)
+        except (OSError, ValueError) as error:
+            print(f"\nImport failed: {error}\n")
+            return
+        print(f"\nImported {nodes} causes and {outcomes} outcomes.\n")
+
+    def export_ui(self, path=None):
+        """Interface for exporting nodes and outcomes to a file."""
+        path = path or validate_input(
+            "\nEnter the path of the CSV or JSONL file to export to: "
+        )
+        try:
+            count = export_graph(self, path)
+        except (OSError, ValueError) as error:
+            print(f"\nExport failed: {error}\n")
+            return
+        print(f"\nExported {count} records to {path}.\n")
+
+    def simulate_ui(self, trials=None, workers=1, seed=None):
+        """Estimate outcome risk by Monte Carlo simulation and print it."""
+        trials = trials or validate_input(
+            "\nEnter the number of trials (1000 - 10000000): ", int,
+            1000, 10000000
+        )
+        print(f"\nSimulating {trials} trials...\n")
+        started = time.perf_counter()
+        try:
+            risks = simulate(self.index, self.rule, trials, workers, seed)
+        except RuntimeError as error:
+            print(f"{error}\n")
+            return
+
+        print(f"{'ID':<7}{'Outcome':<20}{'Simulated':>10}"
+              f"{'95% interval':>18}{'Severity':>10}{'Calculated':>12}")
+        print("-" * 77)
+        for outcome_id, risk in risks.items():
+            outcome = self.index.outcomes[outcome_id]
+            color = self.determine_color(risk.probability)
+            interval = f"{risk.low:.2f} - {risk.high:.2f}%"
+            calculated = outcome.get('probability', '')
+            print(f"{outcome_id:<7}{str(outcome['title'])[:19]:<20}"
+                  f"{color}{risk.probability:>9.2f}%{self.RESET}"
+                  f"{interval:>18}{risk.severity:>10.1f}"
+                  f"{calculated!s:>11}{'%' if calculated != '' else ' '}")
+        if not risks:
+            print("No outcomes with causes to simulate.")
+        print(f"\nSimulated in {time.perf_counter() - started:.1f} s. "
+              "Severity is the expected severity of the worst path when "
+              "the outcome occurs.\n")
+
+    def critical_paths_ui(self, k=None, outcome_id=None):
+        """Print the riskiest chains of causes leading to the outcomes."""
+        if k is None:
+            k = validate_input("\nHow many paths (1 - 100): ", int, 1, 100)
+            outcome_id = input("Outcome ID (leave blank for all outcomes): ")
+            outcome_id = to_id(outcome_id) if outcome_id.strip() else None
+        if k < 1:
+            print("\nThe number of paths must be at least 1.\n")
+            return
+        index = self.index
+        if outcome_id is not None and index.outcome(outcome_id) is None:
+            print(f"\nNo outcome found with ID {outcome_id}\n")
+            return
+
+        paths = self.critical_paths(k)
+        if outcome_id is not None:
+            ranked = paths.get(outcome_id, [])
+        else:
+            ranked = heapq.nlargest(
+                k, itertools.chain.from_iterable(paths.values()),
+                key=lambda path: path.risk
+            )
+
+        print(f"\n{'#':>3}  {'Risk':>8}{'Probability':>13}{'Severity':>10}"
+              "  Outcome")
+        print("-" * 77)
+        for rank, path in enumerate(ranked, start=1):
+            color = self.determine_color(path.probability)
+            outcome = index.outcomes[path.path[-1]]
+            print(f"{rank:>3}. {path.risk:>8.2f}"
+                  f"{color}{path.probability:>12.2f}%{self.RESET}"
+                  f"{path.severity:>10g}  {outcome.title[:40]}")
+            print("      " + " -> ".join(
+                f"{index.nodes[item_id].title[:20]} (#{item_id})"
+                for item_id in path.path[:-1]
+            ))
+        if not ranked:
+            print("No paths from a cause to an outcome.")
+        print("\nProbability is the chance of every cause on the path "
+              "occurring, severity the\nhighest along it, and risk their "
+              "product.\n")
+
     def display_outcome(self, outcome_id):
         """Display a single outcome's details."""
-        outcomes = self.outcomes_sheet.get_all_records()
-        outcome = next((o for o in outcomes if str(o['outcome_id']) ==
-                        str(outcome_id)), None)
+        outcome = self.index.outcome(outcome_id)
 
         if not outcome:
             print(f"No outcome found with ID {outcome_id}")
@@ -421,111 +807,224 @@ class DAG:
         print(f"  Probability: {outcome.get('probability', 'N/A')}%")
         print(f"  Severity: {outcome.get('severity', 'N/A')}\n")
 
-    def calculate_outcome_probabilities_and_severities(self):
+    def recompute_outcomes(self, node_ids):
+        """Recalculate only the outcomes downstream of the given nodes."""
+        affected = self.index.downstream_outcomes(node_ids)
+        if affected:
+            self.calculate_outcome_probabilities_and_severities(affected)
+
+    def recompute_all_outcomes(self):
+        """Recalculate every outcome, e.g. after edits made elsewhere."""
+        self.calculate_outcome_probabilities_and_severities()
+
+    def calculate_outcome_probabilities_and_severities(self,
+                                                       outcome_ids=None):
+        """
+        Recalculate outcome probabilities and severities.
+
+        Args:
+            outcome_ids: (Optional) Outcomes to recalculate. All outcomes
+                are recalculated when omitted.
+        """
         print("\nCalculating outcome probabilities and severities...\n")
-        outcomes_sheet = SHEET.worksheet('outcomes')
-        outcomes = outcomes_sheet.get_all_records()
-        nodes = self.nodes_sheet.get_all_records()
+        index = self.index
 
-        if not outcomes:
+        if not index.outcomes:
             print("No outcomes found.\n")
             return
 
-        for i, outcome in enumerate(outcomes, start=2):
-            # Split causedBy by comma and strip spaces
-            causedBy_ids = [id.strip() for id in str(outcome.get(
-                'causedBy', '')).split(',')]
-            print(f"Processing outcome {outcome['title']} with causes...\n")
-            total_probability, total_severity, count = 0, 0, 0
-
-            for node_id in causedBy_ids:
-                if node_id:  # Check if node_id is not empty
-                    node = next((n for n in nodes if str(n['node_id']) ==
-                                node_id), None)
-                    if node:
-                        node_probability = int(node.get('probability', 0))
-                        node_severity = int(node.get('severity', 0))
-
-                        total_probability += int(node.get('probability', 0))
-                        total_severity = max(total_severity,
-                                             int(node.get('severity', 0)))
-                        count += 1
+        outcomes = [
+            (outcome_id, outcome)
+            for outcome_id, outcome in index.outcomes.items()
+            if outcome_ids is None or outcome_id in outcome_ids
+        ]
+
+        results = self.propagation()
+
+        with self.transaction() as tx:
+            for outcome_id, outcome in outcomes:
+                print(f"Processing outcome {outcome['title']} "
+                      "with causes...\n")
+
+                for node_id in sorted(index.parents.get(outcome_id, ())):
+                    if node_id in results:
+                        node_probability, node_severity = results[node_id]
                         print(
                             f"Node ID {node_id} contributes with "
-                            f"{node_probability}% probability and severity "
-                            f"of {node_severity}\n"
+                            f"{node_probability:g}% probability and "
+                            f"severity of {node_severity:g}\n"
                             )
                     else:
                         print(f"Node ID {node_id} not found in nodes")
 
-            if count > 0:
-                average_probability = total_probability / count
-                outcomes_sheet.update(f'E{i}', [[average_probability]])
-                outcomes_sheet.update(f'F{i}', [[total_severity]])
+                if outcome_id in results:
+                    probability, severity = results[outcome_id]
+                    probability = round(probability, 2)
+                    severity = int(severity)
+                    if self.is_unchanged(outcome, probability, severity):
+                        print(f"Outcome ID {outcome_id} is up to date\n")
+                        continue
 
-                print(f"Updating outcome ID {outcome['outcome_id']} with "
-                      f"probability {average_probability} and severity "
-                      f"{total_severity}\n")
+                    tx.update('outcomes', index.outcome_rows[outcome_id], {
+                        'probability': probability,
+                        'severity': severity
+                    })
+
+                    print(f"Updating outcome ID {outcome_id} with "
+                          f"probability {probability} and severity "
+                          f"{severity}\n")
 
         print("Outcome probabilities and severities updated.")
 
+    def is_unchanged(self, outcome, probability, severity):
+        """Check whether an outcome already stores the given values."""
+        try:
+            return (float(outcome.get('probability')) == probability and
+                    float(outcome.get('severity')) == severity)
+        except (TypeError, ValueError):
+            return False
+
     def visualize_simple_graph(self):
-        outcomes = self.outcomes_sheet.get_all_records()
-        nodes = self.nodes_sheet.get_all_records()
+        index = self.index
 
         print("\nSimplified Graph View:")
         print("------------------------------------------------------")
 
-        for outcome in outcomes:
-            outcome_probability = outcome.get('probability', '0')
-            # Handling empty string for probability
-            if outcome_probability.strip():
-                outcome_probability = int(outcome_probability)
-            else:
-                outcome_probability = 0
-            outcome_color = self.determine_color(outcome_probability)
-            print(f"\n{outcome_color}Outcome: {outcome['title']}"
+        for outcome_id, outcome in index.outcomes.items():
+            outcome_color = self.determine_color(outcome.probability)
+            print(f"\n{outcome_color}Outcome: {outcome.title}"
                   f"{self.RESET}\n"
                   )
-            # Split the function call over two lines
-            self.display_causes_for_outcome(
-                outcome['outcome_id'], outcome['title'], nodes, 1)
+            self.display_causes_for_outcome(outcome_id, outcome.title, 1)
             print()
 
-    def display_causes_for_outcome(self, outcome_id, title, nodes, level):
-        causing_nodes = [
-            node for node in nodes
-            if str(outcome_id) in str(node.get('causes', '')).split(',')
-        ]
-        for node in causing_nodes:
-            node_color = self.determine_color(int(node.get('probability', 0)))
-            print("  " * (level - 1) + f"{node_color}{node['title']}"
-                  f"{self.RESET} ==> {title}")
-
-            if node.get('causedBy', ''):
-                self.display_causes_for_node(
-                    node['node_id'], node['title'], nodes, level + 1)
+    def display_causes_for_outcome(self, outcome_id, title, level):
+        self.display_causes_for_node(outcome_id, title, level)
 
-    def display_causes_for_node(self, node_id, title, nodes, level):
-        causing_nodes = [
-            node for node in nodes
-            if str(node_id) in str(node.get('causes', '')).split(',')
-        ]
-        for node in causing_nodes:
-            node_color = self.determine_color(int(node.get('probability', 0)))
-            print("  " * (level - 1) + f"{node_color}{node['title']}"
+    def display_causes_for_node(self, node_id, title, level):
+        index = self.index
+        for cause_id in index.causes_of(node_id):
+            node = index.nodes[cause_id]
+            node_color = self.determine_color(node.probability)
+            print("  " * (level - 1) + f"{node_color}{node.title}"
                   f"{self.RESET} ==> {title}"
                   )
 
-            if node.get('causedBy', ''):
+            if index.parents.get(cause_id):
                 self.display_causes_for_node(
-                    node['node_id'], node['title'], nodes, level + 1
+                    cause_id, node.title, level + 1
                 )
 
+    def compact_graph_lines(self, max_depth=None):
+        """
+        Yield the lines of the compact graph view one at a time.
+
+        Each cause is expanded once; later appearances print a
+        back-reference to its first appearance instead of repeating the
+        subtree, so the output grows with the number of edges. With a
+        max depth, a cause first met deeper than a later appearance is
+        expanded again there, so none of its causes in reach are hidden.
+        """
+        index = self.index
+        visited = {}
+
+        for outcome_id, outcome in index.outcomes.items():
+            outcome_color = self.determine_color(outcome.probability)
+            yield (f"\n{outcome_color}Outcome: {outcome.title}"
+                   f"{self.RESET}\n")
+
+            walk = walk_causes(index, outcome_id, visited, max_depth)
+            for level, cause_id, effect_id, status in walk:
+                node = index.nodes[cause_id]
+                effect = index.nodes.get(effect_id, outcome)
+                node_color = self.determine_color(node.probability)
+                line = ("  " * (level - 1) + f"{node_color}#{cause_id} "
+                        f"{node.title}{self.RESET} ==> {effect.title}")
+                if status == 'seen':
+                    line += f" (see #{cause_id} above)"
+                elif status == 'cycle':
+                    line += " [cycle]"
+                elif status == 'truncated':
+                    line += " [...]"
+                yield line
+
+    def visualize_compact_graph(self):
+        """Print the compact graph view, streaming it line by line."""
+        max_depth = None
+        while True:
+            depth = input("Max depth (leave blank for no limit): ").strip()
+            if not depth:
+                break
+            if depth.isdigit() and int(depth) > 0:
+                max_depth = int(depth)
+                break
+            print("Please enter a positive number or leave blank.")
+
+        print("\nCompact Graph View:")
+        print("------------------------------------------------------")
+        for line in self.compact_graph_lines(max_depth):
+            print(line)
+        print()
+
+    def search(self, **filters):
+        """
+        Return the ids of the nodes and outcomes matching the filters.
+
+        See ``search.SearchIndex.search`` for the filters.
+        """
+        self.search_index.refresh(self.cache)
+        return self.search_index.search(self.index, **filters)
+
+    def search_ui(self, args=None):
+        """Interface for searching nodes and outcomes."""
+        if args is None:
+            parser = commands.CommandParser(prog='search', add_help=False)
+            add_query_arguments(parser)
+            print("\nFilter by text and options such as --words, "
+                  "--min-probability, --max-severity, --upstream-of ID, "
+                  "--downstream-of ID or --type outcome.")
+            query = validate_input("Search: ")
+            try:
+                args = parser.parse_args(shlex.split(query))
+            except (commands.CommandError, ValueError) as error:
+                print(f"\nInvalid search: {error}\n")
+                return
+
+        index = self.index
+        for item_id in (args.upstream_of, args.downstream_of):
+            if item_id is not None and not index.exists(item_id):
+                print(f"\nNo node or outcome found with ID {item_id}\n")
+                return
+
+        ids = self.search(**query_filters(args))
+        shown = ids[:args.limit]
+        self.print_table_header("Causes")
+        self.print_table_contents(
+            [index.nodes[i] for i in shown if i in index.nodes]
+        )
+        self.print_table_header("Outcomes")
+        self.print_table_contents(
+            [index.outcomes[i] for i in shown if i in index.outcomes],
+            is_outcome=True
+        )
+        more = f", showing the first {len(shown)}" \
+            if len(ids) > len(shown) else ''
+        print(f"\n{len(ids)} match(es){more}.\n")
+
+    def browse(self):
+        """
+        Page through the table and tree views in a scrollable window.
+
+        Falls back to the printed table when the terminal cannot run
+        the viewer.
+        """
+        if not viewer.browse(self):
+            self.print_nodes()
+
     def determine_color(self, probability):
         # Convert empty string to 0
         try:
-            probability = int(probability) if probability else 0
+            probability = float(probability) if probability else 0
         except ValueError:
             probability = 0
 
@@ -537,36 +1036,208 @@ class DAG:
             return self.RED
 
 
-def main():
-    print("\nWelcome to DagTui - A Terminal UI for Directed Acyclic Graphs\n")
-    dag = DAG()
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(
+        description="DagTui - A Terminal UI for Directed Acyclic Graphs"
+    )
+    parser.add_argument(
+        '--backend', choices=BACKENDS,
+        help="storage backend (default: $DAG_BACKEND or 'sheets')"
+    )
+    parser.add_argument(
+        '--db', help="SQLite database file (default: $DAG_SQLITE_PATH)"
+    )
+    parser.add_argument(
+        '--rule', choices=COMBINE_RULES, default=COMBINE_RULE,
+        help="how cause probabilities combine (default: $DAG_COMBINE_RULE "
+             "or 'average')"
+    )
+    parser.add_argument(
+        '--timing', action='store_true', default=TIMING,
+        help="report startup and connection times (or set $DAG_TIMING)"
+    )
+    parser.add_argument(
+        '--profile', action='store_true', default=PROFILE,
+        help="time storage requests and DAG operations and print a "
+             "summary on exit (or set $DAG_PROFILE)"
+    )
+    parser.add_argument(
+        '--profile-json', metavar='FILE', default=PROFILE_JSON,
+        help="also write the profile to a JSON file"
+    )
+    parser.add_argument(
+        '--profile-dump', metavar='FILE', default=PROFILE_DUMP,
+        help="also write a cProfile dump for pstats"
+    )
+    parser.add_argument(
+        '--import', dest='import_path', metavar='FILE',
+        help="import nodes and outcomes from a CSV or JSONL file and exit"
+    )
+    parser.add_argument(
+        '--export', dest='export_path', metavar='FILE',
+        help="export nodes and outcomes to a CSV or JSONL file and exit"
+    )
+    parser.add_argument(
+        '--verbose', action='store_true',
+        help="show outcome recalculation details for commands"
+    )
+    subparsers = parser.add_subparsers(
+        dest='command', metavar='COMMAND',
+        description="run a command without the menu, then exit"
+    )
+    commands.add_command_parsers(subparsers)
+    simulate_parser = subparsers.add_parser(
+        'simulate', help="estimate outcome risk by Monte Carlo simulation"
+    )
+    simulate_parser.add_argument('--trials', type=int, default=100000,
+                                 help="number of trials (default: 100000)")
+    simulate_parser.add_argument(
+        '--workers', type=int, default=1,
+        help="processes to spread the trials over (default: 1)"
+    )
+    simulate_parser.add_argument('--seed', type=int,
+                                 help="random seed, for repeatable results")
+    add_query_arguments(subparsers.add_parser(
+        'query', help="search nodes and outcomes by text, values or links"
+    ))
+    paths_parser = subparsers.add_parser(
+        'paths', help="list the riskiest chains of causes to the outcomes"
+    )
+    paths_parser.add_argument('-k', type=int, default=10,
+                              help="number of paths (default: 10)")
+    paths_parser.add_argument('--outcome', type=int, metavar='ID',
+                              help="only paths leading to this outcome")
+    args = parser.parse_args(argv)
+    if args.db and (args.backend or DEFAULT_BACKEND) != 'sqlite':
+        parser.error("--db only applies to the sqlite backend")
+    return args
+
+
+def report_timing(backend):
+    """Print how long the backend took to connect, if it connected."""
+    connect_seconds = getattr(backend, 'connect_seconds', None)
+    if connect_seconds is not None:
+        print(f"\n[timing] {backend.name} backend connected in "
+              f"{connect_seconds * 1000:.1f} ms")
+    scheduler = getattr(backend, 'scheduler', None)
+    if scheduler is not None:
+        print(f"[quota] {scheduler.report()}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    backend_options = {'path': args.db} if args.db else {}
+    if not args.command:
+        print("\nWelcome to DagTui - A Terminal UI for Directed Acyclic "
+              "Graphs\n")
+    # One-shot runs lease exactly the ids they use, so running several
+    # in a row does not leave a gap of unused ids after each
+    one_shot = args.command or args.import_path or args.export_path
+    dag = DAG(create_backend(args.backend, **backend_options),
+              rule=args.rule,
+              id_block_size=1 if one_shot else ID_BLOCK_SIZE)
+    if args.timing:
+        print(f"[timing] menu ready in "
+              f"{(time.perf_counter() - STARTED) * 1000:.1f} ms "
+              "(backend connects on first use)")
+        atexit.register(report_timing, dag.backend)
+    if args.profile or args.profile_json or args.profile_dump:
+        profiler = Profiler(cprofile=bool(args.profile_dump))
+        profiler.instrument_input()
+        profiler.instrument_backend(dag.backend)
+        profiler.instrument(dag)
+        atexit.register(profiler.finish, args.profile_json,
+                        args.profile_dump)
+    if args.command == 'simulate':
+        dag.simulate_ui(args.trials, args.workers, args.seed)
+        return
+    if args.command == 'query':
+        dag.search_ui(args)
+        return
+    if args.command == 'paths':
+        dag.critical_paths_ui(args.k, args.outcome)
+        return
+    if args.command:
+        return commands.main(dag, args)
+    if args.import_path or args.export_path:
+        if args.import_path:
+            dag.import_ui(args.import_path)
+        if args.export_path:
+            dag.export_ui(args.export_path)
+        return
+
     while True:
+        try:
+            dag.sync()
+        except RemoteError as error:
+            print(f"\nError: {error}. Showing the data as of the last "
+                  "successful sync.")
         print("\nWhat would you like to do?\n")
         print("1. View nodes/outcomes (verbose view)")
         print("2. View graph (graphical view)")
         print("3. Edit nodes")
         print("4. Add nodes")
         print("5. Add outcomes")
-        print("6. Delete nodes")
-        print("7. Exit")
-
-        choice = validate_input("\nEnter your choice (1-7): ", int, 1, 7)
-        if choice == 1:
-            dag.visualize()
-        if choice == 2:
-            dag.visualize_simple_graph()
-        elif choice == 3:
-            dag.edit_nodes()
-        elif choice == 4:
-            dag.add_node()
-        elif choice == 5:
-            dag.add_outcome()
-        elif choice == 6:
-            dag.delete_node_ui()
-        elif choice == 7:
+        print("6. Delete nodes or outcomes")
+        print("7. View graph (compact view for large graphs)")
+        print("8. Recompute all outcomes")
+        print("9. Import from file")
+        print("10. Export to file")
+        print("11. Refresh data")
+        print("12. Simulate outcome risk")
+        print("13. Browse graph (scrollable view for large graphs)")
+        print("14. Search nodes and outcomes")
+        print("15. Show critical risk paths")
+        print("16. Exit")
+
+        choice = validate_input("\nEnter your choice (1-16): ", int, 1, 16)
+        try:
+            if choice == 1:
+                dag.visualize()
+            if choice == 2:
+                dag.visualize_simple_graph()
+            elif choice == 3:
+                dag.edit_nodes()
+            elif choice == 4:
+                dag.add_node()
+            elif choice == 5:
+                dag.add_outcome()
+            elif choice == 6:
+                dag.delete_node_ui()
+            elif choice == 7:
+                dag.visualize_compact_graph()
+            elif choice == 8:
+                dag.recompute_all_outcomes()
+            elif choice == 9:
+                dag.import_ui()
+            elif choice == 10:
+                dag.export_ui()
+            elif choice == 11:
+                dag.refresh()
+            elif choice == 12:
+                dag.simulate_ui()
+            elif choice == 13:
+                dag.browse()
+            elif choice == 14:
+                dag.search_ui()
+            elif choice == 15:
+                dag.critical_paths_ui()
+        except MissingRecordError as error:
+            # Another session moved or deleted the record; start over
+            # from fresh data
+            print(f"\nError: {error}, changed by another session. "
+                  "The data has been refreshed.")
+            dag.cache.invalidate()
+            continue
+        except RemoteError as error:
+            print(f"\nError: {error}. Changes may not have been saved; "
+                  "try again once the server is back.")
+            continue
+        if choice == 16:
             print("Exiting program.")
             break
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
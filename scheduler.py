@@ -0,0 +1,139 @@
+"""
+Quota-aware scheduling of Google Sheets requests.
+
+Google Sheets allows a fixed number of read and write requests per
+minute. Every request made by SheetsBackend goes through a
+RequestScheduler, which:
+
+- waits for a token from a per-kind token bucket instead of exceeding
+  the quota,
+- retries rate-limited and transient failures with jittered
+  exponential backoff,
+- counts everything so quota use can be reported.
+"""
+import collections
+import os
+import random
+import threading
+import time
+
+READ_QUOTA = int(os.environ.get('DAG_READ_QUOTA', 60))
+WRITE_QUOTA = int(os.environ.get('DAG_WRITE_QUOTA', 60))
+MAX_RETRIES = int(os.environ.get('DAG_MAX_RETRIES', 5))
+
+
+class TokenBucket:
+    """Allow ``capacity`` requests per minute, refilled continuously."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rate = capacity / 60
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take one token, sleeping until one is available.
+
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def available(self):
+        """Return the number of tokens currently available."""
+        with self.lock:
+            self._refill()
+            return self.tokens
+
+
+class RequestScheduler:
+    """Throttle and retry requests to a rate-limited API."""
+
+    def __init__(self, read_quota=READ_QUOTA, write_quota=WRITE_QUOTA,
+                 retryable=lambda error: False, max_retries=MAX_RETRIES,
+                 base_delay=1.0, max_delay=32.0):
+        self.quotas = {'read': read_quota, 'write': write_quota}
+        self.buckets = {kind: TokenBucket(quota)
+                        for kind, quota in self.quotas.items()}
+        self.retryable = retryable
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self._sent = {kind: collections.deque() for kind in self.quotas}
+        self.counters = collections.Counter()
+
+    def call(self, kind, function, retryable=None):
+        """
+        Run one request of the given kind ('read' or 'write').
+
+        ``retryable`` replaces the scheduler's own check for requests
+        that are only safe to repeat after some failures.
+        """
+        retryable = retryable or self.retryable
+        for attempt in range(self.max_retries + 1):
+            waited = self.buckets[kind].acquire()
+            with self.lock:
+                self.counters['throttled_seconds'] += waited
+                self.counters[f'{kind}s'] += 1
+                self._record_sent(kind)
+            try:
+                return function()
+            except Exception as error:
+                if attempt == self.max_retries or not retryable(error):
+                    with self.lock:
+                        self.counters['failures'] += 1
+                    raise
+            # Jitter keeps retrying sessions from hitting in lockstep
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            with self.lock:
+                self.counters['retries'] += 1
+            time.sleep(random.uniform(delay / 2, delay))
+
+    def _record_sent(self, kind):
+        """Remember when a request was sent, forgetting old ones."""
+        now = time.monotonic()
+        sent = self._sent[kind]
+        sent.append(now)
+        while sent and now - sent[0] > 60:
+            sent.popleft()
+
+    def stats(self):
+        """Return request counters and quota use over the last minute."""
+        now = time.monotonic()
+        with self.lock:
+            stats = dict(self.counters)
+            for kind, sent in self._sent.items():
+                while sent and now - sent[0] > 60:
+                    sent.popleft()
+                stats[f'{kind}s_last_minute'] = len(sent)
+                stats[f'{kind}_quota'] = self.quotas[kind]
+        for kind, bucket in self.buckets.items():
+            stats[f'{kind}_tokens'] = round(bucket.available(), 1)
+        return stats
+
+    def report(self):
+        """Format quota use as a short human readable summary."""
+        stats = self.stats()
+        return (
+            f"reads {stats['reads_last_minute']}/{stats['read_quota']} "
+            f"and writes {stats['writes_last_minute']}/"
+            f"{stats['write_quota']} in the last minute; "
+            f"{stats.get('retries', 0)} retries, "
+            f"{stats.get('throttled_seconds', 0):.1f}s throttled"
+        )
@@ -0,0 +1,227 @@
+"""
+Indexed search and filtering over nodes and outcomes.
+
+SearchIndex keeps an inverted index from the words of every title and
+description to the ids using them, and the probability and severity
+columns as sorted ``(value, id)`` lists, so each filter only touches the
+ids that can match it. It listens to the RecordCache: local writes are
+applied to the index as they happen, and a table that is refetched is
+re-indexed on the next query.
+
+Filters, all optional and combined with AND:
+
+- ``text``: case-insensitive substring of the title or description.
+- ``words``: every word must appear in the title or description.
+- ``probability``, ``severity``: inclusive ``(low, high)`` ranges;
+  either bound may be None.
+- ``upstream_of``, ``downstream_of``: ids that are a direct or indirect
+  cause, or effect, of the given id.
+- ``kind``: 'node' or 'outcome'.
+"""
+import bisect
+import re
+from collections import defaultdict
+
+from storage import FIELDS
+
+WORD = re.compile(r'\w+')
+
+NUMERIC_FIELDS = ('probability', 'severity')
+
+KINDS = {'node': 'nodes', 'outcome': 'outcomes'}
+
+
+def words_of(text):
+    """Return the set of lowercase words in a piece of text."""
+    return set(WORD.findall(str(text or '').lower()))
+
+
+class SearchIndex:
+    """Inverted word index and sorted numeric columns over the records."""
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.columns = {field: [] for field in NUMERIC_FIELDS}
+        # id -> (table, lowercase text, probability, severity)
+        self.entries = {}
+        self.stale = set(FIELDS)
+
+    # RecordCache listener interface
+
+    def reset(self, name):
+        """Forget a table so it is re-indexed before the next query."""
+        self.stale.add(name)
+
+    def upsert(self, name, record):
+        """Index a record that was added or changed locally."""
+        if name not in self.stale and record.id is not None:
+            self.discard(record.id)
+            self.add(name, record)
+
+    def remove(self, name, record):
+        """Drop a record that was deleted locally."""
+        if name not in self.stale:
+            self.discard(record.id)
+
+    # Maintenance
+
+    def add(self, name, record):
+        text = f"{record.title}\n{record.description}".lower()
+        for word in WORD.findall(text):
+            self.postings[word].add(record.id)
+        values = (record.probability, record.severity)
+        for field, value in zip(NUMERIC_FIELDS, values):
+            if value is not None:
+                bisect.insort(self.columns[field], (value, record.id))
+        self.entries[record.id] = (name, text) + values
+
+    def discard(self, item_id):
+        entry = self.entries.pop(item_id, None)
+        if entry is None:
+            return
+        _, text, *values = entry
+        for word in set(WORD.findall(text)):
+            self.postings[word].discard(item_id)
+            if not self.postings[word]:
+                del self.postings[word]
+        for field, value in zip(NUMERIC_FIELDS, values):
+            if value is not None:
+                column = self.columns[field]
+                position = bisect.bisect_left(column, (value, item_id))
+                if position < len(column) and \
+                        column[position] == (value, item_id):
+                    del column[position]
+
+    def rebuild(self, name, records):
+        """Replace the entries of one table with the given records."""
+        old = {item_id for item_id, entry in self.entries.items()
+               if entry[0] == name}
+        for item_id in old:
+            for word in set(WORD.findall(self.entries.pop(item_id)[1])):
+                self.postings[word].discard(item_id)
+                if not self.postings[word]:
+                    del self.postings[word]
+        for field in NUMERIC_FIELDS:
+            self.columns[field] = [entry for entry in self.columns[field]
+                                   if entry[1] not in old]
+        # Bulk load: append everything, then sort each column once
+        postings, entries, find_words = self.postings, self.entries, \
+            WORD.findall
+        probabilities, severities = (self.columns[field]
+                                     for field in NUMERIC_FIELDS)
+        for record in records:
+            item_id = record.id
+            if item_id is None or item_id in entries:
+                continue
+            text = f"{record.title}\n{record.description}".lower()
+            for word in find_words(text):
+                postings[word].add(item_id)
+            if record.probability is not None:
+                probabilities.append((record.probability, item_id))
+            if record.severity is not None:
+                severities.append((record.severity, item_id))
+            entries[item_id] = (name, text, record.probability,
+                                record.severity)
+        for column in self.columns.values():
+            column.sort()
+        self.stale.discard(name)
+
+    def refresh(self, cache):
+        """Re-index every table the cache replaced since the last query."""
+        for name in sorted(self.stale):
+            self.rebuild(name, cache.get(name))
+
+    # Queries
+
+    def in_range(self, field, low=None, high=None):
+        """Return the ids whose value of a numeric field is in range."""
+        column = self.columns[field]
+        start = 0 if low is None else bisect.bisect_left(column, (low,))
+        end = len(column) if high is None else \
+            bisect.bisect_right(column, (high, float('inf')))
+        return {item_id for _, item_id in column[start:end]}
+
+    def with_words(self, words):
+        """Return the ids whose title or description has every word."""
+        postings = sorted((self.postings.get(word, set()) for word in words),
+                          key=len)
+        return set(postings[0]).intersection(*postings[1:]) \
+            if postings else set(self.entries)
+
+    def containing(self, text):
+        """Return the ids whose title or description contains text."""
+        text = text.lower()
+        words = WORD.findall(text)
+        if words:
+            # Any match contains the longest word inside one of its words
+            longest = max(words, key=len)
+            candidates = set()
+            for word, ids in self.postings.items():
+                if longest in word:
+                    candidates |= ids
+        else:
+            candidates = self.entries
+        return {item_id for item_id in candidates
+                if text in self.entries[item_id][1]}
+
+    def search(self, graph, text=None, words=None, probability=None,
+               severity=None, upstream_of=None, downstream_of=None,
+               kind=None):
+        """Return the sorted ids matching every given filter."""
+        matches = []
+        if words:
+            matches.append(self.with_words(words_of(words)))
+        for field, bounds in zip(NUMERIC_FIELDS, (probability, severity)):
+            if bounds is not None and bounds != (None, None):
+                matches.append(self.in_range(field, *bounds))
+        if upstream_of is not None:
+            matches.append(graph.upstream([upstream_of]))
+        if downstream_of is not None:
+            matches.append(graph.downstream([downstream_of]))
+        if kind is not None:
+            matches.append(set(getattr(graph, KINDS[kind])))
+
+        if matches:
+            matches.sort(key=len)
+            ids = set(matches[0]).intersection(*matches[1:])
+            if text:
+                # The other filters already narrowed the ids to check
+                ids = {item_id for item_id in ids
+                       if item_id in self.entries and
+                       text.lower() in self.entries[item_id][1]}
+        elif text:
+            ids = self.containing(text)
+        else:
+            ids = set(self.entries)
+        return sorted(item_id for item_id in ids if item_id in self.entries)
+
+
+def add_query_arguments(parser):
+    """Add the search filters to an argparse parser."""
+    parser.add_argument('text', nargs='?',
+                        help="text the title or description contains")
+    parser.add_argument('--words',
+                        help="words the title or description must all have")
+    for field in NUMERIC_FIELDS:
+        parser.add_argument(f'--min-{field}', type=float, metavar='N')
+        parser.add_argument(f'--max-{field}', type=float, metavar='N')
+    parser.add_argument('--upstream-of', metavar='ID', type=int,
+                        help="only direct or indirect causes of ID")
+    parser.add_argument('--downstream-of', metavar='ID', type=int,
+                        help="only direct or indirect effects of ID")
+    parser.add_argument('--type', dest='kind', choices=tuple(KINDS))
+    parser.add_argument('--limit', type=int, default=50,
+                        help="most results to show (default: 50)")
+
+
+def query_filters(args):
+    """Return the keyword arguments of SearchIndex.search for parsed args."""
+    return {
+        'text': args.text,
+        'words': args.words,
+        'probability': (args.min_probability, args.max_probability),
+        'severity': (args.min_severity, args.max_severity),
+        'upstream_of': args.upstream_of,
+        'downstream_of': args.downstream_of,
+        'kind': args.kind,
+    }
@@ -0,0 +1,262 @@
+"""
+Shared DAG server.
+
+Holds the single connection to the storage backend and one record cache
+for every terminal session. Sessions run ``run.py --backend remote`` and
+talk to this process over a local socket using JSON lines:
+
+    {"method": "get_records", "params": {"table": "nodes"}}
+    {"result": [...]}            or            {"error": "..."}
+
+Writes from any session update the shared cache and bump its revision.
+The other sessions check it before each screen and fetch only the
+records changed since their last check, listed by a ChangeLog. The
+revision names the server instance too, as versions restart from 0 with
+every server; a session syncing from an earlier instance gets its tables
+in full.
+"""
+import argparse
+import collections
+import errno
+import json
+import os
+import socket
+import socketserver
+import threading
+import uuid
+
+from cache import CACHE_TTL, RecordCache
+from storage import BACKENDS, CHANGE_LOG_SIZE, DEFAULT_BACKEND
+from storage import DEFAULT_SOCKET, FIELDS
+from storage import MissingRecordError, create_backend
+
+
+class ChangeLog:
+    """
+    Ids of the records changed at each version of the shared cache.
+
+    Listens to the cache and keeps the newest ``size`` entries; a
+    session that last synced before them gets its tables in full.
+    """
+
+    def __init__(self, cache, size=CHANGE_LOG_SIZE):
+        self.cache = cache
+        self.entries = collections.deque(maxlen=size)
+        # Every change after this version is in the log
+        self.complete_after = cache.version
+
+    def add(self, name, item_id):
+        if len(self.entries) == self.entries.maxlen:
+            self.complete_after = self.entries[0][0]
+        self.entries.append((self.cache.version, name, item_id))
+
+    def reset(self, name):
+        self.add(name, None)
+
+    def upsert(self, name, record):
+        self.add(name, record.id)
+
+    remove = upsert
+
+    def changed_since(self, version):
+        """
+        Return {table: ids} changed after a version, or None if unknown.
+
+        An id of None means the whole table was replaced.
+        """
+        if version < self.complete_after:
+            return None
+        changed = {}
+        for entry_version, name, item_id in reversed(self.entries):
+            if entry_version <= version:
+                break
+            changed.setdefault(name, set()).add(item_id)
+        return changed
+
+
+class DAGService:
+    """Shared backend and cache, safe to call from several threads."""
+
+    METHODS = ('get_records', 'update_cells', 'append_rows', 'delete_rows',
+               'reserve_ids', 'revision', 'changes')
+
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.cache = RecordCache(backend, ttl=ttl)
+        self.log = ChangeLog(self.cache)
+        self.cache.listeners.append(self.log)
+        self.lock = threading.Lock()
+        self.instance = uuid.uuid4().hex
+
+    def handle(self, method, params):
+        """Run one request and return its JSON-serializable result."""
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown method '{method}'")
+        with self.lock:
+            return getattr(self, method)(**params)
+
+    def revision(self):
+        # Sync expired snapshots so edits made directly in the
+        # spreadsheet reach the sessions once per TTL, not per session
+        for table in FIELDS:
+            self.cache.get(table)
+        return self.instance, self.cache.version
+
+    def changes(self, since):
+        """Return the records changed after revision ``since``."""
+        revision = self.revision()
+        if since is None or since[0] != self.instance:
+            return revision, None
+        if since[1] == revision[1]:
+            return revision, {}
+        changed = self.log.changed_since(since[1])
+        if changed is None:
+            return revision, None
+
+        changes = {}
+        for table, ids in changed.items():
+            records = self.cache.get(table)
+            if None in ids:
+                changes[table] = ([dict(record) for record in records], None)
+                continue
+            found = {record.id: record for record in records
+                     if record.id in ids}
+            changes[table] = ([dict(found[item_id])
+                               for item_id in sorted(found)],
+                              sorted(ids - found.keys()))
+        return revision, changes
+
+    def get_records(self, table):
+        return [dict(record) for record in self.cache.get(table)]
+
+    def resolve(self, table, refs):
+        """
+        Map (row, id) pairs to current rows.
+
+        A session may address rows from a snapshot taken before another
+        session deleted or appended rows, so rows are checked against
+        the record id and looked up again if they moved.
+        """
+        records = self.cache.get(table)
+        id_field = FIELDS[table][0]
+        rows = {}
+        for ref in refs:
+            row, record_id = ref
+            if not (2 <= row < len(records) + 2 and
+                    str(records[row - 2][id_field]) == str(record_id)):
+                row = next(
+                    (i for i, record in enumerate(records, start=2)
+                     if str(record[id_field]) == str(record_id)), None
+                )
+            if row is None:
+                raise MissingRecordError(
+                    f"No record with ID {record_id} in {table}")
+            rows[ref] = row
+        return rows
+
+    def update_cells(self, table, updates):
+        rows = self.resolve(table, [(row, record_id)
+                                    for row, record_id, _, _ in updates])
+        updates = [(rows[(row, record_id)], record_id, field, value)
+                   for row, record_id, field, value in updates]
+        with self.cache.writing():
+            self.backend.update_cells(table, updates)
+        for row, _, field, value in updates:
+            self.cache.update_record(table, row, {field: value})
+
+    def append_rows(self, table, rows):
+        self.cache.get(table)
+        with self.cache.writing():
+            self.backend.append_rows(table, rows)
+        for row in rows:
+            self.cache.append_record(table, dict(zip(FIELDS[table], row)))
+
+    def delete_rows(self, table, refs):
+        rows = self.resolve(table, [tuple(ref) for ref in refs])
+        refs = [(row, record_id) for (_, record_id), row in rows.items()]
+        with self.cache.writing():
+            self.backend.delete_rows(table, refs)
+        for row in sorted({row for row, _ in refs}, reverse=True):
+            self.cache.delete_record(table, row)
+
+    def reserve_ids(self, count):
+        return self.backend.reserve_ids(count)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Serve JSON line requests from one session until it disconnects."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                result = self.server.service.handle(
+                    request['method'], request.get('params', {})
+                )
+                response = {'result': result}
+            except Exception as error:
+                response = {'error': f"{type(error).__name__}: {error}"}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class DAGServer(socketserver.ThreadingMixIn,
+                socketserver.UnixStreamServer):
+    """Threaded local socket server exposing a DAGService."""
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        if os.path.exists(socket_path):
+            # Only clear a socket left behind by a server that is gone
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.remove(socket_path)
+            else:
+                raise OSError(
+                    errno.EADDRINUSE,
+                    f"Another server is already listening on {socket_path}"
+                )
+            finally:
+                probe.close()
+        super().__init__(socket_path, RequestHandler)
+        self.service = service
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared DagTui server")
+    parser.add_argument(
+        '--backend', choices=[name for name in BACKENDS if name != 'remote'],
+        help="storage backend (default: $DAG_BACKEND or 'sheets')"
+    )
+    parser.add_argument(
+        '--db', help="SQLite database file (default: $DAG_SQLITE_PATH)"
+    )
+    parser.add_argument(
+        '--socket', default=DEFAULT_SOCKET,
+        help="socket path (default: $DAG_SOCKET)"
+    )
+    args = parser.parse_args(argv)
+    if (args.backend or DEFAULT_BACKEND) == 'remote':
+        parser.error("the server needs a real backend, not 'remote'")
+    if args.db and (args.backend or DEFAULT_BACKEND) != 'sqlite':
+        parser.error("--db only applies to the sqlite backend")
+
+    backend_options = {'path': args.db} if args.db else {}
+    service = DAGService(create_backend(args.backend, **backend_options))
+    try:
+        server = DAGServer(args.socket, service)
+    except OSError as error:
+        parser.error(error.strerror or str(error))
+    with server:
+        print(f"DagTui server listening on {args.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Monte Carlo simulation of outcome risk.
+
+Each trial samples whether every node occurs and pushes the result
+through the graph in topological order, following the same model as
+``graph.propagate``: a node occurs with its own probability, and only
+if its causes let it (when it has any); an outcome occurs when its
+causes let it. How several causes combine depends on the rule:
+
+- ``noisy_or``: any one cause occurring is enough.
+- ``average``: one cause, picked at random in each trial, must occur.
+- ``max``: the most likely cause must occur.
+
+For independent causes these give the same probabilities as the
+analytic propagation, but the simulation also accounts for causes that
+share ancestors, and measures how often each outcome occurs together
+with how severe the worst path to it was.
+
+Trials are simulated 64 at a time as bits of NumPy ``uint64`` words, one
+array per node with one bit per trial, so a trial costs a fraction of an
+operation per node. NumPy is optional and only needed here; install it
+with ``pip install numpy``.
+"""
+import collections
+import math
+import os
+
+from graph import propagate, topological_order
+
+# Trials simulated together in one set of arrays
+CHUNK_TRIALS = int(os.environ.get('DAG_SIMULATION_CHUNK', 1 << 18))
+
+# Probabilities are rounded to a multiple of 1 / 2 ** PRECISION_BITS
+PRECISION_BITS = 10
+
+# z score of the reported confidence interval
+Z_95 = 1.959964
+
+OutcomeRisk = collections.namedtuple(
+    'OutcomeRisk', ['probability', 'low', 'high', 'severity', 'trials']
+)
+
+
+def import_numpy():
+    """Import NumPy, explaining how to install it if it is missing."""
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError(
+            "The simulation needs NumPy. Install it with 'pip install numpy'."
+        ) from None
+    return numpy
+
+
+def build_model(index, rule='average'):
+    """
+    Flatten the graph into a picklable list of steps in topological order.
+
+    Each step is (item_id, probability as a fraction of
+    2 ** PRECISION_BITS or None for outcomes, severity, cause positions,
+    combination). Items on cycles and outcomes without causes are left
+    out, as in ``propagate``. Returns (steps, severity levels).
+    """
+    order, _ = topological_order(index)
+    analytic = propagate(index, rule, order) if rule == 'max' else {}
+    position = {}
+    steps = []
+    for item_id in order:
+        causes = [position[parent_id]
+                  for parent_id in sorted(index.parents.get(item_id, ()))
+                  if parent_id in position]
+        node = index.nodes.get(item_id)
+        if node is None and not causes:
+            continue
+        if rule == 'max' and len(causes) > 1:
+            # Only the cause with the highest probability counts
+            causes = [max(causes, key=lambda pos: analytic.get(
+                steps[pos][0], (0, 0))[0])]
+        combination = 'any' if rule in ('noisy_or', 'max') else 'pick'
+        if node is None:
+            probability, severity = None, 0
+        else:
+            probability = min(1.0, max(0.0, (node.probability or 0) / 100))
+            probability = round(probability * 2 ** PRECISION_BITS)
+            severity = node.severity or 0
+        position[item_id] = len(steps)
+        steps.append((item_id, probability, severity, causes, combination))
+
+    levels = sorted({severity for _, _, severity, _, _ in steps
+                     if severity > 0})
+    return steps, levels
+
+
+def simulate_chunk(steps, levels, trials, seed):
+    """
+    Simulate ``trials`` trials of a model built by build_model.
+
+    Returns {outcome_id: [occurrences, occurrences with severity of at
+    least each level]}.
+    """
+    np = import_numpy()
+    bit_generator = np.random.PCG64(seed)
+    words = (trials + 63) // 64
+    ones = np.uint64(0xFFFFFFFFFFFFFFFF)
+    valid = np.full(words, ones)
+    if trials % 64:
+        valid[-1] = np.uint64((1 << (trials % 64)) - 1)
+    zeros = np.zeros(words, np.uint64)
+
+    def bernoulli(numerator, bits=PRECISION_BITS):
+        """Words whose bits are set with probability numerator / 2**bits."""
+        if numerator <= 0:
+            return np.zeros(words, np.uint64)
+        if numerator >= 1 << bits:
+            return valid.copy()
+        # Build the bits from the binary digits of the probability,
+        # lowest first: OR with a random word adds 1/2, AND halves
+        while not numerator & 1:
+            numerator >>= 1
+            bits -= 1
+        result = bit_generator.random_raw(words)
+        for digit in range(1, bits):
+            random_words = bit_generator.random_raw(words)
+            if numerator >> digit & 1:
+                result |= random_words
+            else:
+                result &= random_words
+        return result
+
+    def count(array):
+        array = array & valid
+        if hasattr(np, 'bitwise_count'):
+            return int(np.bitwise_count(array).sum())
+        return int(np.unpackbits(array.view(np.uint8)).sum())
+
+    uses = collections.Counter(pos for step in steps for pos in step[3])
+    active = {}
+    at_least = {}
+    results = {}
+    for pos, (item_id, probability, severity, causes, combination) \
+            in enumerate(steps):
+        if causes and combination == 'pick' and len(causes) > 1:
+            # Split the trials between the causes at random
+            remaining = valid.copy()
+            masks = []
+            for i in range(len(causes) - 1):
+                share = bernoulli(round(2 ** PRECISION_BITS /
+                                        (len(causes) - i)))
+                masks.append(remaining & share)
+                remaining &= ~share
+            masks.append(remaining)
+        else:
+            masks = [None] * len(causes)
+
+        def combine(arrays):
+            # Arrays are shared between items, so never modify them
+            combined = None
+            for mask, array in zip(masks, arrays):
+                if mask is not None:
+                    array = array & mask
+                combined = array if combined is None else combined | array
+            return combined
+
+        occurs = combine([active[cause] for cause in causes]) \
+            if causes else valid
+        own = None
+        if probability is not None:
+            own = bernoulli(probability)
+            occurs = occurs & own
+        active[pos] = occurs
+
+        # Trials where the worst path here is at least as severe as each
+        # level: all of them up to the item's own severity, beyond that
+        # those where the chosen causes reached the level
+        at_least[pos] = []
+        for level, value in enumerate(levels):
+            if value <= severity:
+                reached = occurs
+            elif not causes:
+                reached = zeros
+            else:
+                reached = combine([at_least[cause][level]
+                                   for cause in causes])
+                if own is not None:
+                    reached = reached & own
+            at_least[pos].append(reached)
+
+        if probability is None:
+            results[item_id] = [count(occurs)] + [
+                count(array) for array in at_least[pos]
+            ]
+        for cause in causes:
+            uses[cause] -= 1
+            if not uses[cause]:
+                del active[cause], at_least[cause]
+        if not uses[pos]:
+            del active[pos], at_least[pos]
+    return results
+
+
+def wilson_interval(successes, trials, z=Z_95):
+    """Return the Wilson score confidence interval of a proportion."""
+    if not trials:
+        return 0.0, 0.0
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denominator
+    spread = z * math.sqrt(p * (1 - p) / trials +
+                           z * z / (4 * trials * trials)) / denominator
+    return max(0.0, centre - spread), min(1.0, centre + spread)
+
+
+def simulate(index, rule='average', trials=100000, workers=1, seed=None,
+             chunk_trials=CHUNK_TRIALS):
+    """
+    Estimate every outcome's probability and severity by simulation.
+
+    Trials are simulated in chunks of ``chunk_trials``, spread over a
+    pool of ``workers`` processes when more than one is given. Returns
+    {outcome_id: OutcomeRisk} with the probability and its 95%
+    confidence interval in percent, and the expected severity of the
+    worst path in the trials where the outcome occurs.
+    """
+    np = import_numpy()
+    steps, levels = build_model(index, rule)
+    sizes = [min(chunk_trials, trials - start)
+             for start in range(0, trials, chunk_trials)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    arguments = ([steps] * len(sizes), [levels] * len(sizes), sizes, seeds)
+
+    if workers > 1 and len(sizes) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as pool:
+            chunks = list(pool.map(simulate_chunk, *arguments))
+    else:
+        chunks = list(map(simulate_chunk, *arguments))
+
+    totals = {}
+    for chunk in chunks:
+        for outcome_id, counts in chunk.items():
+            totals[outcome_id] = [a + b for a, b in zip(
+                totals.get(outcome_id, [0] * len(counts)), counts)]
+
+    risks = {}
+    for outcome_id, (occurrences, *at_least) in totals.items():
+        low, high = wilson_interval(occurrences, trials)
+        severity = 0.0
+        if occurrences:
+            # E[S] is the sum over levels of P(S >= level) times the step
+            for level, previous, hits in zip(levels, [0] + levels, at_least):
+                severity += (level - previous) * hits / occurrences
+        risks[outcome_id] = OutcomeRisk(
+            100 * occurrences / trials, 100 * low, 100 * high, severity,
+            trials
+        )
+    return risks
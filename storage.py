@@ -0,0 +1,715 @@
+"""
+Storage backends for the DAG.
+
+Every backend exposes the nodes and outcomes tables the same way the
+Google Sheets worksheets do: an ordered list of records where the record
+at position ``i`` lives on sheet row ``i + 2`` (row 1 holds the headers).
+Writes identify a record by both its row and its id. Rows may have moved
+since the caller's snapshot was read, so backends writing by position
+look the ids up first, and every backend raises MissingRecordError for
+an id that is gone.
+"""
+import contextlib
+import datetime
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import time
+import uuid
+import warnings
+
+from scheduler import RequestScheduler
+
+# Suppress specific deprecation warnings from Google Sheets API
+warnings.filterwarnings(
+    "ignore",
+    message=(".*Method signature's arguments 'range_name' and 'values' "
+             "will change their order.*")
+)
+
+SCOPE = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive"
+]
+
+# Column order of each worksheet, used to map records to cells
+NODE_FIELDS = ['node_id', 'title', 'description', 'causedBy', 'causes',
+               'probability', 'severity']
+OUTCOME_FIELDS = ['outcome_id', 'title', 'description', 'causedBy',
+                  'probability', 'severity']
+FIELDS = {'nodes': NODE_FIELDS, 'outcomes': OUTCOME_FIELDS}
+
+BACKENDS = ('sheets', 'sqlite', 'memory', 'remote')
+DEFAULT_BACKEND = os.environ.get('DAG_BACKEND', 'sheets')
+DEFAULT_SQLITE_PATH = os.environ.get('DAG_SQLITE_PATH', 'dag.db')
+
+# Local socket of the shared DAG server (see server.py)
+DEFAULT_SOCKET = os.environ.get(
+    'DAG_SOCKET', os.path.join(tempfile.gettempdir(), 'dag-tui.sock')
+)
+
+# HTTP statuses worth retrying: rate limited or a transient server error
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# The only one of them guaranteeing the request was not applied, so
+# writes that must not run twice are retried on it alone
+RATE_LIMITED = 429
+
+# Change log entries kept by the SQLite backend for delta syncs
+CHANGE_LOG_SIZE = 100000
+
+# Drive API endpoint holding the spreadsheet file's metadata
+DRIVE_FILES_URL = 'https://www.googleapis.com/drive/v3/files'
+
+# Access token and spreadsheet id shared between processes
+TOKEN_CACHE = os.environ.get('DAG_TOKEN_CACHE', '.dag_token.json')
+
+
+class MissingRecordError(KeyError):
+    """Raised when a write addresses a record that no longer exists."""
+
+    def __str__(self):
+        # KeyError would show the message quoted
+        return str(self.args[0]) if self.args else ''
+
+
+def column_letter(table, field):
+    """Return the sheet column letter holding a field of a table."""
+    return chr(65 + FIELDS[table].index(field))
+
+
+def row_runs(rows):
+    """Group row numbers into (first, last) runs, bottom run first."""
+    runs = []
+    for row in sorted(set(rows), reverse=True):
+        if runs and runs[-1][0] == row + 1:
+            runs[-1][0] = row
+        else:
+            runs.append([row, row])
+    return [tuple(run) for run in runs]
+
+
+class StorageBackend:
+    """
+    Interface shared by all storage backends.
+
+    Args used by the write methods:
+        table: 'nodes' or 'outcomes'.
+        updates: list of (row_index, record_id, field, value) tuples.
+        rows: list of value lists in the table's column order.
+        refs: list of (row_index, record_id) tuples.
+    """
+    name = None
+
+    # Set when revision() and changes() are requests to a rate-limited
+    # service: callers then leave checks to the cache TTL, and skip
+    # reading back their own writes
+    quota_limited = False
+
+    def get_records(self, table):
+        """Return all records of a table as a list of dicts."""
+        raise NotImplementedError
+
+    def update_cells(self, table, updates):
+        """Write new values to individual fields of existing records."""
+        raise NotImplementedError
+
+    def append_rows(self, table, rows):
+        """Append new records to the end of a table."""
+        raise NotImplementedError
+
+    def delete_rows(self, table, refs):
+        """Delete records from a table."""
+        raise NotImplementedError
+
+    def reserve_ids(self, count):
+        """
+        Reserve ``count`` consecutive ids for this session.
+
+        Returns the first id of the range. Ranges never overlap, even
+        when several sessions reserve ids at the same time.
+        """
+        raise NotImplementedError
+
+    def revision(self):
+        """
+        Return a token that changes whenever the stored data changes.
+
+        Backends that cannot tell cheaply return None, and callers fall
+        back to refetching on a timer.
+        """
+        return None
+
+    def changes(self, since):
+        """
+        Return ``(revision, changes)`` for what changed after ``since``.
+
+        ``changes`` maps a table to ``(records, deleted_ids)``: the
+        current values of every added or changed record and the ids of
+        deleted ones. When ``deleted_ids`` is None, ``records`` is the
+        whole table in storage order and the caller works out what
+        changed. ``changes`` is None when the backend cannot tell, and
+        the caller must refetch the tables.
+        """
+        revision = self.revision()
+        return revision, {} if revision == since else None
+
+
+class SheetsBackend(StorageBackend):
+    """
+    Backend storing both tables in the "dag-tui" Google spreadsheet.
+
+    Nothing touches the network until the first read or write. The
+    access token and spreadsheet id are cached on disk so later processes
+    can skip the OAuth exchange and the Drive lookup by title; with the
+    id cached, all worksheets are built from a single metadata request.
+    Every request goes through a RequestScheduler to stay within the
+    Sheets quotas.
+    """
+    name = 'sheets'
+    quota_limited = True
+
+    def __init__(self, creds_file='creds.json', spreadsheet='dag-tui',
+                 token_cache=TOKEN_CACHE):
+        self.creds_file = creds_file
+        self.spreadsheet = spreadsheet
+        self.token_cache = token_cache
+        self.connect_seconds = None
+        self.sheet = None
+        self._worksheets = None
+        self._id_sheet = None
+        self.scheduler = RequestScheduler(retryable=self.is_retryable)
+
+    @staticmethod
+    def is_retryable(error):
+        """Check whether a failed request is worth retrying."""
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None) in RETRY_STATUSES
+
+    @staticmethod
+    def is_rate_limited(error):
+        """Check whether a request was rejected by the quota, unapplied."""
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None) == RATE_LIMITED
+
+    @property
+    def worksheets(self):
+        """Return the worksheets by title, connecting on first use."""
+        if self._worksheets is None:
+            self.connect()
+        return self._worksheets
+
+    def connect(self):
+        """Authorize and open the spreadsheet and its worksheets."""
+        # Imported here so the module loads without the Google libraries
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        started = time.perf_counter()
+        creds = Credentials.from_service_account_file(
+            self.creds_file).with_scopes(SCOPE)
+        cached = self.load_token_cache(creds)
+        client = gspread.authorize(creds)
+
+        worksheets = None
+        if cached.get('spreadsheet_id'):
+            # Opening by key makes no request of its own
+            self.sheet = gspread.models.Spreadsheet(
+                client, {'id': cached['spreadsheet_id']})
+            try:
+                worksheets = self.load_worksheets(gspread)
+            except gspread.exceptions.APIError:
+                worksheets = None
+        if worksheets is None:
+            self.sheet = self.scheduler.call(
+                'read', lambda: client.open(self.spreadsheet))
+            worksheets = self.load_worksheets(gspread)
+
+        by_title = {worksheet.title: worksheet for worksheet in worksheets}
+        self._worksheets = {table: by_title[table] for table in FIELDS}
+        self._id_sheet = by_title.get('ids')
+        self.save_token_cache(creds, cached)
+        self.connect_seconds = time.perf_counter() - started
+
+    def load_worksheets(self, gspread):
+        """Build every worksheet from one spreadsheet metadata request."""
+        metadata = self.scheduler.call('read', self.sheet.fetch_sheet_metadata)
+        return [gspread.models.Worksheet(self.sheet, sheet['properties'])
+                for sheet in metadata['sheets']]
+
+    def load_token_cache(self, creds):
+        """Reuse a still valid cached access token for these credentials."""
+        try:
+            with open(self.token_cache, encoding='utf-8') as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(cached, dict) or \
+                cached.get('client_email') != creds.service_account_email or \
+                cached.get('spreadsheet') != self.spreadsheet:
+            return {}
+
+        try:
+            expiry = datetime.datetime.fromisoformat(cached['expiry'])
+            token = cached['token']
+        except (KeyError, TypeError, ValueError):
+            # Truncated or hand-edited; sign in again and overwrite it
+            return {}
+        now = datetime.datetime.now(datetime.timezone.utc).replace(
+            tzinfo=None)
+        if expiry - now > datetime.timedelta(minutes=1):
+            creds.token = token
+            creds.expiry = expiry
+        return cached
+
+    def save_token_cache(self, creds, cached):
+        """Store the current access token if it changed."""
+        if not creds.token or not creds.expiry or \
+                (cached.get('token') == creds.token and
+                 cached.get('spreadsheet_id') == self.sheet.id):
+            return
+        try:
+            descriptor = os.open(self.token_cache,
+                                 os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                                 0o600)
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+                json.dump({
+                    'client_email': creds.service_account_email,
+                    'spreadsheet': self.spreadsheet,
+                    'spreadsheet_id': self.sheet.id,
+                    'token': creds.token,
+                    'expiry': creds.expiry.isoformat(),
+                }, file)
+        except OSError:
+            pass
+
+    def get_records(self, table):
+        worksheet = self.worksheets[table]
+        return self.scheduler.call('read', worksheet.get_all_records)
+
+    def revision(self):
+        # The Drive file version goes up with every edit, by anyone, and
+        # costs one small request
+        if self.sheet is None:
+            self.connect()
+        url = f"{DRIVE_FILES_URL}/{self.sheet.id}"
+        response = self.scheduler.call('read', lambda: self.sheet.client
+                                       .request('get', url,
+                                                params={'fields': 'version'}))
+        return response.json()['version']
+
+    def changes(self, since):
+        revision = self.revision()
+        if revision == since:
+            return revision, {}
+        # Sheets cannot list changed rows, so read both worksheets in
+        # one request and let the caller diff them against its snapshot
+        ranges = self.scheduler.call('read', lambda: self.sheet
+                                     .values_batch_get(list(FIELDS)))
+        changes = {}
+        for table, value_range in zip(FIELDS, ranges['valueRanges']):
+            header, *rows = value_range.get('values') or [FIELDS[table]]
+            changes[table] = ([
+                dict(zip(header, row + [''] * (len(header) - len(row))))
+                for row in rows
+            ], None)
+        return revision, changes
+
+    def update_cells(self, table, updates):
+        worksheet = self.worksheets[table]
+        rows = self.find_rows(table, [(row, record_id)
+                                      for row, record_id, _, _ in updates])
+        data = [{'range': f"{column_letter(table, field)}"
+                          f"{rows[(row, record_id)]}",
+                 'values': [[value]]}
+                for row, record_id, field, value in updates]
+        self.scheduler.call('write', lambda: worksheet.batch_update(data))
+
+    def append_rows(self, table, rows):
+        worksheet = self.worksheets[table]
+        # A 5xx may hide an append that landed; retrying would add the
+        # rows twice
+        self.scheduler.call('write', lambda: worksheet.append_rows(rows),
+                            retryable=self.is_rate_limited)
+
+    def find_rows(self, table, refs):
+        """
+        Map (row, id) pairs to the rows their ids are on now.
+
+        The rows come from a snapshot that other sessions may have moved
+        by adding or deleting rows since, so the id column is read again
+        (one request) before anything is written by position.
+        """
+        worksheet = self.worksheets[table]
+        ids = self.scheduler.call('read', lambda: worksheet.col_values(1))
+        current = {item_id: row for row, item_id in enumerate(ids, 1)
+                   if row > 1}
+        rows = {}
+        for row, record_id in refs:
+            if str(record_id) not in current:
+                raise MissingRecordError(
+                    f"No record with ID {record_id} in {table}")
+            rows[(row, record_id)] = current[str(record_id)]
+        return rows
+
+    def delete_rows(self, table, refs):
+        worksheet = self.worksheets[table]
+
+        def delete():
+            # Looked up on every attempt, as other sessions may have
+            # moved the rows, also while a retry waited
+            rows = self.find_rows(table, refs).values()
+            # One deleteDimension per run of adjacent rows, bottom run
+            # first so earlier deletions don't shift the rows still to be
+            # deleted; the whole batch is a single request
+            requests = [{'deleteDimension': {'range': {
+                'sheetId': worksheet.id, 'dimension': 'ROWS',
+                'startIndex': start - 1, 'endIndex': end,
+            }}} for start, end in row_runs(rows)]
+            if requests:
+                self.sheet.batch_update({'requests': requests})
+
+        # Deleting by position is never repeated after a 5xx, which may
+        # hide a delete that landed and shifted the rows below
+        self.scheduler.call('write', delete, retryable=self.is_rate_limited)
+
+    def id_sheet(self):
+        """Return the worksheet recording id leases, creating it once."""
+        if self.worksheets and self._id_sheet is None:
+            try:
+                self._id_sheet = self.scheduler.call(
+                    'write', lambda: self.sheet.add_worksheet('ids', 1, 3),
+                    retryable=self.is_rate_limited)
+                self.scheduler.call('write', lambda: self._id_sheet.update(
+                    'A1:C1', [['start', 'count', 'session']]))
+            except Exception as error:
+                # Imported here so stand-ins for gspread need not have it
+                import gspread
+                if not isinstance(error, gspread.exceptions.APIError):
+                    raise
+                # Another session created it in the meantime
+                self._id_sheet = self.scheduler.call(
+                    'read', lambda: self.sheet.worksheet('ids'))
+        return self._id_sheet
+
+    def reserve_ids(self, count):
+        # Optimistic leasing: claim the range after the last lease by
+        # appending a row, then re-read the leases. Appends are applied
+        # in order, so the claim is ours if no earlier row overlaps it.
+        sheet = self.id_sheet()
+        while True:
+            leases = self.scheduler.call('read', sheet.get_all_values)[1:]
+            start = max((int(row[0]) + int(row[1]) for row in leases),
+                        default=1)
+            token = uuid.uuid4().hex
+            self.scheduler.call(
+                'write', lambda: sheet.append_row([start, count, token]),
+                retryable=self.is_rate_limited)
+
+            for row in self.scheduler.call('read', sheet.get_all_values)[1:]:
+                if row[2] == token:
+                    return start
+                if int(row[0]) < start + count and \
+                        start < int(row[0]) + int(row[1]):
+                    break
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Backend storing both tables in a local SQLite database.
+
+    Triggers log the id of every inserted, updated or deleted record in
+    a ``changes`` table, so other processes sharing the database file
+    can read just the records changed since their last sync. The newest
+    CHANGE_LOG_SIZE entries are kept.
+    """
+    name = 'sqlite'
+
+    COLUMN_TYPES = {
+        'node_id': 'INTEGER', 'outcome_id': 'INTEGER',
+        'probability': 'NUMERIC', 'severity': 'NUMERIC'
+    }
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        self.path = path
+        # The shared server calls in from its handler threads, one at a
+        # time under the service lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            for table, fields in FIELDS.items():
+                columns = ', '.join(
+                    f'"{field}" {self.COLUMN_TYPES.get(field, "TEXT")}'
+                    for field in fields
+                )
+                self.conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {table} ({columns})'
+                )
+                self.conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS {table}_{fields[0]} '
+                    f'ON {table} ("{fields[0]}")'
+                )
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS id_leases '
+                '(start INTEGER, count INTEGER)'
+            )
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY '
+                'KEY AUTOINCREMENT, tbl TEXT, item_id INTEGER)'
+            )
+            for table, fields in FIELDS.items():
+                for event, rows in (('INSERT', ('NEW',)),
+                                    ('UPDATE', ('OLD', 'NEW')),
+                                    ('DELETE', ('OLD',))):
+                    logs = ' '.join(
+                        f"INSERT INTO changes (tbl, item_id) "
+                        f"VALUES ('{table}', {row}.\"{fields[0]}\");"
+                        for row in rows
+                    )
+                    self.conn.execute(
+                        f'CREATE TRIGGER IF NOT EXISTS {table}_'
+                        f'{event.lower()}_log AFTER {event} ON {table} '
+                        f'BEGIN {logs} END'
+                    )
+
+    def select(self, table, where='', params=()):
+        """Return the records of a table matching a WHERE clause."""
+        fields = FIELDS[table]
+        columns = ', '.join(f'"{field}"' for field in fields)
+        cursor = self.conn.execute(
+            f'SELECT {columns} FROM {table} {where} ORDER BY rowid', params
+        )
+        return [
+            {field: '' if value is None else value
+             for field, value in zip(fields, row)}
+            for row in cursor
+        ]
+
+    def get_records(self, table):
+        return self.select(table)
+
+    def revision(self):
+        revision, = self.conn.execute(
+            'SELECT COALESCE(MAX(seq), 0) FROM changes'
+        ).fetchone()
+        return revision
+
+    def changes(self, since):
+        revision = self.revision()
+        if revision == since:
+            return revision, {}
+        oldest, = self.conn.execute('SELECT MIN(seq) FROM changes')\
+            .fetchone()
+        if since is None or oldest is None or oldest > since + 1:
+            # Entries after ``since`` were pruned from the log
+            return revision, None
+
+        changes = {}
+        logged = ('SELECT item_id FROM changes '
+                  'WHERE tbl = ? AND seq > ? AND seq <= ?')
+        for table, fields in FIELDS.items():
+            params = (table, since, revision)
+            ids = {item_id for item_id, in self.conn.execute(logged, params)}
+            if not ids:
+                continue
+            records = self.select(
+                table, f'WHERE "{fields[0]}" IN ({logged})', params
+            )
+            found = {record[fields[0]] for record in records}
+            changes[table] = (records, sorted(ids - found))
+        return revision, changes
+
+    def prune_changes(self):
+        """Drop all but the newest CHANGE_LOG_SIZE change log entries."""
+        self.conn.execute(
+            'DELETE FROM changes WHERE seq <= '
+            '(SELECT MAX(seq) FROM changes) - ?', (CHANGE_LOG_SIZE,)
+        )
+
+    def update_cells(self, table, updates):
+        id_field = FIELDS[table][0]
+        with self.conn:
+            for _, record_id, field, value in updates:
+                self.conn.execute(
+                    f'UPDATE {table} SET "{field}" = ? '
+                    f'WHERE "{id_field}" = ?',
+                    (value, record_id)
+                )
+            self.prune_changes()
+
+    def append_rows(self, table, rows):
+        placeholders = ', '.join('?' for _ in FIELDS[table])
+        with self.conn:
+            self.conn.executemany(
+                f'INSERT INTO {table} VALUES ({placeholders})', rows
+            )
+            self.prune_changes()
+
+    def delete_rows(self, table, refs):
+        id_field = FIELDS[table][0]
+        with self.conn:
+            self.conn.executemany(
+                f'DELETE FROM {table} WHERE "{id_field}" = ?',
+                [(record_id,) for _, record_id in refs]
+            )
+            self.prune_changes()
+
+    def reserve_ids(self, count):
+        # BEGIN IMMEDIATE takes the write lock before reading, so other
+        # processes sharing the database file wait for the lease to land
+        self.conn.execute('BEGIN IMMEDIATE')
+        with self.conn:
+            start, = self.conn.execute(
+                'SELECT COALESCE(MAX(start + count), 1) FROM id_leases'
+            ).fetchone()
+            self.conn.execute('INSERT INTO id_leases VALUES (?, ?)',
+                              (start, count))
+        return start
+
+
+class MemoryBackend(StorageBackend):
+    """Backend keeping both tables in process memory only."""
+    name = 'memory'
+
+    def __init__(self, records=None):
+        self.tables = {table: [] for table in FIELDS}
+        self.next_id = 1
+        for table, table_records in (records or {}).items():
+            self.append_rows(table, [
+                [record.get(field, '') for field in FIELDS[table]]
+                for record in table_records
+            ])
+
+    def get_records(self, table):
+        return [dict(record) for record in self.tables[table]]
+
+    def update_cells(self, table, updates):
+        for row, _, field, value in updates:
+            self.tables[table][row - 2][field] = value
+
+    def append_rows(self, table, rows):
+        fields = FIELDS[table]
+        self.tables[table].extend(dict(zip(fields, row)) for row in rows)
+
+    def delete_rows(self, table, refs):
+        for row in sorted({row for row, _ in refs}, reverse=True):
+            del self.tables[table][row - 2]
+
+    def reserve_ids(self, count):
+        start = self.next_id
+        self.next_id += count
+        return start
+
+
+class RemoteError(RuntimeError):
+    """Raised when the DAG server reports a failed request or is gone."""
+
+
+class RemoteBackend(StorageBackend):
+    """
+    Backend forwarding every call to the shared DAG server.
+
+    The server holds the only connection to the real backend and one
+    cache shared by all sessions; this class is a thin client speaking
+    JSON lines over a local socket. A dropped connection, e.g. after the
+    server restarted, is reopened once per request. Revisions are
+    ``(server instance, version)`` pairs, so a restarted server is never
+    asked for changes since a version of the one before.
+    """
+    name = 'remote'
+
+    # Requests safe to send again when the reply was lost
+    READ_METHODS = ('get_records', 'revision', 'changes')
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        self.socket_path = socket_path
+        self._file = None
+
+    def call(self, method, **params):
+        """Send one request to the server and return its result."""
+        request = json.dumps({'method': method, 'params': params}) + '\n'
+        for attempt in range(2):
+            reconnected = self._file is None
+            sent = False
+            try:
+                if self._file is None:
+                    connection = socket.socket(socket.AF_UNIX,
+                                               socket.SOCK_STREAM)
+                    try:
+                        connection.connect(self.socket_path)
+                    except OSError:
+                        connection.close()
+                        raise
+                    self._file = connection.makefile('rw', encoding='utf-8')
+                self._file.write(request)
+                self._file.flush()
+                sent = True
+                line = self._file.readline()
+                if not line:
+                    raise ConnectionResetError(
+                        "DAG server closed the connection")
+                break
+            except OSError as error:
+                self.close()
+                # A write may have been applied before the reply was lost
+                if reconnected or attempt or \
+                        sent and method not in self.READ_METHODS:
+                    raise RemoteError(
+                        f"Lost the DAG server at {self.socket_path}: "
+                        f"{error.strerror or error}"
+                    ) from error
+        response = json.loads(line)
+        if 'error' in response:
+            name, _, message = response['error'].partition(': ')
+            if name == MissingRecordError.__name__:
+                raise MissingRecordError(message)
+            raise RemoteError(response['error'])
+        return response['result']
+
+    def get_records(self, table):
+        return self.call('get_records', table=table)
+
+    def update_cells(self, table, updates):
+        self.call('update_cells', table=table, updates=updates)
+
+    def append_rows(self, table, rows):
+        self.call('append_rows', table=table, rows=rows)
+
+    def delete_rows(self, table, refs):
+        self.call('delete_rows', table=table, refs=refs)
+
+    def reserve_ids(self, count):
+        return self.call('reserve_ids', count=count)
+
+    def close(self):
+        """Drop the connection; the next request opens a new one."""
+        if self._file is not None:
+            with contextlib.suppress(OSError):
+                self._file.close()
+            self._file = None
+
+    def revision(self):
+        # JSON turns the pair into a list, which cannot key a dict
+        return tuple(self.call('revision'))
+
+    def changes(self, since):
+        revision, changes = self.call('changes', since=since)
+        return tuple(revision), changes
+
+
+def create_backend(name=None, **kwargs):
+    """Create the backend selected by name or the DAG_BACKEND variable."""
+    name = name or DEFAULT_BACKEND
+    if name == 'sheets':
+        return SheetsBackend(**kwargs)
+    if name == 'sqlite':
+        return SQLiteBackend(**kwargs)
+    if name == 'memory':
+        return MemoryBackend(**kwargs)
+    if name == 'remote':
+        return RemoteBackend(**kwargs)
+    raise ValueError(
+        f"Unknown backend '{name}'. Choose one of: {', '.join(BACKENDS)}"
+    )
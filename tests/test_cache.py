@@ -0,0 +1,58 @@
+"""
+Id allocation across sessions and across one-shot command-line runs.
+"""
+import contextlib
+import io
+import os
+import random
+import tempfile
+import unittest
+
+from cache import IdAllocator
+import run
+from storage import create_backend
+
+
+class IdAllocatorTest(unittest.TestCase):
+
+    def test_unique_across_sessions(self):
+        rng = random.Random(10)
+        for _ in range(50):
+            backend = create_backend('memory')
+            taken = set(rng.sample(range(1, 200), rng.randint(0, 60)))
+            sessions = [IdAllocator(backend, taken.__contains__,
+                                    block_size=rng.randint(1, 20))
+                        for _ in range(3)]
+            handed_out = []
+            for _ in range(30):
+                allocator = rng.choice(sessions)
+                count = rng.randint(1, 25)
+                exclude = set(rng.sample(range(1, 300), 20))
+                ids = allocator.reserve(count, exclude=exclude)
+                self.assertEqual(len(ids), count)
+                self.assertFalse(set(ids) & (taken | exclude))
+                handed_out.extend(ids)
+            self.assertEqual(len(handed_out), len(set(handed_out)))
+
+    def test_one_shot_runs_stay_consecutive(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'dag.db')
+        script = os.path.join(directory.name, 'script.txt')
+        with open(script, 'w', encoding='utf-8') as file:
+            file.write("add node --title B\nadd node --title C\n")
+        argv = ['--backend', 'sqlite', '--db', path]
+        with contextlib.redirect_stdout(io.StringIO()):
+            run.main(argv + ['add', 'node', '--title', 'A'])
+            run.main(argv + ['batch', script])
+            run.main(argv + ['add', 'outcome', '--title', 'D'])
+        backend = create_backend('sqlite', path=path)
+        ids = sorted(int(record[field])
+                     for table, field in (('nodes', 'node_id'),
+                                          ('outcomes', 'outcome_id'))
+                     for record in backend.get_records(table))
+        self.assertEqual(ids, [1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
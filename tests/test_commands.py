@@ -0,0 +1,211 @@
+"""
+Headless command scripts checked against a model of the links they make.
+"""
+import contextlib
+import io
+import random
+import unittest
+
+import bench
+from commands import parse_script, run_commands
+from graph import GraphIndex, propagate
+from run import DAG
+from storage import create_backend
+from tests.test_graph import random_graph
+from tests.test_run import acyclic, edges_of
+
+
+def run(dag, lines):
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        status = run_commands(dag, parse_script(lines))
+    return status, output.getvalue()
+
+
+class ScriptModel:
+    """
+    Items and links a script should leave, or None if it must fail.
+
+    Existing items are known by id, added ones by their @name. A command
+    addressing an item that is not there fails at once; links to one
+    only fail if they are still there at the end.
+    """
+
+    def __init__(self, index):
+        self.nodes = set(index.nodes)
+        self.outcomes = set(index.outcomes)
+        self.edges = edges_of(index)
+        self.valid = True
+
+    def exists(self, *labels):
+        return all(label in self.nodes or label in self.outcomes
+                   for label in labels)
+
+    def add(self, name, kind, parents, children):
+        if kind == 'outcome' and children:
+            self.valid = False
+        (self.nodes if kind == 'node' else self.outcomes).add(name)
+        self.set_links(name, parents, children)
+
+    def set_links(self, label, parents=None, children=None):
+        if parents is not None:
+            self.edges = {(a, b) for a, b in self.edges if b != label}
+        if children is not None:
+            self.edges = {(a, b) for a, b in self.edges if a != label}
+        self.edges |= {(a, label) for a in parents or ()}
+        self.edges |= {(label, b) for b in children or ()}
+
+    def update(self, label, parents, children):
+        if not self.exists(label) or \
+                label in self.outcomes and children is not None:
+            self.valid = False
+            return
+        self.set_links(label, parents, children)
+
+    def link(self, cause, effect, linked):
+        if not self.exists(cause, effect) or cause in self.outcomes:
+            self.valid = False
+            return
+        if linked:
+            self.edges.add((cause, effect))
+        else:
+            self.edges.discard((cause, effect))
+
+    def delete(self, label):
+        if not self.exists(label):
+            self.valid = False
+            return
+        self.nodes.discard(label)
+        self.outcomes.discard(label)
+        self.edges = {(a, b) for a, b in self.edges if label not in (a, b)}
+
+    def result(self):
+        # Links are only checked once the whole script has run
+        if self.valid and acyclic(self.edges) and \
+                all(self.exists(*edge) for edge in self.edges):
+            return self.edges
+        return None
+
+
+def random_script(rng, index):
+    """Return (script lines, expected edges or None)."""
+    model = ScriptModel(index)
+    lines = []
+
+    def ref(label):
+        return f"@{label}" if isinstance(label, str) else str(label)
+
+    def pick(labels, count):
+        # Now and then refer to an item that does not exist
+        labels = sorted(labels, key=str) + [999999]
+        return rng.sample(labels, min(count, len(labels)))
+
+    def links(labels):
+        return ', '.join(map(ref, labels))
+
+    for step in range(rng.randint(1, 6)):
+        operation = rng.random()
+        if operation < 0.3:
+            name = f"n{step}"
+            kind = 'node' if rng.random() < 0.8 else 'outcome'
+            parents = pick(model.nodes, rng.randint(0, 2))
+            children = pick(model.nodes | model.outcomes,
+                            rng.randint(0, 2)) if kind == 'node' else []
+            line = f"add {kind} --title {name} --as {name}"
+            if parents:
+                line += f" --caused-by '{links(parents)}'"
+            if children:
+                line += f" --causes '{links(children)}'"
+            model.add(name, kind, parents, children)
+        elif operation < 0.55:
+            label = pick(model.nodes | model.outcomes, 1)[0]
+            parents = children = None
+            line = f"update {ref(label)}"
+            if rng.random() < 0.7:
+                parents = pick(model.nodes, rng.randint(0, 2))
+                line += f" --caused-by '{links(parents)}'"
+            if label not in model.outcomes and rng.random() < 0.7:
+                children = pick(model.nodes | model.outcomes,
+                                rng.randint(0, 2))
+                line += f" --causes '{links(children)}'"
+            model.update(label, parents, children)
+        elif operation < 0.85:
+            cause = pick(model.nodes, 1)[0]
+            effect = pick(model.nodes | model.outcomes, 1)[0]
+            linked = rng.random() < 0.7
+            line = f"{'link' if linked else 'unlink'} {ref(cause)} " \
+                f"{ref(effect)}"
+            model.link(cause, effect, linked)
+        else:
+            label = pick(model.nodes | model.outcomes, 1)[0]
+            line = f"delete {ref(label)}"
+            model.delete(label)
+        lines.append(line)
+    return lines, model.result()
+
+
+class RunCommandsTest(unittest.TestCase):
+
+    def saved(self, dag):
+        return GraphIndex(dag.backend.get_records('nodes'),
+                          dag.backend.get_records('outcomes'))
+
+    def test_matches_model(self):
+        rng = random.Random(8)
+        outcomes_checked = 0
+        for _ in range(150):
+            nodes, outcomes = random_graph(rng, rng.randint(2, 8),
+                                           edges=rng.random())
+            dag = DAG(create_backend('memory', records={
+                'nodes': nodes, 'outcomes': outcomes,
+            }), cache_ttl=-1)
+            with contextlib.redirect_stdout(io.StringIO()):
+                dag.calculate_outcome_probabilities_and_severities()
+            before = self.saved(dag)
+            lines, expected = random_script(rng, dag.index)
+            status, output = run(dag, lines)
+            saved = self.saved(dag)
+            if expected is None:
+                self.assertEqual(status, 1, (lines, output))
+                self.assertIn("Nothing was saved", output)
+                self.assertEqual(edges_of(saved), edges_of(before))
+                self.assertEqual(set(saved.nodes), set(before.nodes))
+                continue
+            self.assertEqual(status, 0, (lines, output))
+
+            ids = {record.title: item_id for item_id, record in
+                   list(saved.nodes.items()) + list(saved.outcomes.items())}
+            expected = {(ids.get(a, a), ids.get(b, b))
+                        for a, b in expected}
+            self.assertEqual(edges_of(saved), expected, lines)
+
+            values = propagate(saved)
+            for outcome_id, outcome in saved.outcomes.items():
+                if outcome_id in values:
+                    probability, severity = values[outcome_id]
+                    self.assertAlmostEqual(outcome.probability,
+                                           round(probability, 2))
+                    self.assertEqual(outcome.severity, int(severity))
+                    outcomes_checked += 1
+        self.assertGreater(outcomes_checked, 0)
+
+    def test_requests_do_not_grow_with_the_script(self):
+        calls = []
+        for adds in (2, 200):
+            nodes, outcomes = bench.generate_graph(50, seed=0)
+            backend = bench.FakeSheetsBackend(nodes, outcomes)
+            dag = DAG(backend, cache_ttl=-1)
+            dag.index
+            backend.calls.clear()
+            lines = [f"add node --title n{i} --as n{i} --causes "
+                     f"{outcomes[i % len(outcomes)][0]}"
+                     for i in range(adds)]
+            lines += [f"link @n{i} @n{i + 1}" for i in range(adds - 1)]
+            lines += [f"update {nodes[0][0]} --title Edited",
+                      f"delete {nodes[1][0]}"]
+            self.assertEqual(run(dag, lines)[0], 0)
+            calls.append(sum(backend.calls.values()))
+        self.assertEqual(calls[0], calls[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+"""
+Cross-checks of the graph algorithms against brute force on small graphs.
+"""
+import random
+import unittest
+
+from graph import (COMBINE_RULES, CycleError, GraphIndex,
+                   OnlineTopologicalOrder, propagate, walk_causes)
+
+
+def random_graph(rng, size, outcomes=3, edges=2.0):
+    """
+    Return (nodes, outcomes) rows of a random DAG.
+
+    Nodes only cause nodes later in a random order, and each outcome is
+    caused by a few random nodes.
+    """
+    ids = rng.sample(range(1, 10 * size + 1), size + outcomes)
+    node_ids, outcome_ids = ids[:size], ids[size:]
+    causes = {node_id: set() for node_id in node_ids}
+    for _ in range(int(edges * size)):
+        a, b = sorted(rng.sample(range(size), 2))
+        causes[node_ids[a]].add(node_ids[b])
+    nodes = [{
+        'node_id': node_id, 'title': f"Cause {node_id}",
+        'causes': ', '.join(map(str, sorted(causes[node_id]))),
+        'probability': rng.choice([10, 25, 50, 75, 90, 100]),
+        'severity': rng.randint(1, 10),
+    } for node_id in node_ids]
+    outcome_rows = [{
+        'outcome_id': outcome_id, 'title': f"Outcome {outcome_id}",
+        'causedBy': ', '.join(map(str, rng.sample(node_ids,
+                                                  min(size, 3)))),
+    } for outcome_id in outcome_ids]
+    return nodes, outcome_rows
+
+
+def reaches(index, extra, start, target):
+    """Check by brute force for a path along the index and extra edges."""
+    seen = {start}
+    stack = [start]
+    while stack:
+        item_id = stack.pop()
+        if item_id == target:
+            return True
+        for next_id in list(index.children.get(item_id, ())) + \
+                [b for a, b in extra if a == item_id]:
+            if next_id not in seen:
+                seen.add(next_id)
+                stack.append(next_id)
+    return False
+
+
+def add_back_links(rng, nodes, count):
+    """Make a few nodes caused by a random node, which may close cycles."""
+    for row in rng.sample(nodes, count):
+        row['causedBy'] = str(rng.choice(nodes)['node_id'])
+
+
+class PropagateTest(unittest.TestCase):
+
+    def brute_force(self, index, rule):
+        """Propagate by plain recursion, skipping items behind cycles."""
+        ids = list(index.nodes) + list(index.outcomes)
+        cyclic = {item_id for item_id in ids
+                  if any(reaches(index, [], child_id, item_id)
+                         for child_id in index.children.get(item_id, ()))}
+        skipped = {item_id for item_id in ids
+                   if any(reaches(index, [], cycle_id, item_id)
+                          for cycle_id in cyclic)}
+
+        def ancestors(item_id):
+            return {other_id for other_id in index.nodes
+                    if other_id not in skipped and
+                    reaches(index, [], other_id, item_id)}
+
+        def probability(item_id):
+            causes = [probability(parent_id)
+                      for parent_id in index.parents.get(item_id, ())
+                      if parent_id not in skipped]
+            if rule == 'average' and causes:
+                combined = sum(causes) / len(causes)
+            elif rule == 'max' and causes:
+                combined = max(causes)
+            else:
+                miss = 1.0
+                for cause in causes:
+                    miss *= 1 - cause / 100
+                combined = 100 * (1 - miss)
+            node = index.nodes.get(item_id)
+            if node is None:
+                return combined
+            own = node.probability or 0.0
+            return own * combined / 100 if causes else own
+
+        expected = {}
+        for item_id in ids:
+            if item_id in skipped:
+                continue
+            if item_id in index.outcomes and not ancestors(item_id):
+                continue
+            expected[item_id] = (probability(item_id), max(
+                index.nodes[node_id].severity or 0.0
+                for node_id in ancestors(item_id)
+            ))
+        return expected
+
+    def test_matches_brute_force(self):
+        rng = random.Random(6)
+        for _ in range(100):
+            nodes, outcomes = random_graph(rng, rng.randint(2, 10),
+                                           edges=rng.random() * 2)
+            add_back_links(rng, nodes, rng.randint(0, 1))
+            index = GraphIndex(nodes, outcomes)
+            for rule in COMBINE_RULES:
+                expected = self.brute_force(index, rule)
+                found = propagate(index, rule)
+                self.assertEqual(set(found), set(expected))
+                for item_id, (probability, severity) in expected.items():
+                    self.assertAlmostEqual(found[item_id][0], probability)
+                    self.assertEqual(found[item_id][1], severity)
+
+
+class OnlineTopologicalOrderTest(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rng = random.Random(1)
+        for _ in range(100):
+            nodes, outcomes = random_graph(rng, rng.randint(2, 12),
+                                           edges=rng.random())
+            index = GraphIndex(nodes, outcomes)
+            order = OnlineTopologicalOrder(index)
+            ids = list(index.nodes) + list(index.outcomes)
+            for _ in range(20):
+                batch = [tuple(rng.sample(ids, 2))
+                         for _ in range(rng.randint(1, 3))]
+                cycle = any(reaches(index, batch[:i], b, a)
+                            for i, (a, b) in enumerate(batch))
+                try:
+                    order.add_edges(index, batch)
+                except CycleError as error:
+                    self.assertTrue(cycle)
+                    self.assertEqual(error.path[0], error.path[-1])
+                    for a, b in zip(error.path, error.path[1:]):
+                        self.assertTrue(b in index.children.get(a, ()) or
+                                        (a, b) in batch)
+                    continue
+                self.assertFalse(cycle)
+
+                # Save the links, as the UI does once they are accepted
+                for a, b in batch:
+                    rows = nodes if b in index.nodes else outcomes
+                    row = next(row for row in rows
+                               if b in (row.get('node_id'),
+                                        row.get('outcome_id')))
+                    row['causedBy'] = f"{row.get('causedBy', '')}, {a}"
+                index = GraphIndex(nodes, outcomes)
+                for a in index.children:
+                    for b in index.children[a]:
+                        self.assertLess(order.position[a],
+                                        order.position[b])
+
+
+class WalkCausesTest(unittest.TestCase):
+
+    def walk(self, index, max_depth):
+        visited = {}
+        return [line for outcome_id in index.outcomes
+                for line in walk_causes(index, outcome_id, visited,
+                                        max_depth)]
+
+    def test_cause_truncated_deeper_is_expanded(self):
+        # X -> A -> B -> O1 and A -> O2
+        index = GraphIndex(
+            [{'node_id': 1, 'title': 'X', 'causes': '2'},
+             {'node_id': 2, 'title': 'A', 'causes': '3, 11'},
+             {'node_id': 3, 'title': 'B', 'causes': '10'}],
+            [{'outcome_id': 10, 'title': 'O1'},
+             {'outcome_id': 11, 'title': 'O2'}])
+        self.assertEqual(self.walk(index, 2), [
+            (1, 3, 10, 'expanded'),
+            (2, 2, 3, 'truncated'),
+            (1, 2, 11, 'expanded'),
+            (2, 1, 2, 'expanded'),
+        ])
+
+    def test_matches_brute_force(self):
+        rng = random.Random(4)
+        for _ in range(200):
+            nodes, outcomes = random_graph(rng, rng.randint(2, 12),
+                                           edges=rng.random() * 2)
+            # Some back links, so the walk meets cycles too
+            add_back_links(rng, nodes, rng.randint(0, 2))
+            index = GraphIndex(nodes, outcomes)
+            max_depth = rng.choice([None, 1, 2, 3])
+
+            # Levels at which each cause can be reached from an outcome
+            distance = {}
+            frontier = list(index.outcomes)
+            level = 0
+            while frontier and (max_depth is None or level < max_depth):
+                level += 1
+                frontier = [cause_id for item_id in frontier
+                            for cause_id in index.causes_of(item_id)
+                            if cause_id not in distance]
+                for cause_id in frontier:
+                    distance.setdefault(cause_id, level)
+
+            lines = self.walk(index, max_depth)
+            self.assertEqual({cause_id for _, cause_id, _, _ in lines},
+                             set(distance))
+            expanded = set()
+            for level, cause_id, effect_id, status in lines:
+                self.assertIn(cause_id, index.causes_of(effect_id))
+                self.assertGreaterEqual(level, distance[cause_id])
+                if status == 'seen':
+                    self.assertIn(cause_id, expanded)
+                elif status == 'truncated':
+                    self.assertEqual(level, max_depth)
+                elif status == 'expanded':
+                    expanded.add(cause_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
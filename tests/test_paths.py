@@ -0,0 +1,86 @@
+"""
+Top-k critical risk paths checked against enumerating every path.
+"""
+import contextlib
+import io
+import random
+import unittest
+
+from graph import GraphIndex, critical_paths
+from run import DAG
+from storage import create_backend
+from tests.test_graph import random_graph
+
+
+def all_paths(index):
+    """Yield every path from a node without causes to an outcome."""
+    stack = [[node_id] for node_id in index.nodes
+             if not index.parents.get(node_id)]
+    while stack:
+        path = stack.pop()
+        if path[-1] in index.outcomes:
+            yield path
+        for child_id in index.children.get(path[-1], ()):
+            stack.append(path + [child_id])
+
+
+class CriticalPathsTest(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rng = random.Random(2)
+        for _ in range(200):
+            nodes, outcomes = random_graph(rng, rng.randint(2, 12))
+            index = GraphIndex(nodes, outcomes)
+            k = rng.randint(1, 4)
+            expected = {}
+            for path in all_paths(index):
+                probability = 100.0
+                for node_id in path[:-1]:
+                    probability *= index.nodes[node_id].probability / 100
+                severity = max(index.nodes[node_id].severity
+                               for node_id in path[:-1])
+                expected.setdefault(path[-1], []).append(
+                    probability * severity)
+
+            found = critical_paths(index, k)
+            self.assertEqual(set(found), set(expected))
+            for outcome_id, risks in expected.items():
+                best = sorted(risks, reverse=True)[:k]
+                self.assertEqual(
+                    [round(path.risk, 9) for path in found[outcome_id]],
+                    [round(risk, 9) for risk in best]
+                )
+                for path in found[outcome_id]:
+                    self.assertEqual(path.path[-1], outcome_id)
+                    self.assertFalse(index.parents.get(path.path[0]))
+                    for a, b in zip(path.path, path.path[1:]):
+                        self.assertIn(b, index.children[a])
+
+
+class CachedPathsTest(unittest.TestCase):
+
+    def test_reused_until_the_graph_changes(self):
+        rng = random.Random(5)
+        nodes, outcomes = random_graph(rng, 12)
+        dag = DAG(create_backend('memory', records={
+            'nodes': nodes, 'outcomes': outcomes,
+        }), cache_ttl=-1)
+        paths = dag.critical_paths(k=4)
+        self.assertEqual(paths, critical_paths(dag.index, 4))
+        # A smaller k is the start of the cached lists
+        self.assertEqual(dag.critical_paths(k=2), {
+            outcome_id: found[:2] for outcome_id, found in paths.items()
+        })
+        self.assertIs(dag.critical_paths(k=4)[next(iter(paths))][0],
+                      paths[next(iter(paths))][0])
+
+        node_id = paths[next(iter(paths))][0].path[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            dag.update_node(node_id, probability=1)
+        self.assertEqual(dag.critical_paths(k=4),
+                         critical_paths(dag.index, 4))
+        self.assertNotEqual(dag.critical_paths(k=4), paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
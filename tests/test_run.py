@@ -0,0 +1,141 @@
+"""
+Edits through the DAG, checked against the graph they leave behind and
+the outcome values it should have.
+"""
+import contextlib
+import io
+import random
+import unittest
+
+from graph import COMBINE_RULES, GraphIndex, propagate
+from run import DAG
+from storage import create_backend
+from tests.test_graph import random_graph
+
+
+def quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def edges_of(index):
+    return {(a, b) for a, children in index.children.items()
+            for b in children}
+
+
+def acyclic(edges):
+    """Check by brute force, removing items without parents one by one."""
+    edges = set(edges)
+    while edges:
+        children = {b for _, b in edges}
+        roots = {a for a, _ in edges} - children
+        if not roots:
+            return False
+        edges = {(a, b) for a, b in edges if a not in roots}
+    return True
+
+
+class UpdateLinksTest(unittest.TestCase):
+
+    def dag(self, nodes, outcomes=()):
+        return DAG(create_backend('memory', records={
+            'nodes': nodes, 'outcomes': list(outcomes),
+        }), cache_ttl=-1)
+
+    def test_reversing_a_link(self):
+        dag = self.dag([
+            {'node_id': 1, 'title': 'A', 'causes': '2'},
+            {'node_id': 2, 'title': 'B', 'causedBy': '1'},
+        ])
+        dag.order
+        quiet(dag.update_node, 1, causes='', causedBy='2')
+        self.assertEqual(edges_of(dag.index), {(2, 1)})
+        self.assertLess(dag.order.position[2], dag.order.position[1])
+
+    def test_rejected_reversal_keeps_a_valid_order(self):
+        # 3 -> 4 -> 1 -> 2: reversing 1 -> 2 is fine, but 1 -> 3 is not
+        dag = self.dag([
+            {'node_id': 1, 'title': 'A', 'causedBy': '4', 'causes': '2'},
+            {'node_id': 2, 'title': 'B'},
+            {'node_id': 3, 'title': 'C', 'causes': '4'},
+            {'node_id': 4, 'title': 'D'},
+        ])
+        edges = edges_of(dag.index)
+        dag.order
+        quiet(dag.update_node, 1, causedBy='2, 4', causes='3')
+        self.assertEqual(edges_of(dag.index), edges)
+        for a, b in edges:
+            self.assertLess(dag.order.position[a], dag.order.position[b])
+
+    def test_matches_brute_force(self):
+        rng = random.Random(3)
+        for _ in range(40):
+            nodes, outcomes = random_graph(rng, rng.randint(2, 10),
+                                           edges=rng.random() * 2)
+            dag = self.dag(nodes, outcomes)
+            for _ in range(15):
+                index = dag.index
+                node_ids = list(index.nodes)
+                ids = node_ids + list(index.outcomes)
+                node_id = rng.choice(node_ids)
+                causedBy = causes = None
+                before = edges = edges_of(index)
+                added = set()
+                if rng.random() < 0.7:
+                    parents = rng.sample(node_ids, rng.randint(0, 2))
+                    causedBy = ', '.join(map(str, parents))
+                    edges = {(a, b) for a, b in edges if b != node_id}
+                    added.update((a, node_id) for a in parents)
+                if rng.random() < 0.7:
+                    children = rng.sample(ids, rng.randint(0, 2))
+                    causes = ', '.join(map(str, children))
+                    edges = {(a, b) for a, b in edges if a != node_id}
+                    added.update((node_id, b) for b in children)
+                edges = edges | added
+
+                quiet(dag.update_node, node_id, causedBy=causedBy,
+                      causes=causes)
+                saved = GraphIndex(dag.backend.get_records('nodes'),
+                                   dag.backend.get_records('outcomes'))
+                if acyclic(edges):
+                    self.assertEqual(edges_of(saved), edges)
+                else:
+                    self.assertEqual(edges_of(saved), before)
+                for a, b in edges_of(saved):
+                    self.assertLess(dag.order.position[a],
+                                    dag.order.position[b])
+
+
+class OutcomeValuesTest(unittest.TestCase):
+
+    def assertPropagated(self, dag):
+        saved = GraphIndex(dag.backend.get_records('nodes'),
+                           dag.backend.get_records('outcomes'))
+        expected = propagate(saved, dag.rule)
+        for outcome_id, outcome in saved.outcomes.items():
+            if outcome_id in expected:
+                probability, severity = expected[outcome_id]
+                self.assertAlmostEqual(outcome.probability,
+                                       round(probability, 2))
+                self.assertEqual(outcome.severity, int(severity))
+
+    def test_recalculated_after_edits(self):
+        rng = random.Random(7)
+        for rule in COMBINE_RULES:
+            nodes, outcomes = random_graph(rng, 10)
+            dag = DAG(create_backend('memory', records={
+                'nodes': nodes, 'outcomes': outcomes,
+            }), cache_ttl=-1, rule=rule)
+            quiet(dag.calculate_outcome_probabilities_and_severities)
+            self.assertPropagated(dag)
+            # Only the outcomes downstream of each edit are recalculated
+            for _ in range(10):
+                node_id = rng.choice(list(dag.index.nodes))
+                quiet(dag.update_node, node_id,
+                      probability=rng.randint(1, 100),
+                      severity=rng.randint(1, 10))
+                self.assertPropagated(dag)
+
+
+if __name__ == '__main__':
+    unittest.main()
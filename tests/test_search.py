@@ -0,0 +1,138 @@
+"""
+Indexed search checked against a linear scan while the graph is edited.
+"""
+import contextlib
+import io
+import random
+import unittest
+
+from run import DAG
+from search import words_of
+from storage import create_backend
+from tests.test_graph import random_graph, reaches
+
+VOCABULARY = ['pump', 'pumps', 'valve', 'Leak', 'power', 'cut', 'fire',
+              'FIRE', 'x-ray', 'über']
+
+
+def scan(dag, text=None, words=None, probability=None, severity=None,
+         upstream_of=None, downstream_of=None, kind=None):
+    """Return the sorted ids matching the filters, checking every record."""
+    index = dag.index
+    matches = []
+    for table, records in (('node', dag.get_nodes()),
+                           ('outcome', dag.get_outcomes())):
+        for record in records:
+            content = f"{record.title}\n{record.description}".lower()
+            if text and text.lower() not in content:
+                continue
+            if words and not words_of(words) <= words_of(content):
+                continue
+            in_range = True
+            for value, bounds in ((record.probability, probability),
+                                  (record.severity, severity)):
+                low, high = bounds or (None, None)
+                if low is None and high is None:
+                    continue
+                if value is None or low is not None and value < low or \
+                        high is not None and value > high:
+                    in_range = False
+            if not in_range:
+                continue
+            if upstream_of is not None and (
+                    record.id == upstream_of or
+                    not reaches(index, [], record.id, upstream_of)):
+                continue
+            if downstream_of is not None and (
+                    record.id == downstream_of or
+                    not reaches(index, [], downstream_of, record.id)):
+                continue
+            if kind is not None and kind != table:
+                continue
+            matches.append(record.id)
+    return sorted(matches)
+
+
+def random_text(rng, count):
+    return ' '.join(rng.choice(VOCABULARY)
+                    for _ in range(rng.randint(0, count)))
+
+
+def random_filters(rng, ids):
+    filters = {}
+    if rng.random() < 0.4:
+        word = rng.choice(VOCABULARY)
+        start = rng.randint(0, len(word) - 1)
+        # Whole words, pieces of one, or two words in a row
+        filters['text'] = rng.choice([
+            word, word[start:start + rng.randint(1, 3)],
+            f"{word} {rng.choice(VOCABULARY)}", word.upper(),
+        ])
+    if rng.random() < 0.4:
+        filters['words'] = random_text(rng, 2)
+    for field, top in (('probability', 100), ('severity', 10)):
+        if rng.random() < 0.4:
+            low = rng.choice([None, rng.randint(0, top)])
+            high = rng.choice([None, rng.randint(0, top)])
+            filters[field] = (low, high)
+    for field in ('upstream_of', 'downstream_of'):
+        if rng.random() < 0.2:
+            filters[field] = rng.choice(ids)
+    if rng.random() < 0.2:
+        filters['kind'] = rng.choice(['node', 'outcome'])
+    return filters
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def random_edit(self, rng, dag):
+        index = dag.index
+        operation = rng.random()
+        if operation < 0.4:
+            node_id = rng.choice(list(index.nodes))
+            dag.update_node(node_id, title=random_text(rng, 3),
+                            description=random_text(rng, 4),
+                            probability=rng.randint(1, 100),
+                            severity=rng.randint(1, 10))
+        elif operation < 0.55 and index.outcomes:
+            outcome_id = rng.choice(list(index.outcomes))
+            with dag.transaction() as tx:
+                tx.update('outcomes', index.outcome_rows[outcome_id],
+                          {'title': random_text(rng, 3)})
+        elif operation < 0.75:
+            with dag.transaction() as tx:
+                tx.append('nodes', {
+                    'node_id': dag.ids.next_id(),
+                    'title': random_text(rng, 3),
+                    'description': random_text(rng, 4),
+                    'probability': rng.choice(['', rng.randint(1, 100)]),
+                    'severity': rng.randint(1, 10),
+                })
+        elif operation < 0.95 and len(index.nodes) > 2:
+            dag.delete_items(rng.sample(list(index.nodes), 1))
+        else:
+            # Another session replaced the table
+            dag.cache.invalidate(rng.choice(['nodes', 'outcomes']))
+
+    def test_matches_linear_scan(self):
+        rng = random.Random(9)
+        for _ in range(30):
+            nodes, outcomes = random_graph(rng, rng.randint(2, 12))
+            for row in nodes + outcomes:
+                row['title'] = random_text(rng, 3)
+                row['description'] = random_text(rng, 4)
+            dag = DAG(create_backend('memory', records={
+                'nodes': nodes, 'outcomes': outcomes,
+            }), cache_ttl=-1)
+            for _ in range(12):
+                ids = list(dag.index.nodes) + list(dag.index.outcomes)
+                for _ in range(10):
+                    filters = random_filters(rng, ids)
+                    self.assertEqual(dag.search(**filters),
+                                     scan(dag, **filters), filters)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.random_edit(rng, dag)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Shared server requests addressed from an outdated snapshot, and sessions
+outliving the server they connected to.
+"""
+import contextlib
+import io
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from run import DAG
+from server import DAGServer, DAGService
+from storage import RemoteBackend, RemoteError, create_backend
+
+
+class DroppingServer(DAGServer):
+    """DAG server that can cut the connections it accepted."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.connections = []
+
+    def get_request(self):
+        connection, address = super().get_request()
+        self.connections.append(connection)
+        return connection, address
+
+    def drop_connections(self):
+        for connection in self.connections:
+            with contextlib.suppress(OSError):
+                connection.shutdown(socket.SHUT_RDWR)
+
+
+class ResolveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = DAGService(create_backend('memory', records={
+            'nodes': [{'node_id': item_id, 'title': f"Cause {item_id}"}
+                      for item_id in (1, 2, 3)],
+        }))
+
+    def titles(self):
+        return [record['title']
+                for record in self.service.get_records('nodes')]
+
+    def test_moved_rows_are_found_by_id(self):
+        # Another session deleted node 1, so node 3 moved from row 4 to 3
+        self.service.delete_rows('nodes', [(2, 1)])
+        self.service.update_cells('nodes', [(4, 3, 'title', 'Moved')])
+        self.assertEqual(self.titles(), ['Cause 2', 'Moved'])
+        self.service.delete_rows('nodes', [(4, 3)])
+        self.assertEqual(self.titles(), ['Cause 2'])
+
+    def test_deleted_record_is_reported(self):
+        self.service.delete_rows('nodes', [(3, 2)])
+        with self.assertRaises(KeyError):
+            self.service.update_cells('nodes', [(3, 2, 'title', 'Gone')])
+
+
+class RestartTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'dag.sock')
+        self.backend = create_backend('memory', records={
+            'nodes': [{'node_id': item_id, 'title': f"Cause {item_id}"}
+                      for item_id in (1, 2, 3)],
+        })
+        self.server = None
+        self.start()
+
+    def start(self):
+        if self.server is not None:
+            self.stop()
+        self.server = DroppingServer(self.path, DAGService(self.backend))
+        threading.Thread(target=self.server.serve_forever, args=(0.01,),
+                         daemon=True).start()
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server.drop_connections()
+            self.server = None
+            os.remove(self.path)
+
+    def session(self):
+        return DAG(RemoteBackend(self.path), cache_ttl=-1)
+
+    def edit(self, node_id, title):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.session().update_node(node_id, title=title)
+
+    def test_restarted_server_is_synced_in_full(self):
+        dag = self.session()
+        dag.index
+        self.edit(1, 'Before')
+        dag.sync()
+        # The new server counts versions from 0 again
+        self.start()
+        self.edit(2, 'After')
+        dag.sync()
+        self.assertEqual([record['title'] for record in dag.get_nodes()],
+                         ['Before', 'After', 'Cause 3'])
+
+    def test_dropped_connection_is_reopened(self):
+        dag = self.session()
+        dag.index
+        self.server.drop_connections()
+        self.edit(3, 'Edited')
+        dag.sync()
+        self.assertEqual(dag.index.node(3)['title'], 'Edited')
+        self.server.drop_connections()
+        with contextlib.redirect_stdout(io.StringIO()):
+            dag.update_node(1, title='Reconnected')
+        self.assertEqual(self.backend.get_records('nodes')[0]['title'],
+                         'Reconnected')
+
+    def test_stopped_server_is_reported(self):
+        dag = self.session()
+        dag.index
+        self.stop()
+        with self.assertRaises(RemoteError):
+            dag.sync()
+        with self.assertRaises(RemoteError):
+            dag.cache.refresh()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Monte Carlo results checked against exact enumeration on small graphs.
+"""
+import itertools
+import random
+import unittest
+
+from graph import GraphIndex, propagate, topological_order
+from simulation import PRECISION_BITS, simulate
+from tests.test_graph import random_graph
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def exact_risks(index):
+    """
+    Return {outcome_id: (probability, expected severity)} under noisy_or.
+
+    Every combination of nodes occurring on their own is enumerated, so
+    causes sharing ancestors are accounted for exactly.
+    """
+    order, _ = topological_order(index)
+    node_ids = [item_id for item_id in order if item_id in index.nodes]
+    chances = {
+        node_id: round(index.nodes[node_id].probability / 100 *
+                       2 ** PRECISION_BITS) / 2 ** PRECISION_BITS
+        for node_id in node_ids
+    }
+    totals = {}
+    for own in itertools.product((False, True), repeat=len(node_ids)):
+        weight = 1.0
+        for node_id, occurs in zip(node_ids, own):
+            weight *= chances[node_id] if occurs else 1 - chances[node_id]
+        if not weight:
+            continue
+
+        # Severity of the worst path for every item that occurs
+        severity = {}
+        own = dict(zip(node_ids, own))
+        for item_id in order:
+            causes = [severity[parent_id]
+                      for parent_id in index.parents.get(item_id, ())
+                      if parent_id in severity]
+            node = index.nodes.get(item_id)
+            if node is None:
+                if causes:
+                    severity[item_id] = max(causes)
+            elif own[item_id] and (causes or
+                                   not index.parents.get(item_id)):
+                severity[item_id] = max(causes + [node.severity])
+
+        for outcome_id in index.outcomes:
+            probability, expected = totals.get(outcome_id, (0.0, 0.0))
+            if outcome_id in severity:
+                probability += weight
+                expected += weight * severity[outcome_id]
+            totals[outcome_id] = (probability, expected)
+    return {outcome_id: (probability,
+                         expected / probability if probability else 0.0)
+            for outcome_id, (probability, expected) in totals.items()}
+
+
+def random_forest(rng, size, outcomes=3):
+    """
+    Return (nodes, outcomes) rows where every node has a single effect.
+
+    No two causes of an item then share an ancestor, so the analytic
+    propagation is exact under every rule.
+    """
+    ids = rng.sample(range(1, 10 * size + 1), size + outcomes)
+    node_ids, outcome_ids = ids[:size], ids[size:]
+    nodes = [{
+        'node_id': node_id, 'title': f"Cause {node_id}",
+        'causes': str(rng.choice(node_ids[i + 1:] + outcome_ids)),
+        # Multiples of 1 / 2 ** PRECISION_BITS, so nothing is rounded
+        'probability': rng.choice([25, 50, 75, 100]),
+        'severity': rng.randint(1, 10),
+    } for i, node_id in enumerate(node_ids)]
+    outcome_rows = [{'outcome_id': outcome_id,
+                     'title': f"Outcome {outcome_id}"}
+                    for outcome_id in outcome_ids]
+    return nodes, outcome_rows
+
+
+@unittest.skipIf(numpy is None, "the simulation needs NumPy")
+class SimulationTest(unittest.TestCase):
+
+    def test_matches_enumeration(self):
+        rng = random.Random(3)
+        for seed in range(10):
+            nodes, outcomes = random_graph(rng, rng.randint(2, 10))
+            index = GraphIndex(nodes, outcomes)
+            risks = simulate(index, 'noisy_or', trials=200000, seed=seed)
+            for outcome_id, (probability, severity) in \
+                    exact_risks(index).items():
+                risk = risks[outcome_id]
+                self.assertAlmostEqual(risk.probability / 100, probability,
+                                       delta=0.005)
+                self.assertLessEqual(risk.low / 100, probability + 0.005)
+                self.assertGreaterEqual(risk.high / 100, probability - 0.005)
+                if probability > 0.05:
+                    self.assertAlmostEqual(risk.severity, severity,
+                                           delta=0.15)
+
+    def test_matches_propagation_without_shared_causes(self):
+        rng = random.Random(4)
+        for seed in range(10):
+            nodes, outcomes = random_forest(rng, rng.randint(2, 12))
+            index = GraphIndex(nodes, outcomes)
+            for rule in ('average', 'noisy_or', 'max'):
+                expected = propagate(index, rule)
+                risks = simulate(index, rule, trials=200000, seed=seed)
+                self.assertEqual(set(risks), set(expected) &
+                                 set(index.outcomes))
+                for outcome_id, risk in risks.items():
+                    self.assertAlmostEqual(risk.probability,
+                                           expected[outcome_id][0],
+                                           delta=0.5)
+
+    def test_pool_matches_one_process(self):
+        nodes, outcomes = random_graph(random.Random(5), 30)
+        index = GraphIndex(nodes, outcomes)
+        options = {'trials': 50000, 'seed': 1, 'chunk_trials': 8192}
+        self.assertEqual(simulate(index, 'noisy_or', workers=2, **options),
+                         simulate(index, 'noisy_or', **options))
+
+
+if __name__ == '__main__':
+    unittest.main()
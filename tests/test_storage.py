@@ -0,0 +1,99 @@
+"""
+Writes and deletes addressed from a snapshot another session has outdated.
+"""
+import contextlib
+import io
+import unittest
+
+import bench
+from run import DAG
+from storage import MissingRecordError
+
+
+def quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+class StaleSheetsWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        nodes = [[item_id, f"Cause {item_id}", '', '', '', 0.5, 1.0]
+                 for item_id in range(1, 13)]
+        outcomes = [[100, 'Outcome', '', '12', 0.5, 1.0]]
+        mine = bench.FakeSheetsBackend(nodes, outcomes)
+        theirs = bench.FakeSheetsBackend([], [])
+        theirs.fake = mine.fake
+        # A negative TTL keeps the snapshot until it is synced explicitly
+        self.dag = DAG(mine, cache_ttl=-1)
+        self.other = DAG(theirs, cache_ttl=-1)
+        self.dag.index
+        self.sheet = mine.fake.worksheet('nodes')
+
+    def stored(self):
+        return {row[0]: row[1] for row in self.sheet.rows[1:]}
+
+    def test_rows_moved_by_another_session(self):
+        quiet(self.other.delete_items, [1])
+        # No sync: the snapshot still has node 5 on row 6 and 10 on row 11
+        quiet(self.dag.delete_items, [5])
+        quiet(self.dag.update_node, 10, title='Edited')
+        stored = self.stored()
+        self.assertNotIn(5, stored)
+        self.assertEqual(stored[6], 'Cause 6')
+        self.assertEqual(stored[10], 'Edited')
+        self.assertEqual(stored[11], 'Cause 11')
+        self.assertEqual(len(stored), 10)
+
+    def test_record_deleted_by_another_session(self):
+        quiet(self.other.delete_items, [4])
+        with self.assertRaises(MissingRecordError):
+            quiet(self.dag.update_node, 4, title='Edited')
+        # The failed write dropped the snapshot, so the next read is fresh
+        self.assertFalse(self.dag.index.exists(4))
+        quiet(self.other.delete_items, [7])
+        with self.assertRaises(MissingRecordError):
+            quiet(self.dag.delete_items, [7])
+        self.assertEqual(len(self.stored()), 10)
+        self.assertFalse(self.dag.index.exists(7))
+
+
+class DeleteItemsTest(unittest.TestCase):
+
+    def setUp(self):
+        # 1 -> 2 -> 3 -> 100, and 1 -> 101
+        nodes = [[1, 'A', '', '', '2, 101', 0.5, 1.0],
+                 [2, 'B', '', '1', '3', 0.5, 1.0],
+                 [3, 'C', '', '2', '100', 0.5, 1.0]]
+        outcomes = [[100, 'X', '', '3', 0.0, 0.0],
+                    [101, 'Y', '', '1', 0.0, 0.0]]
+        self.backend = bench.FakeSheetsBackend(nodes, outcomes)
+        self.dag = DAG(self.backend, cache_ttl=-1)
+        quiet(self.dag.calculate_outcome_probabilities_and_severities)
+
+    def test_links_are_stripped_and_outcomes_recalculated(self):
+        deleted = quiet(self.dag.delete_items, [2, 'x', 999])
+        self.assertEqual(deleted, {2})
+        index = self.dag.index
+        self.assertEqual(list(index.node(1).causes), [101])
+        self.assertEqual(list(index.node(3).caused_by), [])
+        self.assertEqual(list(index.children.get(1)), [101])
+        self.assertNotIn(2, index.parents.get(3, ()))
+        # A fresh read sees the same rows as the snapshot
+        fresh = DAG(self.backend, cache_ttl=-1)
+        self.assertEqual([dict(record) for record in fresh.get_nodes()],
+                         [dict(record) for record in self.dag.get_nodes()])
+        self.assertEqual(fresh.get_outcomes()[0]['causedBy'], '3')
+        # Recalculating everything changes none of the outcomes
+        outcomes = [dict(record) for record in self.dag.get_outcomes()]
+        quiet(fresh.calculate_outcome_probabilities_and_severities)
+        self.assertEqual([dict(record) for record in fresh.get_outcomes()],
+                         outcomes)
+
+    def test_unknown_ids_delete_nothing(self):
+        self.assertEqual(quiet(self.dag.delete_items, [7]), set())
+        self.assertEqual(len(self.dag.get_nodes()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+"""
+Delta sync between two sessions sharing a backend.
+
+One session makes random edits, appends and deletes, the other makes its
+own and syncs. After every sync its snapshot and graph index must match
+what a fresh read of the backend gives. Backends that address records
+by id may list rows appended by both sessions in another order; Sheets
+writes by row, so there the order must match too. A session whose
+changes were pruned from the change log must end up in sync as well.
+"""
+import collections
+import contextlib
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import bench
+from cache import WriteTransaction
+from graph import GraphIndex, Record
+from run import DAG
+from server import DAGServer, DAGService
+import storage
+from storage import FIELDS, RemoteBackend, create_backend
+
+
+class DeltaSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes, self.outcomes = bench.generate_graph(60, seed=0)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def check_sessions(self, mine, theirs, seed=0, steps=60,
+                       ordered=False):
+        rng = random.Random(seed)
+        dag = DAG(mine, cache_ttl=-1)
+        other = DAG(theirs, cache_ttl=-1)
+        dag.index
+        for _ in range(steps):
+            self.random_write(rng, rng.choice([dag, other]))
+            if rng.random() < 0.3:
+                dag.sync(force=True)
+                self.assertSynced(dag, ordered)
+        dag.sync(force=True)
+        self.assertSynced(dag, ordered)
+        # Tables were only downloaded once; everything else was a delta
+        self.assertEqual(dag.cache.fetches, len(FIELDS))
+
+    def random_write(self, rng, dag):
+        # Catch up first, so no write addresses a row the other moved
+        dag.sync(force=True)
+        index = dag.index
+        ids = list(index.nodes) + list(index.outcomes)
+
+        def links():
+            return ', '.join(str(rng.choice(ids + [999999]))
+                             for _ in range(rng.randint(0, 3)))
+
+        operation = rng.random()
+        if operation < 0.2 and len(ids) > 10:
+            with contextlib.redirect_stdout(io.StringIO()):
+                dag.delete_items(rng.sample(ids, rng.randint(1, 2)))
+            return
+        tx = WriteTransaction(dag.backend, dag.cache)
+        table = rng.choice(list(FIELDS))
+        if operation < 0.6:
+            items = index.nodes if table == 'nodes' else index.outcomes
+            for item_id in rng.sample(list(items), min(2, len(items))):
+                fields = {'causedBy': links(),
+                          'title': f"Edit {rng.random()}"}
+                if table == 'nodes':
+                    fields['causes'] = links()
+                tx.update(table, index.rows(table)[item_id], fields)
+        else:
+            record = {FIELDS[table][0]: dag.ids.next_id(), 'title': 'New',
+                      'causedBy': links()}
+            if table == 'nodes':
+                record['causes'] = links()
+            tx.append(table, record)
+        tx.commit()
+
+    def assertSynced(self, dag, ordered):
+        for table in FIELDS:
+            stored = [dict(Record(FIELDS[table], row))
+                      for row in dag.backend.get_records(table)]
+            cached = [dict(record) for record in dag.cache.get(table)]
+            if not ordered:
+                id_field = FIELDS[table][0]
+                stored.sort(key=lambda record: record[id_field])
+                cached.sort(key=lambda record: record[id_field])
+            self.assertEqual(cached, stored)
+        index = dag.index
+        rebuilt = GraphIndex(dag.get_nodes(), dag.get_outcomes())
+        self.assertEqual(index.children, rebuilt.children)
+        self.assertEqual(index.parents, rebuilt.parents)
+        self.assertEqual(index.node_rows, rebuilt.node_rows)
+        self.assertEqual(index.outcome_rows, rebuilt.outcome_rows)
+
+    def test_sqlite(self):
+        path = os.path.join(self.directory, 'dag.db')
+        backend = create_backend('sqlite', path=path)
+        backend.append_rows('nodes', self.nodes)
+        backend.append_rows('outcomes', self.outcomes)
+        self.check_sessions(create_backend('sqlite', path=path),
+                            create_backend('sqlite', path=path))
+
+    def test_sheets(self):
+        mine = bench.FakeSheetsBackend(self.nodes, self.outcomes)
+        theirs = bench.FakeSheetsBackend([], [])
+        theirs.fake = mine.fake
+        self.check_sessions(mine, theirs, seed=1, ordered=True)
+
+    def test_remote(self):
+        records = {table: [dict(zip(FIELDS[table], row)) for row in rows]
+                   for table, rows in (('nodes', self.nodes),
+                                       ('outcomes', self.outcomes))}
+        path = os.path.join(self.directory, 'dag.sock')
+        server = DAGServer(path, DAGService(create_backend(
+            'memory', records=records)))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.check_sessions(RemoteBackend(path), RemoteBackend(path),
+                            seed=2)
+
+    def test_expired_tables_sync_together(self):
+        mine = bench.FakeSheetsBackend(self.nodes, self.outcomes)
+        theirs = bench.FakeSheetsBackend([], [])
+        theirs.fake = mine.fake
+        dag = DAG(mine, cache_ttl=0.2)
+        other = DAG(theirs, cache_ttl=-1)
+        dag.index
+        node_id = next(iter(other.index.nodes))
+        with contextlib.redirect_stdout(io.StringIO()):
+            other.update_node(node_id, title='Changed')
+        time.sleep(0.3)
+        mine.calls.clear()
+        self.assertEqual(dag.index.node(node_id)['title'], 'Changed')
+        # One revision check and one download bring both tables up to date
+        self.assertEqual(mine.calls['files_get'], 1)
+        self.assertEqual(mine.calls['values_batch_get'], 1)
+        self.assertEqual(dag.cache.fetches, len(FIELDS))
+        self.assertSynced(dag, ordered=True)
+
+    def check_pruned(self, mine, theirs):
+        dag = DAG(mine, cache_ttl=-1)
+        other = DAG(theirs, cache_ttl=-1)
+        dag.index
+        rng = random.Random(3)
+        for _ in range(8):
+            self.random_write(rng, other)
+        dag.sync(force=True)
+        self.assertSynced(dag, ordered=False)
+        # The changes were no longer listed, so the tables were re-read
+        self.assertGreater(dag.cache.fetches, len(FIELDS))
+
+    def test_sqlite_pruned_log(self):
+        path = os.path.join(self.directory, 'dag.db')
+        backend = create_backend('sqlite', path=path)
+        backend.append_rows('nodes', self.nodes)
+        backend.append_rows('outcomes', self.outcomes)
+        with mock.patch.object(storage, 'CHANGE_LOG_SIZE', 3):
+            self.check_pruned(create_backend('sqlite', path=path),
+                              create_backend('sqlite', path=path))
+
+    def test_server_pruned_log(self):
+        records = {table: [dict(zip(FIELDS[table], row)) for row in rows]
+                   for table, rows in (('nodes', self.nodes),
+                                       ('outcomes', self.outcomes))}
+        service = DAGService(create_backend('memory', records=records))
+        service.log.entries = collections.deque(maxlen=3)
+        path = os.path.join(self.directory, 'dag.sock')
+        server = DAGServer(path, service)
+        threading.Thread(target=server.serve_forever, args=(0.01,),
+                         daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.check_pruned(RemoteBackend(path), RemoteBackend(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
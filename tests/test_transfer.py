@@ -0,0 +1,104 @@
+"""
+Imports validated against the graph and the file itself.
+"""
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from graph import GraphIndex, topological_order
+from run import DAG
+from storage import create_backend
+from transfer import ImportValidationError, export_graph, import_graph
+
+
+class ImportTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.dag = DAG(create_backend('memory', records={
+            'nodes': [{'node_id': 1, 'title': 'A', 'causes': '2'},
+                      {'node_id': 2, 'title': 'B'}],
+            'outcomes': [{'outcome_id': 3, 'title': 'X', 'causedBy': '2'}],
+        }), cache_ttl=-1)
+
+    def write(self, records, name='import.jsonl'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            for record in records:
+                file.write(json.dumps(record) + '\n')
+        return path
+
+    def load(self, records):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return import_graph(self.dag, self.write(records))
+
+    def titles(self):
+        return {record['title']: record for record in
+                self.dag.get_nodes() + self.dag.get_outcomes()}
+
+    def test_references_are_rewritten_to_new_ids(self):
+        counts = self.load([
+            # 1 is taken, so the file's node 1 gets a new id
+            {'type': 'node', 'id': '1', 'title': 'C', 'causedBy': '2'},
+            {'type': 'node', 'id': 'd', 'title': 'D', 'causedBy': '1'},
+            {'type': 'outcome', 'id': '', 'title': 'Y', 'causedBy': 'd, 1'},
+        ])
+        self.assertEqual(counts, (2, 1))
+        records = self.titles()
+        c, d = records['C']['node_id'], records['D']['node_id']
+        self.assertNotIn(c, (1, 2, 3))
+        self.assertEqual(records['C']['causedBy'], '2')
+        self.assertEqual(records['D']['causedBy'], str(c))
+        self.assertEqual(records['Y']['causedBy'], f"{d}, {c}")
+        index = self.dag.index
+        self.assertEqual(index.missing_references(), [])
+        self.assertEqual(topological_order(index)[1], set())
+
+    def test_unknown_references_are_rejected(self):
+        for reference in ('o9', 'a3', '99', '2x'):
+            with self.subTest(reference=reference):
+                with self.assertRaisesRegex(ImportValidationError,
+                                            f"c -> {reference}"):
+                    self.load([
+                        {'type': 'node', 'id': 'c', 'title': 'C',
+                         'causes': f"2, {reference}"},
+                    ])
+                self.assertNotIn('C', self.titles())
+
+    def test_cycles_are_rejected(self):
+        with self.assertRaisesRegex(ImportValidationError, 'cycle'):
+            self.load([
+                {'type': 'node', 'id': 'c', 'title': 'C', 'causedBy': '2',
+                 'causes': '1'},
+            ])
+        with self.assertRaisesRegex(ImportValidationError, 'cycle'):
+            self.load([
+                {'type': 'node', 'id': 'c', 'title': 'C', 'causes': 'd'},
+                {'type': 'node', 'id': 'd', 'title': 'D', 'causes': 'c'},
+            ])
+        self.assertEqual(len(self.dag.get_nodes()), 2)
+
+    def test_round_trip(self):
+        for name in ('graph.csv', 'graph.jsonl'):
+            with self.subTest(name=name):
+                path = os.path.join(self.directory, name)
+                self.assertEqual(export_graph(self.dag, path), 3)
+                copy = DAG(create_backend('memory'), cache_ttl=-1)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.assertEqual(import_graph(copy, path), (2, 1))
+                original = GraphIndex(self.dag.get_nodes(),
+                                      self.dag.get_outcomes())
+                imported = copy.index
+                self.assertEqual(imported.children, original.children)
+                self.assertEqual(
+                    [record['title'] for record in copy.get_nodes()],
+                    ['A', 'B'])
+
+
+if __name__ == '__main__':
+    unittest.main()
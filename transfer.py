@@ -0,0 +1,233 @@
+"""
+Streaming import and export of nodes and outcomes.
+
+Files hold one record per CSV row or JSON Lines line, with the columns in
+EXPORT_FIELDS. ``type`` is 'node' or 'outcome'; rows shaped like the
+worksheets (with a ``node_id`` or ``outcome_id`` column) are accepted too.
+Files are read in a streaming fashion, so only ids and links are kept in
+memory while an import is validated.
+"""
+import csv
+import json
+
+from graph import GraphIndex, to_id, topological_order
+from storage import NODE_FIELDS, OUTCOME_FIELDS
+
+CHUNK_SIZE = 500
+FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ['type', 'id', 'title', 'description', 'causedBy', 'causes',
+                 'probability', 'severity']
+
+
+class ImportValidationError(ValueError):
+    """Raised when a file would leave the graph inconsistent."""
+
+
+def detect_format(path, fmt=None):
+    """Return the file format given explicitly or by the file extension."""
+    if fmt is None:
+        fmt = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    if fmt not in FORMATS:
+        raise ValueError(
+            f"Unknown format '{fmt}'. Choose one of: {', '.join(FORMATS)}"
+        )
+    return fmt
+
+
+def link_text(value):
+    """Return a causedBy/causes value as comma-separated text."""
+    if isinstance(value, (list, tuple)):
+        return ', '.join(str(item) for item in value)
+    return '' if value is None else str(value)
+
+
+def normalize(row):
+    """Convert a CSV or JSON row into a record in EXPORT_FIELDS form."""
+    if row.get('type'):
+        kind = str(row['type']).strip().lower()
+    else:
+        kind = 'outcome' if 'outcome_id' in row else 'node'
+    if kind not in ('node', 'outcome'):
+        raise ImportValidationError(f"Unknown record type '{kind}'")
+
+    record = {field: row.get(field, '') for field in EXPORT_FIELDS}
+    record['type'] = kind
+    record['id'] = str(
+        row.get('id') or row.get('node_id') or row.get('outcome_id') or ''
+    ).strip()
+    record['causedBy'] = link_text(row.get('causedBy'))
+    record['causes'] = '' if kind == 'outcome' else \
+        link_text(row.get('causes'))
+    return record
+
+
+def read_records(path, fmt=None):
+    """Yield normalized records from a file one at a time."""
+    fmt = detect_format(path, fmt)
+    with open(path, newline='', encoding='utf-8') as file:
+        if fmt == 'csv':
+            for row in csv.DictReader(file):
+                yield normalize(row)
+        else:
+            for line in file:
+                if line.strip():
+                    yield normalize(json.loads(line))
+
+
+def export_graph(dag, path, fmt=None):
+    """
+    Write every node and outcome to a file, one record at a time.
+
+    Records are streamed straight from the cached snapshot without
+    building a copy of either table. Returns the number of records.
+    """
+    fmt = detect_format(path, fmt)
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, EXPORT_FIELDS) if fmt == 'csv' \
+            else None
+        if writer:
+            writer.writeheader()
+        for kind, records in (('node', dag.get_nodes()),
+                              ('outcome', dag.get_outcomes())):
+            for record in records:
+                row = {
+                    'type': kind,
+                    'id': record.get(f'{kind}_id', ''),
+                    'title': record.get('title', ''),
+                    'description': record.get('description', ''),
+                    'causedBy': record.get('causedBy', ''),
+                    'causes': record.get('causes', ''),
+                    'probability': record.get('probability', ''),
+                    'severity': record.get('severity', ''),
+                }
+                if writer:
+                    writer.writerow(row)
+                else:
+                    file.write(json.dumps(row) + '\n')
+                count += 1
+    return count
+
+
+def import_graph(dag, path, fmt=None, chunk_size=CHUNK_SIZE):
+    """
+    Append the nodes and outcomes in a file to the graph.
+
+    The file is read twice. The first pass assigns ids and collects the
+    links, which are validated in a single pass over the combined graph:
+    every reference must name an id in the file or in the graph, and the
+    import may not add a cycle, though it does not fail on ones already
+    in the graph. IDs in the file are kept unless they are missing or
+    already taken, in which case new ones are allocated and references
+    within the file are rewritten to match. The second pass appends the
+    records in chunks of ``chunk_size`` rows. Outcomes downstream of the
+    imported items are recalculated once at the end.
+
+    Returns (nodes imported, outcomes imported).
+    """
+    index = dag.index
+    id_map = {}
+    taken = set()
+    links = []
+
+    # First pass: ids and links only
+    for record in read_records(path, fmt):
+        label = record['id']
+        if label and label in id_map:
+            raise ImportValidationError(f"Duplicate ID {label} in {path}")
+        item_id = to_id(label)
+        if item_id is None or index.exists(item_id) or item_id in taken:
+            item_id = None
+        else:
+            taken.add(item_id)
+        id_map[label or object()] = item_id
+        links.append((record['type'], record['causedBy'], record['causes']))
+
+    unassigned = [label for label, item_id in id_map.items()
+                  if item_id is None]
+    new_ids = dag.ids.reserve(len(unassigned), exclude=taken)
+    id_map.update(zip(unassigned, new_ids))
+
+    def resolve(links, unknown=None):
+        """
+        Rewrite file-local ids in a link string to graph ids.
+
+        Tokens that are neither an id in the file nor one in the graph
+        are left out and added to ``unknown``.
+        """
+        ids = []
+        for token in links.split(','):
+            token = token.strip()
+            if not token:
+                continue
+            if token in id_map:
+                ids.append(str(id_map[token]))
+            elif index.exists(to_id(token)):
+                ids.append(str(to_id(token)))
+            elif unknown is not None:
+                unknown.append(token)
+        return ', '.join(ids)
+
+    node_stubs, outcome_stubs = [], []
+    unknown = []
+    for label, item_id, (kind, caused_by, causes) in zip(
+            id_map, id_map.values(), links):
+        refs = []
+        if kind == 'node':
+            node_stubs.append({'node_id': item_id,
+                               'causedBy': resolve(caused_by, refs),
+                               'causes': resolve(causes, refs)})
+        else:
+            outcome_stubs.append({'outcome_id': item_id,
+                                  'causedBy': resolve(caused_by, refs)})
+        label = label if isinstance(label, str) else item_id
+        unknown.extend((label, ref) for ref in refs)
+    del links
+
+    if unknown:
+        details = ', '.join(f"{label} -> {ref}"
+                            for label, ref in unknown[:10])
+        raise ImportValidationError(f"Unknown IDs referenced: {details}")
+
+    # Only report cycles the import adds: older sheets may already
+    # hold some
+    check = GraphIndex(dag.get_nodes() + node_stubs,
+                       dag.get_outcomes() + outcome_stubs)
+    _, cyclic_before = topological_order(index)
+    _, cyclic = topological_order(check)
+    cyclic -= cyclic_before
+    if cyclic:
+        labels = {item_id: label for label, item_id in id_map.items()
+                  if isinstance(label, str)}
+        raise ImportValidationError(
+            "Import would create a cycle through IDs: " + ', '.join(
+                str(labels.get(item_id, item_id))
+                for item_id in sorted(cyclic)[:10]
+            )
+        )
+    del check, node_stubs, outcome_stubs
+
+    # Second pass: write the records in chunks
+    counts = {'node': 0, 'outcome': 0}
+    labels = iter(id_map.items())
+    records = read_records(path, fmt)
+    while True:
+        chunk = [record for _, record in zip(range(chunk_size), records)]
+        if not chunk:
+            break
+        with dag.transaction() as tx:
+            for record in chunk:
+                _, item_id = next(labels)
+                kind = record['type']
+                fields = NODE_FIELDS if kind == 'node' else OUTCOME_FIELDS
+                values = dict(record, causedBy=resolve(record['causedBy']),
+                              causes=resolve(record['causes']))
+                values[fields[0]] = item_id
+                tx.append(f'{kind}s', {
+                    field: values.get(field, '') for field in fields
+                })
+                counts[kind] += 1
+
+    dag.reset_order()
+    dag.recompute_outcomes(id_map.values())
+    return counts['node'], counts['outcome']
@@ -0,0 +1,290 @@
+"""
+Scrollable curses viewer for large graphs.
+
+The viewer shows either a table of every node and outcome or a tree of
+the outcomes and their causes. Only the rows inside the window are
+formatted and drawn, and curses sends just the cells that changed, so
+the bytes written to the terminal stay the same however large the
+graph is. Tree rows start collapsed and a subtree is only read from the
+index when it is expanded.
+
+Keys:
+
+    Up/Down, j/k      move one row
+    PgUp/PgDn, space  move one page
+    Home/End, g/G     jump to the first or last row
+    Enter, Right, l   expand the selected cause in the tree
+    Left, h           collapse it, or go to its parent
+    Tab               switch between the table and the tree
+    r                 reload the graph
+    q, Escape         return to the menu
+"""
+import os
+import sys
+
+try:
+    import curses
+except ImportError:
+    # Not bundled with Python on Windows
+    curses = None
+
+TABLE, TREE = 'table', 'tree'
+
+HELP = ("Arrows/PgUp/PgDn move  Enter/Left open/close  Tab table/tree  "
+        "r reload  q quit")
+
+
+def risk_level(probability):
+    """Return 0, 1 or 2 for a low, medium or high probability."""
+    probability = probability or 0
+    if probability < 30:
+        return 0
+    return 1 if probability <= 70 else 2
+
+
+def fit(text, width):
+    """Cut or pad text to exactly ``width`` characters."""
+    return text[:width].ljust(width)
+
+
+class TableRows:
+    """Rows of the table view, formatted only when they are drawn."""
+
+    HEADER = (f"{'ID':<8}{'Title':<24}{'Prob':>6}{'Sev':>5}  "
+              f"{'Caused By':<16}{'Causes':<16}")
+
+    def __init__(self, index):
+        self.index = index
+        self.ids = list(index.nodes) + list(index.outcomes)
+        self.outcome_start = len(index.nodes)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def record(self, position):
+        item_id = self.ids[position]
+        if position < self.outcome_start:
+            return self.index.nodes[item_id]
+        return self.index.outcomes[item_id]
+
+    def line(self, position):
+        """Return (text, probability) for a row."""
+        record = self.record(position)
+        kind = 'O' if position >= self.outcome_start else ' '
+        probability = '' if record.probability is None \
+            else f"{record.probability:g}"
+        severity = '' if record.severity is None \
+            else f"{record.severity:g}"
+        text = (f"{kind}{record.id:<7}{fit(record.title, 23)} "
+                f"{probability:>6}{severity:>5}  "
+                f"{fit(record['causedBy'], 15)} "
+                f"{fit(record.get('causes', ''), 15)}")
+        return text, record.probability
+
+
+class TreeRows:
+    """
+    Rows of the tree view, expanded lazily.
+
+    Each row is ``[level, item_id, expanded, cycle]``. The roots are
+    the outcomes; expanding a row inserts the causes of its item right
+    below it, and collapsing removes its descendants again. A cause that
+    already appears above it on its own path is marked as a cycle and
+    cannot be expanded.
+    """
+
+    HEADER = "Outcomes and their causes"
+
+    def __init__(self, index):
+        self.index = index
+        self.rows = [[0, outcome_id, False, False]
+                     for outcome_id in index.outcomes]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def ancestors(self, position):
+        """Yield the positions of a row's parent, grandparent and so on."""
+        level = self.rows[position][0]
+        while level and position:
+            position -= 1
+            if self.rows[position][0] < level:
+                level = self.rows[position][0]
+                yield position
+
+    def expand(self, position):
+        """Insert the causes of a row below it. Returns True if any."""
+        level, item_id, expanded, cycle = self.rows[position]
+        cause_ids = self.index.causes_of(item_id)
+        if expanded or cycle or not cause_ids:
+            return False
+        path = {item_id} | {self.rows[ancestor][1]
+                            for ancestor in self.ancestors(position)}
+        self.rows[position][2] = True
+        self.rows[position + 1:position + 1] = [
+            [level + 1, cause_id, False, cause_id in path]
+            for cause_id in cause_ids
+        ]
+        return True
+
+    def collapse(self, position):
+        """Remove a row's descendants. Returns True if it was expanded."""
+        level, _, expanded, _ = self.rows[position]
+        if not expanded:
+            return False
+        end = position + 1
+        while end < len(self.rows) and self.rows[end][0] > level:
+            end += 1
+        del self.rows[position + 1:end]
+        self.rows[position][2] = False
+        return True
+
+    def line(self, position):
+        """Return (text, probability) for a row."""
+        level, item_id, expanded, cycle = self.rows[position]
+        record = self.index.nodes.get(item_id) or \
+            self.index.outcomes[item_id]
+        if level == 0:
+            marker = 'Outcome:'
+        elif cycle:
+            marker = '[cycle]'
+        elif not self.index.parents.get(item_id):
+            marker = '   '
+        else:
+            marker = '[-]' if expanded else '[+]'
+        return (f"{'  ' * level}{marker} #{item_id} {record.title}",
+                record.probability)
+
+
+class Viewer:
+    """Curses front end drawing one window of the table or tree rows."""
+
+    def __init__(self, dag):
+        self.dag = dag
+        self.mode = TREE
+        self.load()
+
+    def load(self):
+        index = self.dag.index
+        self.views = {TABLE: TableRows(index), TREE: TreeRows(index)}
+        self.cursor = {TABLE: 0, TREE: 0}
+        self.top = {TABLE: 0, TREE: 0}
+
+    @property
+    def rows(self):
+        return self.views[self.mode]
+
+    def move(self, position):
+        """Move the cursor, keeping it inside the rows."""
+        self.cursor[self.mode] = max(0, min(position, len(self.rows) - 1))
+
+    def scroll(self, height):
+        """Scroll so the cursor is inside a window of ``height`` rows."""
+        cursor, top = self.cursor[self.mode], self.top[self.mode]
+        if cursor < top:
+            top = cursor
+        elif cursor >= top + height:
+            top = cursor - height + 1
+        self.top[self.mode] = max(0, min(top, len(self.rows) - height))
+
+    def handle(self, key, height):
+        """Apply a key press. Returns False when the viewer should close."""
+        cursor = self.cursor[self.mode]
+        if key in (ord('q'), 27):
+            return False
+        if key in (curses.KEY_UP, ord('k')):
+            self.move(cursor - 1)
+        elif key in (curses.KEY_DOWN, ord('j')):
+            self.move(cursor + 1)
+        elif key == curses.KEY_PPAGE:
+            self.move(cursor - height)
+        elif key in (curses.KEY_NPAGE, ord(' ')):
+            self.move(cursor + height)
+        elif key in (curses.KEY_HOME, ord('g')):
+            self.move(0)
+        elif key in (curses.KEY_END, ord('G')):
+            self.move(len(self.rows) - 1)
+        elif key == ord('\t'):
+            self.mode = TABLE if self.mode == TREE else TREE
+        elif key == ord('r'):
+            self.dag.sync(force=True)
+            self.load()
+        elif self.mode == TREE and self.rows:
+            if key in (curses.KEY_ENTER, curses.KEY_RIGHT, 10, 13,
+                       ord('l')):
+                self.rows.expand(cursor)
+            elif key in (curses.KEY_LEFT, ord('h')):
+                if not self.rows.collapse(cursor):
+                    self.move(next(self.rows.ancestors(cursor), cursor))
+        return True
+
+    def draw(self, screen, colors):
+        height, width = screen.getmaxyx()
+        body = max(1, height - 3)
+        self.scroll(body)
+        rows, cursor, top = self.rows, self.cursor[self.mode], \
+            self.top[self.mode]
+
+        screen.erase()
+        title = (f"{rows.HEADER}  ({cursor + 1 if rows else 0}"
+                 f"/{len(rows)})")
+        screen.addnstr(0, 0, fit(title, width - 1), width - 1,
+                       curses.A_BOLD)
+        for line in range(min(body, len(rows) - top)):
+            position = top + line
+            text, probability = rows.line(position)
+            attributes = colors[risk_level(probability)]
+            if position == cursor:
+                attributes |= curses.A_REVERSE
+            screen.addnstr(line + 1, 0, fit(text, width - 1), width - 1,
+                           attributes)
+        screen.addnstr(height - 1, 0, fit(HELP, width - 1), width - 1,
+                       curses.A_DIM)
+        screen.noutrefresh()
+        curses.doupdate()
+        return body
+
+    def run(self, screen):
+        # Terminals such as xterm-color cannot hide the cursor or keep
+        # their own background colour, which is only cosmetic
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+        screen.keypad(True)
+        colors = [curses.A_NORMAL] * 3
+        if curses.has_colors():
+            try:
+                curses.use_default_colors()
+                background = -1
+            except curses.error:
+                background = curses.COLOR_BLACK
+            for level, color in enumerate((curses.COLOR_GREEN,
+                                           curses.COLOR_YELLOW,
+                                           curses.COLOR_RED), start=1):
+                curses.init_pair(level, color, background)
+                colors[level - 1] = curses.color_pair(level)
+
+        height = self.draw(screen, colors)
+        while self.handle(screen.getch(), height):
+            height = self.draw(screen, colors)
+
+
+def browse(dag):
+    """
+    Open the viewer on a DAG until the user quits.
+
+    Returns False without drawing anything when curses is unavailable or
+    the output is not a terminal, so callers can fall back to printing.
+    """
+    if curses is None:
+        return False
+    if not (sys.stdin.isatty() and sys.stdout.isatty()):
+        return False
+    # Let Escape close the viewer without the default one second wait
+    os.environ.setdefault('ESCDELAY', '25')
+    try:
+        curses.wrapper(Viewer(dag).run)
+    except curses.error:
+        return False
+    return True